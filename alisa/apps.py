@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AlisaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'alisa'
+
+    def ready(self):
+        # Подключение обработчиков сигналов
+        from alisa import signals  # noqa: F401
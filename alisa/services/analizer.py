@@ -21,38 +21,38 @@ def text_preparation(text):
     return text
 
 
-def find_matching_stop(word, anything_list, options):
+def prepare_names(anything_list, options) -> tuple:
+    """Подготовка списка сущностей к сопоставлению.
+    Возвращает имена сущностей (остановок) в преобразованном виде
+    (только буквы и цифры в нижнем регистре, ё - заменена на е)
+    и оригинальные имена: ((имя, оригинал), ...).
+    Получает список сущностей и дополнительный словарь в котором указаны
+    варианты названия некоторых  {Название: [Вариант1, Вариант2,...]}.
+    Если у сущности есть варианты - берутся они, если нет - только ее название.
+    Подготовленный список не зависит от фразы, его можно использовать повторно.
+    """
+    names = []
+    for stop in anything_list:
+        if stop in options:
+            for option in options[stop]:
+                names.append((text_preparation(option).strip(), stop))
+        else:
+            names.append((text_preparation(stop).strip(), stop))
+    return tuple(names)
+
+
+def find_matching_stop(word, names):
     """Сущность - это шаблонная фраза (название остановки, команда).
     Поиск наиболее похожего названия сущности из списка имеющихся.
-    Принимает искомое слово и список в котором будет искать. Расширительный словарь:
-    названия в основном списке как ключи в словаре из которого можно брать варианты слов
-    {Название: [Вариант1, Вариант2,...]}.
-    Ищет похожие названия из списка и расширенного списка (словаря) для некоторых.
+    Принимает искомое слово и подготовленный список сущностей (prepare_names).
     Возвращает название сущности (правильное, из основного списка) и степень его схожести)."""
     best_match = None
     best_match_ratio = 0
 
-    def name_generator(stops, options):
-        """Генератор.
-        Возвращает имена сущностей (остановок) в преобразованном виде
-        (только буквы и цифры в нижнем регистре, ё - заменена на е.
-        И оригинальные имена (кортеж).
-        Получает список сущностей и дополнительный словарь в котором указаны
-        варианты названия некоторых  {Название: [Вариант1, Вариант2,...]}.
-        Если у сущности есть варианты - возвращает их, если нет - только ее название."""
-        for stop in stops:
-            if stop in options:
-                for option in options[stop]:
-                    name = text_preparation(option)
-                    yield name, stop
-            else:
-                name = text_preparation(stop)
-                yield name, stop
-
     # Перебор всех сущностей, поиск в них похожих на искомое слов
-    stops_list = name_generator(anything_list, options)  # Получаем очередную сущность
-    for stop, original_name in stops_list:
-        similarity_ratio = SequenceMatcher(None, word.strip(), stop.strip()).ratio()  # Сравниваем
+    word = word.strip()
+    for stop, original_name in names:
+        similarity_ratio = SequenceMatcher(None, word, stop).ratio()  # Сравниваем
         # similarity_ratio = 1 - distance(word.strip(), stop.strip()) / max(len(word.strip()), len(stop.strip()))  # Сравниваем
         if similarity_ratio > best_match_ratio:
             # Выбираем лучший результат
@@ -72,6 +72,13 @@ def select_samples_by_phrase(phrase, anything_list, add_dict) -> list:
     {Название: [Вариант1, Вариант2,...]}.
     Возвращает список шаблонных фраз (оригинальных) в порядке встреченном во фразе.
     """
+    return select_samples(phrase, prepare_names(anything_list, add_dict))
+
+
+def select_samples(phrase, names) -> list:
+    """То же, что select_samples_by_phrase, но по подготовленному
+    списку сущностей (prepare_names), который строится один раз.
+    """
     # Обработка текста, получение токенов
     phrase = text_preparation(phrase)
     words_start = phrase.split()
@@ -106,7 +113,7 @@ def select_samples_by_phrase(phrase, anything_list, add_dict) -> list:
     # Очищаем найденную фразу и берем последнее слово и с него продолжаем..
     for word in words:
         # Ищем совпадающую фразу
-        matching_stops = find_matching_stop(new_phrase + ' ' + word, anything_list, add_dict)
+        matching_stops = find_matching_stop(new_phrase + ' ' + word, names)
         if matching_stops[1] < 0.5:
             # Если это слово имеет плохое совпадение с фразами, то пропускаем его
             continue
@@ -122,7 +129,7 @@ def select_samples_by_phrase(phrase, anything_list, add_dict) -> list:
             new_phrase = word
             best_result = 0
             best_stop = ''
-            matching_stops = find_matching_stop(new_phrase, anything_list, add_dict)
+            matching_stops = find_matching_stop(new_phrase, names)
             if matching_stops[1] > 0.5:
                 # Записываем только слова с хорошим совпадением
                 best_result = matching_stops[1]
@@ -17,11 +17,13 @@ import logging
 import jellyfish
 from num2words import num2words
 from rapidfuzz import process, fuzz
+from rapidfuzz.distance import JaroWinkler
 
 logger = logging.getLogger('alisa')
 
 LIMIT = 83  # Порог, при значении ниже которого новое слово для сущности бракуется
 RESOLVE = 95  # Если баллы выше или равны этому значению - сущность признается
+EPSILON = 1e-9  # Допустимое расхождение схожести, вычисленной разными библиотеками
 
 
 def text_preparation(text):
@@ -79,22 +81,44 @@ class Find:
                     new_list.add(text_preparation(item))
             self.alter_dict[word] = new_list
 
+        # Плоский список альтернативных названий в порядке перебора словаря
+        # и сущность для каждого из них
+        self.alter_names = []
+        self.entity_names = []
+        for entity_name, alter_list in self.alter_dict.items():
+            for alter_name in alter_list:
+                self.alter_names.append(alter_name)
+                self.entity_names.append(entity_name)
 
     def find_matching_entity(self, phrase: str) -> tuple:
         """
         Поиск сущности в переданной фразе.
-        Перебирает словарь списков альтернативных названий, сопоставляет с фразой.
+        Сопоставляет фразу со всеми альтернативными названиями одним вызовом rapidfuzz.
         Возвращает лучшее совпадение в виде кортежа:
         (правильное название сущности, какая альтернатива лучшая, процент совпадения)
+        Процент - целая часть схожести Джаро-Винклера. При равных процентах
+        выбирается название, последнее в порядке перебора словаря.
         """
-        entity = ('', '', 0)
-        # Перебор всех сущностей в словаре
-        for entity_name, alter_list in self.alter_dict.items():
-            for alter_name in alter_list:
+        if not self.alter_names:
+            return '', '', 0
+
+        # Все схожести по убыванию: (название, схожесть, номер в списке)
+        results = process.extract(phrase, self.alter_names, scorer=JaroWinkler.normalized_similarity, limit=None)
+
+        best_score = -1
+        best_index = -1
+        for alter_name, similarity, index in results:
+            if int((similarity + EPSILON) * 100) < best_score:
+                break  # Дальше названия только с меньшим процентом
+            score = int((similarity - EPSILON) * 100)
+            if score != int((similarity + EPSILON) * 100):
+                # Схожесть на границе процента, а rapidfuzz и jellyfish могут
+                # расходиться в последнем знаке. Процент берем точно, как раньше.
                 score = int(jellyfish.jaro_winkler_similarity(phrase, alter_name) * 100)
-                if score >= entity[2]:
-                    entity = (entity_name, alter_name, score)
-        return entity
+            if score > best_score or (score == best_score and index > best_index):
+                best_score = score
+                best_index = index
+        return self.entity_names[best_index], self.alter_names[best_index], best_score
 
 
 def select_samples_by_phrase(phrase: str, anything_list: list, add_dict: dict, threshold: int = 90) -> list:
@@ -105,8 +129,13 @@ def select_samples_by_phrase(phrase: str, anything_list: list, add_dict: dict, t
     Возвращает список шаблонных фраз (оригинальных) в порядке встреченном во фразе.
     """
     # Подготовка объекта для сопоставления
-    find = Find(anything_list, add_dict)
+    return select_samples(phrase, Find(anything_list, add_dict))
+
 
+def select_samples(phrase: str, find: Find) -> list:
+    """То же, что select_samples_by_phrase, но по готовому объекту сопоставления,
+    который строится один раз для списка сущностей.
+    """
     # Обработка текста, получение токенов
     phrase = text_preparation(phrase)
     words_start = phrase.split()
@@ -145,6 +174,7 @@ def select_samples_by_phrase(phrase: str, anything_list: list, add_dict: dict, t
     """
 
     found_entities = []  # Найденные сущности
+    matches = {}  # Результаты сопоставления строк фразы {строка: лучшее совпадение}
     pre_entities = None  # Вероятная сущность
 
     # Это текущая (предполагаемая) сущность выделенная в word
@@ -156,8 +186,12 @@ def select_samples_by_phrase(phrase: str, anything_list: list, add_dict: dict, t
     while index + count <= len(words):
         # Находим лучшее соответствие среди всех сущностей
         # (правильное название сущности, какая альтернатива лучшая, процент совпадения)
-        temp_entity = find.find_matching_entity(' '.join(words[index: index + count]))
-        print(f"Для строки |{' '.join(words[index: index + count])}| лучшее совпадение {temp_entity}")
+        # Алгоритм возвращается к уже проверенным строкам, результаты сопоставления запоминаются
+        candidate = ' '.join(words[index: index + count])
+        if candidate not in matches:
+            matches[candidate] = find.find_matching_entity(candidate)
+        temp_entity = matches[candidate]
+        print(f"Для строки |{candidate}| лучшее совпадение {temp_entity}")
         if temp_entity[2] < limit:
             # Показатель совпадения с новым словом низкий или ухудшился
             if limit >= RESOLVE:
@@ -5,9 +5,9 @@ from datetime import datetime, timedelta
 
 from django.utils import timezone
 
-from alisa.services.analizer import select_samples_by_phrase
+from alisa.services.analizer import select_samples
 from alisa.services.functions import authorize, date_now
-from schedule.models import BusStop, OptionsForStopNames
+from alisa.services.vocabulary import COMMANDS, get_vocabulary
 from schedule.services.timestamp import answer_by_two_busstop, preparing_bus_list
 
 
@@ -148,51 +148,21 @@ def answer_to_alisa(request_body, user=None):
         if not user:
             return
 
-    # Составим список остановок без повторений, в алфавитном порядке
-    stops = BusStop.get_all_bus_stops_names()
-
-    # Получаем словарь вариантов названий остановок
-    options = OptionsForStopNames.get_dict_options_name()
-
-    # Добавляем команды
-    commands = ["Что ты умеешь", "Помощь", "Дальше", "Спасибо", "Повтори"]
-    stops.extend(commands)
-    # Добавляем расширительный словарь команд
-    add_commands = {
-        "Что ты умеешь": [
-            "Что ты умеешь",
-            "Расскажи о себе",
-            "Для чего ты",
-            "Как пользоваться",
-            "Не понимаю",
-        ],
-        "Помощь": ["помощь", "помоги", "Какие есть команды", "help me"],
-        "Дальше": ["Дальше", "Следующий", "Next", "Еще", "Другой", "Позже"],
-        "Спасибо": [
-            "Спасибо",
-            "Благодарю",
-            "thank you",
-            "дзякуй",
-            "умница",
-            "молодец",
-            "хорошо",
-            "отлично",
-        ],
-        "Повтори": ["Повтори", "Скажи еще раз"],
-    }
-    options.update(add_commands)
+    # Словарь сущностей: остановки без повторений, варианты их названий и команды.
+    # Строится один раз, пока не изменятся таблицы остановок и вариантов названий.
+    vocabulary = get_vocabulary()
 
     # Получаем текст в чистом виде (цифры - словами)
     words = request_body["request"]["original_utterance"]
 
     # Анализ текста
-    out = select_samples_by_phrase(words, stops, options)
+    out = select_samples(words, vocabulary.prepared)
 
     if not out:
         return answer()
     elif len(out) == 1:
         # Это может быть команда или не понятый маршрут
-        if out[0] in commands:
+        if out[0] in COMMANDS:
             if out[0] == "Что ты умеешь":
                 return (
                     "Я подскажу вам, какие автобусы в ближайшее время идут по названному маршруту в Слуцке."
@@ -276,7 +246,7 @@ def answer_to_alisa(request_body, user=None):
 
     elif len(out) == 2:
         # 2 слова могут быть маршрутом, но если среди них есть команда - это ошибка
-        if out[0] in commands or out[1] in commands:
+        if out[0] in COMMANDS or out[1] in COMMANDS:
             return answer()
 
         # Увеличение счетчика выдачи расписаний для пользователя.
@@ -0,0 +1,85 @@
+"""
+Словарь сущностей для распознавания речи Алисы.
+
+Сущности - это названия остановок (с вариантами из таблицы OptionsForStopNames)
+и команды навыка. Словарь и подготовленные к сопоставлению названия
+строятся один раз и хранятся в памяти процесса, пока не изменятся
+таблицы остановок или вариантов названий (сброс сигналами, alisa/signals.py).
+"""
+import threading
+
+from alisa.services import analizer
+from schedule.models import BusStop, OptionsForStopNames
+
+# Команды навыка
+COMMANDS = ["Что ты умеешь", "Помощь", "Дальше", "Спасибо", "Повтори"]
+
+# Расширительный словарь команд
+ADD_COMMANDS = {
+    "Что ты умеешь": [
+        "Что ты умеешь",
+        "Расскажи о себе",
+        "Для чего ты",
+        "Как пользоваться",
+        "Не понимаю",
+    ],
+    "Помощь": ["помощь", "помоги", "Какие есть команды", "help me"],
+    "Дальше": ["Дальше", "Следующий", "Next", "Еще", "Другой", "Позже"],
+    "Спасибо": [
+        "Спасибо",
+        "Благодарю",
+        "thank you",
+        "дзякуй",
+        "умница",
+        "молодец",
+        "хорошо",
+        "отлично",
+    ],
+    "Повтори": ["Повтори", "Скажи еще раз"],
+}
+
+
+class Vocabulary:
+    """Словарь сущностей с подготовленными для сопоставления названиями."""
+
+    def __init__(self, stops: list, options: dict):
+        """
+        Args:
+            stops - названия остановок (BusStop.get_all_bus_stops_names)
+            options - варианты названий (OptionsForStopNames.get_dict_options_name)
+        """
+        self.names = stops + COMMANDS  # Все сущности
+        self.options = {**options, **ADD_COMMANDS}  # Варианты названий сущностей
+        # Подготовленные названия для analizer.select_samples
+        self.prepared = analizer.prepare_names(self.names, self.options)
+
+    @classmethod
+    def from_db(cls) -> 'Vocabulary':
+        return cls(BusStop.get_all_bus_stops_names(), OptionsForStopNames.get_dict_options_name())
+
+
+_vocabulary = None  # Текущий словарь
+_generation = 0  # Номер поколения данных, растет при каждом сбросе
+_lock = threading.Lock()
+
+
+def get_vocabulary() -> Vocabulary:
+    """Возвращает словарь сущностей, при необходимости строит его."""
+    global _vocabulary
+    vocabulary = _vocabulary
+    if vocabulary is None:
+        with _lock:
+            generation = _generation
+        vocabulary = Vocabulary.from_db()
+        with _lock:
+            if generation == _generation:
+                _vocabulary = vocabulary
+    return vocabulary
+
+
+def invalidate_vocabulary():
+    """Сбрасывает словарь. Вызывается при изменении остановок или вариантов названий."""
+    global _vocabulary, _generation
+    with _lock:
+        _generation += 1
+        _vocabulary = None
@@ -0,0 +1,25 @@
+# Сброс словаря сущностей при изменении остановок и вариантов их названий
+from django.db.models.signals import post_delete, post_save
+
+from alisa.services.vocabulary import invalidate_vocabulary
+from schedule.models import BusStop, OptionsForStopNames
+from schedule.services.data_version import in_bulk_changes, register_cache
+from schedule.signals import data_changed
+
+
+def vocabulary_changed(sender, **kwargs):
+    """Изменились названия остановок или варианты названий."""
+    if in_bulk_changes():
+        return  # Импорт: словарь сбросит новая версия данных
+    invalidate_vocabulary()
+    # Другие процессы сбросят словарь по новой версии данных
+    data_changed()
+
+
+for model in (BusStop, OptionsForStopNames):
+    post_save.connect(vocabulary_changed, sender=model, dispatch_uid=f'vocabulary_changed_save_{model.__name__}')
+    post_delete.connect(vocabulary_changed, sender=model, dispatch_uid=f'vocabulary_changed_delete_{model.__name__}')
+
+
+# Словарь сбрасывается и при смене версии данных (импорт в этом или другом процессе)
+register_cache(invalidate_vocabulary)
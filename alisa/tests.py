@@ -2,10 +2,12 @@ import os
 import time
 import shutil
 
+import jellyfish
 from django.conf import settings
 from django.test import TestCase
-from alisa.services.analizer_2 import select_samples_by_phrase
-from schedule.models import BusStop, OptionsForStopNames
+from alisa.services.analizer_2 import Find, select_samples_by_phrase
+from alisa.services.vocabulary import get_vocabulary
+from schedule.models import BusStop, DataVersion, OptionsForStopNames
 
 class AnalizerTest(TestCase):
     @classmethod
@@ -73,3 +75,42 @@ class AnalizerTest(TestCase):
                 result = select_samples_by_phrase(phrase, self.stops, self.options, threshold=50)
                 self.assertEqual(result, expected)
 
+
+
+class VocabularyTest(TestCase):
+    def test_vocabulary_cached(self):
+        """Словарь сущностей строится один раз и сбрасывается при изменении вариантов названий."""
+        vocabulary = get_vocabulary()
+        with self.assertNumQueries(0):
+            self.assertIs(get_vocabulary(), vocabulary)
+        self.assertIn("Помощь", vocabulary.names)
+
+        BusStop.objects.create(name="Тест Я", external_id="тя")
+        OptionsForStopNames.objects.create(name="Тест Я", options='["тестовая"]')
+        vocabulary = get_vocabulary()
+        self.assertIn(("тестовая", "Тест Я"), vocabulary.prepared)
+
+    def test_options_edit_publishes_version(self):
+        """Правка вариантов названий записывает версию данных - другие процессы сбросят словарь."""
+        versions = DataVersion.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            OptionsForStopNames.objects.create(name="Тест Я", options='["тестовая"]')
+        self.assertEqual(DataVersion.objects.count(), versions + 1)
+
+
+class FindTest(TestCase):
+    def test_same_as_pairwise(self):
+        """Пакетное сопоставление выбирает то же, что и попарный перебор jellyfish."""
+        find = Find(
+            ["Дом культуры", "Рынок", "Школа №8", "Зелёная", "Социалистическая"],
+            {"Школа №8": ["школа номер 8", "восьмая школа"], "Социалистическая": ["одиннадцатый городок"]},
+        )
+        for phrase in ["дом", "дом культуры", "рыно", "восьмая", "зеленая улица", "одиннадцатый", "шк"]:
+            with self.subTest(phrase=phrase):
+                expected = ('', '', 0)
+                for entity_name, alter_list in find.alter_dict.items():
+                    for alter_name in alter_list:
+                        score = int(jellyfish.jaro_winkler_similarity(phrase, alter_name) * 100)
+                        if score >= expected[2]:
+                            expected = (entity_name, alter_name, score)
+                self.assertEqual(find.find_matching_entity(phrase), expected)
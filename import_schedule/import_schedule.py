@@ -1,15 +1,15 @@
 import logging
-import hashlib
 import colorlog
 import re, os, json
-from functools import cmp_to_key
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
 from .buses_list import buses
-from utils.sorted_buses import sorted_buses, compare_name
+from utils.hashing import calculate_md5_from_dict  # noqa: F401 (используется в start_import.py)
+from utils.schedule_file import write_buses
+from utils.sorted_buses import sorted_buses
 
 # Определяем цветовую схему для разных уровней логов
 log_colors = {
@@ -156,12 +156,6 @@ def get_direction_and_bus_stop(driver):
 
     return result
 
-def calculate_md5_from_dict(data: dict) -> str:
-    """Получение хэша md5 из словаря"""
-    json_str = json.dumps(data, sort_keys=True, separators=(',', ':'))
-    return hashlib.md5(json_str.encode('utf-8')).hexdigest()
-
-
 def save_bus(schedule: dict, number: str, hash_: str, folder: str = "import_schedule/buses") -> str:
     """
     Проверяет наличие файла по шаблону {number}_{hash}.json.
@@ -190,47 +184,41 @@ def save_bus(schedule: dict, number: str, hash_: str, folder: str = "import_sche
 
 def merge_json_files(folder: str = "import_schedule/buses", output_filename: str = "result.json"):
     """
-    Объединяет все JSON-файлы из указанной папки в один словарь.
-    Каждое значение добавляется в виде элементов списка, упорядоченного по номерам.
+    Объединяет все JSON-файлы из указанной папки в один файл импорта, упорядоченный по номерам.
+    Файлы читаются по одному при записи, в памяти находится расписание одного автобуса.
+    Файл импорта с расширением .msgpack записывается в двоичном формате (utils/schedule_file.py).
     """
-    merged = {}
-    buses_present = []  # Эти автобусы обработаны
+    files = {}  # {номер автобуса: файл с расписанием}
     print("Сборка файла импорта:")
     for filename in sorted(os.listdir(folder)):
         if filename.endswith(".json") and filename != output_filename:
-            filepath = os.path.join(folder, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-
-                if not isinstance(data, dict):
-                    print(f"Файл {filename} не является словарем. Исключен.")
-                    continue  # Пропускаем невалидные файлы
-
-                number = filename.split("_")[0]  # Номер автобуса
-                # Исключаем автобус
-                if number not in buses:
-                    print(f"автобус {number} исключен")
-                    continue
-
-                buses_present.append(number)  # Добавляем автобус в список
-                # Добавляем расписание в словарь
-                merged[str(next(iter(data)))] = next(iter(data.values()))
-
-            except Exception as e:
-                print(f"Ошибка при чтении {filename}: {e}")
+            number = filename.split("_")[0]  # Номер автобуса
+            # Исключаем автобус
+            if number not in buses:
+                print(f"автобус {number} исключен")
                 continue
+            files[number] = os.path.join(folder, filename)
 
     # Сообщаем, для каких автобусов нет файлов-расписаний
-    is_absent = list(set(buses) - set(buses_present))
+    is_absent = list(set(buses) - set(files))
     is_absent = sorted_buses(is_absent)  # Сортировка названий автобусов
     if is_absent:
         print(f"Для автобусов: {', '.join(is_absent)}\nнет расписаний.")
 
-    # Упорядочим по номеру (если можно привести к int, иначе по строке)
-    sorted_merged = {k: merged[k] for k in sorted(merged, key=cmp_to_key(compare_name))}
+    def read_buses():
+        """Расписания автобусов по одному, по порядку номеров."""
+        for number in sorted_buses(files):
+            try:
+                with open(files[number], 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"Ошибка при чтении {files[number]}: {e}")
+                continue
+            if not isinstance(data, dict) or not data:
+                print(f"Файл {files[number]} не является словарем. Исключен.")
+                continue  # Пропускаем невалидные файлы
+            yield str(next(iter(data))), next(iter(data.values()))
 
-    with open(os.path.join(".", output_filename), 'w', encoding='utf-8') as f:
-        json.dump(sorted_merged, f, ensure_ascii=False, indent=4)
+    write_buses(os.path.join(".", output_filename), read_buses())
 
     print("Файл импорта собран.")
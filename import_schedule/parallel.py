@@ -0,0 +1,189 @@
+"""
+Параллельный парсинг расписания.
+
+Список автобусов делится между несколькими процессами, у каждого процесса
+свой браузер. Каждый автобус читается до тех пор, пока два прочтения подряд
+не совпадут (как в start_import.py), и сохраняется через save_bus.
+После завершения всех процессов собирается файл импорта (merge_json_files).
+
+Пул процессов и сохранение не зависят от браузера: маршруты автобуса читает
+функция, которую выдает fetcher (по умолчанию browser_fetcher). В тестах
+вместо браузера подставляется заглушка.
+
+Запуск из корня проекта:
+    python -m import_schedule.parallel                  # все автобусы из buses_list.py
+    python -m import_schedule.parallel 10 11п --workers 2
+"""
+import argparse
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
+from time import sleep, time
+from typing import Callable, ContextManager, Optional
+
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from .buses_list import buses
+from .import_schedule import calculate_md5_from_dict, get_direction_and_bus_stop, merge_json_files, save_bus
+from .logger_config import logger
+
+URL = "https://gpmopt.by/mopt/Home/Index/sluck#/routes/bus"
+FOLDER = "import_schedule/buses"
+WORKERS = 4  # Количество процессов (браузеров)
+ATTEMPTS = 5  # Сколько раз пробовать прочитать автобус
+PAUSE = 2  # Пауза (в секундах) на загрузку страницы после перехода
+READ_ERROR = "Не удалось прочитать расписание."
+
+
+def make_driver(headless: bool = True) -> webdriver.Chrome:
+    """Запуск браузера для одного процесса."""
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+    return webdriver.Chrome(options=options)
+
+
+def bus_number_from_text(text: str) -> str:
+    """Номер автобуса из текста ссылки в списке маршрутов."""
+    # Удаляем все непечатаемые символы (включая \n, \t, \xa0 и др.)
+    cleaned_text = re.sub(r"[\x00-\x1F\x7F-\xA0\u200B-\u200F\u2028-\u202F]", " ", text)
+    return cleaned_text.split()[0]
+
+
+def open_bus(driver, url: str, number: str, pause: float = PAUSE) -> bool:
+    """Открывает страницу маршрутов автобуса. Возвращает False, если автобуса нет в списке."""
+    driver.get(url)
+    WebDriverWait(driver, 10).until(
+        EC.presence_of_element_located((By.XPATH, '//*[@id="routeList"]/li[1]/a'))
+    )
+    for link in driver.find_elements(By.XPATH, '//*[@id="routeList"]/li[*]/a'):
+        if link.text.strip() and bus_number_from_text(link.text) == number:
+            WebDriverWait(driver, 5).until(EC.element_to_be_clickable(link))
+            link.click()
+            sleep(pause)
+            return True
+    return False
+
+
+@contextmanager
+def browser_fetcher(url: str = URL, headless: bool = True, pause: float = PAUSE):
+    """
+    Функция чтения маршрутов автобуса в браузере. Браузер закрывается при выходе.
+
+    Функция возвращает маршруты ({} - страница не прочиталась)
+    или None, если автобуса нет на сайте.
+    """
+    driver = make_driver(headless)
+
+    def fetch(number: str) -> Optional[dict]:
+        if not open_bus(driver, url, number, pause):
+            return None
+        return get_direction_and_bus_stop(driver) or {}
+
+    try:
+        yield fetch
+    finally:
+        driver.quit()
+
+
+def read_bus(fetch: Callable[[str], Optional[dict]], number: str, attempts: int = ATTEMPTS, pause: float = PAUSE):
+    """
+    Читает расписание автобуса, пока два прочтения подряд не совпадут.
+
+    Returns:
+        ({номер: маршруты}, хэш) или None, если прочитать не удалось
+    """
+    previous = None
+    for _ in range(attempts):
+        direction = fetch(number)
+        if direction is None:
+            logger.error(f"Автобус {number} не найден на сайте.")
+            return None
+        if not direction:
+            sleep(pause)
+            continue
+        result = {number: direction}
+        hash_ = calculate_md5_from_dict(result)
+        if hash_ == previous:
+            return result, hash_
+        if previous is not None:
+            logger.warning(f"Автобус {number}: ошибка чтения. Повтор...")
+        previous = hash_
+    return None
+
+
+def scrape_buses(numbers: list, folder: str, fetcher: Callable[[], ContextManager], pause: float = PAUSE) -> dict:
+    """
+    Парсинг списка автобусов одной функцией чтения (выполняется в процессе пула).
+
+    Returns:
+        {номер автобуса: сообщение save_bus или об ошибке}
+    """
+    results = {}
+    with fetcher() as fetch:
+        for number in numbers:
+            read = read_bus(fetch, number, pause=pause)
+            if read is None:
+                results[number] = READ_ERROR
+                logger.error(f"Автобус {number}: {results[number]}")
+                continue
+            results[number] = save_bus(read[0], number, read[1], folder)
+            logger.info(f"Автобус {number}: {results[number]}")
+    return results
+
+
+def scrape_parallel(numbers: list, workers: int = WORKERS, url: str = URL, folder: str = FOLDER,
+                    headless: bool = True, pause: float = PAUSE,
+                    fetcher: Callable[[], ContextManager] = None) -> dict:
+    """
+    Парсинг автобусов в нескольких процессах.
+    Автобусы раздаются процессам по очереди, чтобы длинные и короткие списки
+    маршрутов распределялись равномерно.
+
+    Args:
+        fetcher - выдает функцию чтения маршрутов (см. browser_fetcher), вызывается
+                  в каждом процессе; должна передаваться в процесс (pickle).
+                  По умолчанию - браузер по адресу url
+
+    Returns:
+        {номер автобуса: сообщение save_bus или об ошибке}
+    """
+    if fetcher is None:
+        fetcher = partial(browser_fetcher, url, headless, pause)
+    chunks = [numbers[i::workers] for i in range(workers) if numbers[i::workers]]
+    results = {}
+    with ProcessPoolExecutor(max_workers=len(chunks) or 1) as pool:
+        futures = {pool.submit(scrape_buses, chunk, folder, fetcher, pause): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            try:
+                results.update(future.result())
+            except Exception as e:
+                # Процесс упал (например, браузер), его автобусы остаются непрочитанными
+                logger.error(f"Ошибка процесса парсинга ({', '.join(futures[future])}): {e}")
+                results.update({number: READ_ERROR for number in futures[future]})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Параллельный парсинг расписания автобусов")
+    parser.add_argument("numbers", nargs="*", help="Номера автобусов (по умолчанию все из buses_list.py)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Количество процессов (браузеров)")
+    parser.add_argument("--show", action="store_true", help="Показывать окна браузеров")
+    args = parser.parse_args()
+
+    time_start = time()
+    logger.warning("Начало получения расписания.")
+    results = scrape_parallel(args.numbers or buses, workers=args.workers, headless=not args.show)
+    failed = [number for number, message in results.items() if message == READ_ERROR]
+    minutes, seconds = divmod(int(time() - time_start), 60)
+    logger.warning(f"Конец получения расписания. {minutes} мин {seconds} сек")
+    if failed:
+        logger.error(f"Не прочитаны автобусы: {', '.join(failed)}")
+
+    # Собираем общее расписание
+    logger.warning("Сборка полного расписания...")
+    merge_json_files(FOLDER)
@@ -0,0 +1,244 @@
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager, redirect_stdout
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import skipUnless
+from urllib.parse import parse_qs, urlparse
+
+from django.test import SimpleTestCase
+
+# Расписание тестового сайта: {номер: {маршрут: [(остановка, id, {день: [время]})]}}
+SITE = {
+    '10': {
+        'Вокзал - Рынок': [
+            ('Вокзал', '101', {'пн': ['06:00', '06:30', '07:15'], 'сб': ['08:00']}),
+            ('Школа', '102', {'пн': ['06:05', '06:35', '07:20'], 'сб': ['08:05']}),
+            ('Рынок', '103', {'пн': ['06:12', '06:42', '07:27'], 'сб': ['08:12']}),
+        ],
+        'Рынок - Вокзал': [
+            ('Рынок', '104', {'пн': ['09:00']}),
+            ('Вокзал', '105', {'пн': ['09:12']}),
+        ],
+    },
+    '11': {
+        'Школа - Рынок': [
+            ('Школа', '106', {'вс': ['10:00', '10:40']}),
+            ('Рынок', '107', {'вс': ['10:09', '10:49']}),
+        ],
+    },
+}
+DAYS = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
+
+
+def expected_routes(routes: dict) -> dict:
+    """Маршруты автобуса в том виде, в котором их сохраняет парсер."""
+    return {
+        route: {
+            f'{name}|{j:03d}': {'id': stop_id, 'schedule': {day: schedule.get(day, []) for day in DAYS}}
+            for j, (name, stop_id, schedule) in enumerate(stops)
+        }
+        for route, stops in routes.items()
+    }
+
+
+def page(content: str, script: str = '') -> bytes:
+    """Страница с той же вложенностью блоков, что на gpmopt.by
+    (парсер ищет элементы по абсолютным XPath)."""
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>'
+        '<div></div><div><div><div></div><div><div></div><div></div><div></div>'
+        f'<div><div>{content}</div></div>'
+        f'</div></div></div><script>{script}</script></body></html>'
+    ).encode('utf-8')
+
+
+def timetable(times: list) -> str:
+    """Текст таблицы расписания: строка заголовков, затем часы с минутами."""
+    hours = {}
+    for value in times:
+        hour, minute = value.split(':')
+        hours.setdefault(hour, []).append(minute)
+    return '\n'.join(['Часы Минуты'] + [f'{hour}: {" ".join(minutes)}' for hour, minutes in hours.items()])
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Статическая копия структуры страниц gpmopt.by."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if not parts:
+            # Список автобусов
+            items = ''.join(
+                f'<li><a href="/bus/{number}/">{number}\xa0{next(iter(routes))}</a></li>'
+                for number, routes in SITE.items()
+            )
+            body = page(f'<ul id="routeList">{items}</ul>')
+        elif parts[0] == 'bus':
+            # Маршруты автобуса и остановки на них
+            content = ''
+            for k, (route, stops) in enumerate(SITE[parts[1]].items()):
+                links = ''.join(
+                    f'<a href="/stop/{stop_id}/?bus={parts[1]}&route={k}&stop={j}"><h6>{name}</h6></a>'
+                    for j, (name, stop_id, _) in enumerate(stops)
+                )
+                content += f'<h4>{route}</h4><div class="list-group">{links}</div>'
+            body = page(content)
+        elif parts[0] == 'stop':
+            # Расписание остановки по дням
+            query = {key: value[0] for key, value in parse_qs(url.query).items()}
+            route = list(SITE[query['bus']].values())[int(query['route'])]
+            schedule = route[int(query['stop'])][2]
+            buttons = ''.join(
+                f'<button class="btn" onclick="show(\'{day}\')">{day}</button>' if schedule.get(day)
+                else f'<button class="btn disabled">{day}</button>'
+                for day in DAYS
+            )
+            tables = json.dumps({day: timetable(times) for day, times in schedule.items()}, ensure_ascii=False)
+            body = page(
+                f'<div></div><div><div></div><div><div>{buttons}</div></div></div>'
+                '<pre id="schedule">Часы Минуты</pre>',
+                f'var tables = {tables};'
+                'function show(day) {document.getElementById("schedule").innerText = tables[day];}',
+            )
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def site_fetcher(unstable=(), broken=()):
+    """
+    Заглушка браузера для scrape_parallel: маршруты автобусов из SITE.
+    Автобусы unstable при первом чтении приходят без остановок (страница не догрузилась),
+    на автобусах broken процесс падает.
+    """
+    reads = {}
+
+    def fetch(number):
+        if number in broken:
+            raise RuntimeError('Браузер упал')
+        if number not in SITE:
+            return None
+        reads[number] = reads.get(number, 0) + 1
+        routes = expected_routes(SITE[number])
+        if number in unstable and reads[number] == 1:
+            return {route: {} for route in routes}
+        return routes
+
+    yield fetch
+
+
+class ParallelPoolTest(SimpleTestCase):
+    """Пул процессов, сохранение и сборка файла импорта без браузера."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Модули парсера при импорте заменяют обработчики корневого логгера, возвращаем их
+        root = logging.getLogger()
+        handlers, level = root.handlers[:], root.level
+        from import_schedule import import_schedule, parallel
+        root.handlers[:] = handlers
+        root.setLevel(level)
+        cls.parser, cls.parallel = import_schedule, parallel
+
+    def test_scrape_and_merge(self):
+        """Автобусы читаются в нескольких процессах до совпадения двух прочтений,
+        сохраняются по одному и собираются в файл импорта."""
+        fetcher = partial(site_fetcher, unstable=('10',))
+        with tempfile.TemporaryDirectory() as folder:
+            with self.assertNoLogs(level='ERROR'):
+                results = self.parallel.scrape_parallel(list(SITE), workers=2, folder=folder, pause=0, fetcher=fetcher)
+            self.assertEqual(results, {number: 'Расписание сохранено.' for number in SITE})
+            for number, routes in SITE.items():
+                expected = {number: expected_routes(routes)}
+                filename = f'{number}_{self.parser.calculate_md5_from_dict(expected)}.json'
+                with open(os.path.join(folder, filename), encoding='utf-8') as file:
+                    self.assertEqual(json.load(file), expected)
+
+            # Повторный парсинг находит те же хэши и не перезаписывает файлы
+            with self.assertNoLogs(level='ERROR'):
+                results = self.parallel.scrape_parallel(list(SITE), workers=1, folder=folder, pause=0, fetcher=fetcher)
+            self.assertEqual(results, {number: 'Расписание не изменилось.' for number in SITE})
+
+            output = os.path.join(folder, 'result.json')
+            with redirect_stdout(io.StringIO()):  # Отчет о сборке
+                self.parser.merge_json_files(folder, output)
+            with open(output, encoding='utf-8') as file:
+                self.assertEqual(json.load(file), {number: expected_routes(routes) for number, routes in SITE.items()})
+
+    def test_failures(self):
+        """Автобус, которого нет на сайте, и автобусы упавшего процесса отмечаются непрочитанными,
+        остальные процессы дорабатывают."""
+        fetcher = partial(site_fetcher, broken=('11',))
+        with tempfile.TemporaryDirectory() as folder:
+            with self.assertLogs(level='ERROR') as logs:
+                results = self.parallel.scrape_parallel(['10', '11', '99'], workers=2, folder=folder,
+                                                        pause=0, fetcher=fetcher)
+            self.assertEqual(results, {
+                '10': 'Расписание сохранено.',
+                '11': self.parallel.READ_ERROR,
+                '99': self.parallel.READ_ERROR,
+            })
+            self.assertIn('Ошибка процесса парсинга (11): Браузер упал', logs.output[0])
+            [saved] = os.listdir(folder)
+            self.assertTrue(saved.startswith('10_'))
+
+
+CHROME = any(shutil.which(name) for name in ('google-chrome', 'chromium', 'chromium-browser', 'chrome'))
+
+
+@skipUnless(CHROME, 'Нет браузера Chrome')
+class ParallelScrapeTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}/#/routes/bus'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def test_scrape_and_merge(self):
+        """Автобусы парсятся в нескольких процессах, сохраняются по одному и собираются в файл импорта."""
+        # Модули парсера настраивают корневой логгер, поэтому импортируются только здесь
+        from import_schedule.import_schedule import calculate_md5_from_dict, merge_json_files
+        from import_schedule.parallel import scrape_parallel
+
+        with tempfile.TemporaryDirectory() as folder:
+            results = scrape_parallel(list(SITE), workers=2, url=self.url, folder=folder, pause=0)
+            self.assertEqual(results, {number: 'Расписание сохранено.' for number in SITE})
+            for number, routes in SITE.items():
+                expected = {number: expected_routes(routes)}
+                filename = f'{number}_{calculate_md5_from_dict(expected)}.json'
+                with open(os.path.join(folder, filename), encoding='utf-8') as file:
+                    self.assertEqual(json.load(file), expected)
+
+            # Повторный парсинг находит те же хэши и не перезаписывает файлы
+            results = scrape_parallel(list(SITE), workers=1, url=self.url, folder=folder, pause=0)
+            self.assertEqual(results, {number: 'Расписание не изменилось.' for number in SITE})
+
+            output = os.path.join(folder, 'result.json')
+            merge_json_files(folder, output)
+            with open(output, encoding='utf-8') as file:
+                merged = json.load(file)
+            self.assertEqual(merged, {number: expected_routes(routes) for number, routes in SITE.items()})
@@ -32,6 +32,9 @@ TOKEN = env('BOT_TOKEN')
 ADMINS = json.loads(env('ADMINS'))
 TELEGRAM_WEBHOOK_HOST = env('TELEGRAM_WEBHOOK_HOST')
 TELEGRAM_WEBHOOK_PATH = env('TELEGRAM_WEBHOOK_PATH', '/schedule/tbot/')
+# Обработка обновлений вебхука в рабочих потоках (0 - синхронно, в запросе вебхука)
+TELEGRAM_UPDATE_WORKERS = env.int('TELEGRAM_UPDATE_WORKERS', 4)
+TELEGRAM_UPDATE_QUEUE_SIZE = env.int('TELEGRAM_UPDATE_QUEUE_SIZE', 100)  # Емкость очереди одного потока
 OPENROUTER_API_KEY = env('OPENROUTER_API_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
@@ -64,6 +67,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'schedule.middleware.DataVersionMiddleware',  # Сброс кешей после импорта расписания
 ]
 
 ROOT_URLCONF = 'nb.urls'
@@ -99,6 +103,9 @@ DATABASES = {
     }
 }
 
+# Тесты не читают файл отправлений рабочей БД (timetable.bin)
+TEST_RUNNER = 'nb.test_runner.TestRunner'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -0,0 +1,27 @@
+"""Запуск тестов проекта."""
+import os
+import tempfile
+from unittest import mock
+
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Тесты не читают файл отправлений из корня проекта: он записан импортом
+    для рабочей БД. На время всех тестов путь к файлу - во временной папке.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        from schedule.services import timetable_file
+
+        super().setup_test_environment(**kwargs)
+        self._timetable_folder = tempfile.TemporaryDirectory()
+        self._timetable_patch = mock.patch.object(
+            timetable_file, 'TIMETABLE_FILE', os.path.join(self._timetable_folder.name, 'timetable.bin'))
+        self._timetable_patch.start()
+
+    def teardown_test_environment(self, **kwargs):
+        self._timetable_patch.stop()
+        self._timetable_folder.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -1,8 +1,11 @@
+import re
+
+from django import forms
 from django.contrib import admin
 
 from .models import (BusStop, OptionsForStopNames,
-                     Order, Router, Bus, Schedule,
-                     Holiday, StopGroup)
+                     Order, Router, Bus, Timetable, StopTimetable,
+                     Holiday, StopGroup, DataVersion)
 
 
 @admin.register(BusStop)
@@ -36,13 +39,53 @@ class BusAdmin(admin.ModelAdmin):
     list_display = ('number', 'active')
 
 
-@admin.register(Schedule)
-class ScheduleAdmin(admin.ModelAdmin):
+class TimetableForm(forms.ModelForm):
+    """Отправления редактируются текстом: время ЧЧ:ММ через пробел."""
+    departures = forms.CharField(label='Отправления', widget=forms.Textarea(attrs={'rows': 4}),
+                                 help_text='Время в формате ЧЧ:ММ через пробел')
+
+    class Meta:
+        model = Timetable
+        fields = ('bus', 'bus_stop', 'day')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial['departures'] = ' '.join(value.strftime('%H:%M') for value in self.instance.get_times())
+
+    def clean_departures(self):
+        minutes = []
+        for value in self.cleaned_data['departures'].split():
+            match = re.fullmatch(r'([01]?\d|2[0-3]):([0-5]\d)', value)
+            if not match:
+                raise forms.ValidationError(f'Неверное время {value}')
+            minutes.append(int(match[1]) * 60 + int(match[2]))
+        return minutes
+
+    def save(self, commit=True):
+        self.instance.minutes = Timetable.pack(self.cleaned_data['departures'])
+        return super().save(commit)
+
+
+@admin.register(Timetable)
+class TimetableAdmin(admin.ModelAdmin):
     """Настройки в Админке"""
-    list_display = ('bus', 'bus_stop', 'time', 'day')
+    form = TimetableForm
+    list_display = ('bus', 'bus_stop', 'day', 'departures')
     list_filter = ('bus', 'bus_stop', 'day')
-    search_fields = ('bus', 'bus_stop', 'time')
-    list_editable = ('time', 'day')
+    list_select_related = ('bus', 'bus_stop')
+
+    @admin.display(description='Отправления')
+    def departures(self, obj):
+        return ' '.join(value.strftime('%H:%M') for value in obj.get_times())
+
+
+@admin.register(StopTimetable)
+class StopTimetableAdmin(admin.ModelAdmin):
+    """Настройки в Админке"""
+    list_display = ('name', 'day')
+    list_filter = ('day',)
+    search_fields = ('name',)
 
 
 @admin.register(Holiday)
@@ -55,4 +98,10 @@ class HolidayAdmin(admin.ModelAdmin):
 @admin.register(StopGroup)
 class StopGroupAdmin(admin.ModelAdmin):
     list_display = ('id', 'list_name')
-    list_editable = ('list_name',)
\ No newline at end of file
+    list_editable = ('list_name',)
+
+
+@admin.register(DataVersion)
+class DataVersionAdmin(admin.ModelAdmin):
+    """Настройки в Админке"""
+    list_display = ('id', 'created', 'rows')
@@ -0,0 +1,218 @@
+# Команда замеряет производительность основных запросов:
+# анализ маршрутов, расписание между остановками, полное расписание остановки,
+# распознавание фраз и ответ Алисы.
+# Расписание из result.json загружается во временную БД SQLite (в памяти),
+# рабочая БД не затрагивается. Результаты сохраняются в JSON файл,
+# чтобы сравнивать их между коммитами.
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from alisa.services.analizer_2 import select_samples_by_phrase
+from alisa.services.talk_to_alisa import answer_to_alisa
+from alisa.services.vocabulary import get_vocabulary
+from schedule.models import BusStop
+from schedule.services.add_to_models import import_schedule_data
+from schedule.services.full_schedule import full_schedule
+from schedule.services.timestamp import analyze_routes, answer_by_two_busstop, route_analysis
+
+# Фразы для распознавания (кроме фраз, составленных из пар остановок)
+UTTERANCES = [
+    "Найди автобус от социалистической до мясокомбината",
+    "дом культуры до поликлиники",
+    "как доехать из одинадцатого до вокзала",
+    "как доехать в одинадцатый с вокзала",
+    "ДК одинадцатый",
+    "рынок зелёная",
+    "от исполкома на льнозавод",
+    "возле библиотеки",
+    "улица первого августа зеленхоз",
+    "алиса маршрут номер 256 улица ленина 158 на 3 автобусе дом культуры 11",
+    "Помощь",
+    "Что ты умеешь",
+]
+
+
+def stop_pairs(names: list, count: int) -> list:
+    """Постоянный для одного набора остановок список пар (отправление, прибытие)."""
+    pairs = []
+    n = len(names)
+    i = 0
+    while len(pairs) < count and n > 1 and i < count * 2:
+        start = names[(i * 7) % n]
+        finish = names[(i * 13 + 5) % n]
+        if start != finish:
+            pairs.append((start, finish))
+        i += 1
+    return pairs
+
+
+def percentile(quantiles: list, p: int) -> float:
+    """p-й процентиль из 99 точек statistics.quantiles(n=100)."""
+    return quantiles[p - 1]
+
+
+class Command(BaseCommand):
+    help = 'Замер производительности запросов на временной БД с расписанием из result.json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data', default='result.json', help='Файл с расписанием (формат result.json)')
+        parser.add_argument('--output', default='bench.json', help='Файл для результатов')
+        parser.add_argument('--pairs', type=int, default=100, help='Количество пар остановок')
+        parser.add_argument('--repeat', type=int, default=3, help='Количество повторов каждого вызова')
+        parser.add_argument('--day', type=int, default=3, help='День недели для полного расписания')
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['data']):
+            raise CommandError(f"Нет файла с расписанием {options['data']}")
+        with open(options['data'], 'r', encoding='utf-8') as file:
+            data = json.load(file)
+
+        # Временная БД (для SQLite - в памяти), настройки соединения меняются на нее
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            start = time.perf_counter()
+            with self.quiet():
+                import_schedule_data(data, verbose=False)
+            self.stdout.write(f'Расписание загружено за {time.perf_counter() - start:.1f} с')
+
+            results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': self.commit(),
+            'python': platform.python_version(),
+            'options': {key: options[key] for key in ('data', 'pairs', 'repeat', 'day')},
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=4)
+
+        for name, result in results.items():
+            if not result['calls']:
+                self.stdout.write(f"{name:26} все вызовы с ошибкой: {result['errors']}")
+                continue
+            self.stdout.write(
+                f"{name:26} p50 {result['p50_ms']:8.2f} мс  p95 {result['p95_ms']:8.2f} мс  "
+                f"p99 {result['p99_ms']:8.2f} мс  запросов {result['queries_mean']:6.1f}  "
+                f"память {result['alloc_peak_kb_p50']:8.1f} КБ  ошибок {result['errors']}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Результаты сохранены в {options['output']}"))
+
+    def run(self, options) -> dict:
+        """Замеры всех сценариев."""
+        names = sorted(set(BusStop.objects.values_list('name', flat=True)))
+        pairs = stop_pairs(names, options['pairs'])
+        utterances = UTTERANCES + [f'от {start} до {finish}' for start, finish in pairs[:20]]
+        vocabulary = get_vocabulary()
+
+        def alisa_request(text):
+            return {
+                'session': {'application': {'application_id': 'bench'}, 'new': False},
+                'request': {'original_utterance': text},
+            }
+
+        scenarios = {
+            'analyze_routes': [(analyze_routes, pair) for pair in pairs],
+            'route_analysis': [(route_analysis, pair) for pair in pairs],
+            'answer_by_two_busstop': [(answer_by_two_busstop, pair) for pair in pairs],
+            'full_schedule': [(full_schedule, (name, options['day'])) for name in names],
+            'select_samples_by_phrase': [
+                (select_samples_by_phrase, (text, vocabulary.names, vocabulary.options)) for text in utterances
+            ],
+            'answer_to_alisa': [(answer_to_alisa, (alisa_request(text),)) for text in utterances],
+        }
+        return {name: self.measure(calls, options['repeat']) for name, calls in scenarios.items()}
+
+    def measure(self, calls: list, repeat: int) -> dict:
+        """
+        Замер одного сценария.
+        Время и количество запросов к БД замеряются без tracemalloc,
+        пиковый объем выделенной памяти - отдельным проходом.
+        """
+        timings = []
+        queries = []
+        peaks = []
+        measured = []
+        with self.quiet():
+            for func, args in calls:
+                if not self.call(func, args):  # Прогрев кешей
+                    continue  # Ожидаемая ошибка (нет прямого автобуса) - считается отдельно, не замеряется
+                measured.append((func, args))
+                for _ in range(repeat):
+                    # Журнал запросов ограничен по длине, при переполнении подсчет невозможен
+                    connection.queries_log.clear()
+                    with CaptureQueriesContext(connection) as context:
+                        start = time.perf_counter()
+                        self.call(func, args)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    queries.append(len(context.captured_queries))
+
+            tracemalloc.start()
+            for func, args in measured:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                self.call(func, args)
+                peaks.append((tracemalloc.get_traced_memory()[1] - before) / 1024)
+            tracemalloc.stop()
+
+        errors = len(calls) - len(measured)
+        if not timings:
+            return {'calls': 0, 'errors': errors}
+        quantiles = statistics.quantiles(timings, n=100, method='inclusive') if len(timings) > 1 else timings * 99
+        return {
+            'calls': len(timings),
+            'errors': errors,
+            'p50_ms': round(percentile(quantiles, 50), 3),
+            'p95_ms': round(percentile(quantiles, 95), 3),
+            'p99_ms': round(percentile(quantiles, 99), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'queries_mean': round(statistics.fmean(queries), 2),
+            'queries_max': max(queries),
+            'alloc_peak_kb_p50': round(statistics.median(peaks), 1),
+            'alloc_peak_kb_max': round(max(peaks), 1),
+        }
+
+    @staticmethod
+    def call(func, args) -> bool:
+        """Вызов функции сценария. False - ожидаемая ошибка ValueError (например, нет прямого автобуса),
+        остальные исключения не перехватываются."""
+        try:
+            func(*args)
+        except ValueError:
+            return False
+        return True
+
+    @staticmethod
+    @contextlib.contextmanager
+    def quiet():
+        """Подавление отладочного вывода и логов замеряемых функций."""
+        logging.disable(logging.CRITICAL)
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                yield
+        finally:
+            logging.disable(logging.NOTSET)
+
+    @staticmethod
+    def commit() -> str:
+        """Текущий коммит, если проект в репозитории git."""
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
@@ -20,79 +20,92 @@
 }
 Этот файл должен находиться в корне проекта для выполнения этой команды.
 При экспорте данных меняется id остановок в функции merge_bus_stops.
-"""
-import os
-import json
 
-from schedule.services.add_to_models import (add_bus, add_bus_stop, add_final_stop_to_bus_stop,
-                                             add_router, add_final_stop_to_bus, add_order,
-                                             add_time_point, clear_all_tables)
+Замена расписания не прерывает работу приложения:
+данные проверяются до изменения БД, старое расписание заменяется новым в одной транзакции
+вместе с записью новой версии данных (DataVersion). Запросы видят либо старое расписание
+целиком, либо новое. Процессы приложения по смене версии сбрасывают кеши в памяти.
+Для SQLite включается журнал WAL, чтобы чтение не блокировалось на время записи.
 
+С ключом --incremental заменяются данные только тех автобусов, расписание которых
+изменилось с прошлого импорта (по хэшу расписания автобуса, см. import_changed_buses).
 
-clear_all_tables()  # Очистка всех таблиц БД (перед импортом новых данных)
-
-# Получение данных из файла
-try:
-    file_final = 'result.json'
-    if os.path.exists(file_final):
-        with open(file_final, "r") as file:
-            data = json.load(file)
-    else:
-        print('Отсутствует файл с расписанием Миноблавтотранс.')
-except:
-    print('Ошибка импорта файла с  расписанием Миноблавтотранс.')
+Файл читается потоком, по одному автобусу (utils/schedule_file.py): сначала для проверки,
+затем для записи. Кроме JSON можно импортировать компактный файл .msgpack (--file result.msgpack).
+"""
+import os
+import time
 
-# Обработка данных и заполнение БД
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from schedule.services import timetable_file
+from schedule.services.add_to_models import (check_imported_data, clear_all_tables, import_changed_buses,
+                                             import_schedule_data, validate_schedule_data)
+from schedule.services.data_version import bulk_changes, publish_data_version
+from schedule.services.full_schedule import build_stop_timetables
+from utils.schedule_file import iter_buses
 
-for bus, directions in data.items():  # Номер автобуса и названия маршрутов
-    print(bus)
-    bus_obj = add_bus(bus)  # Добавление автобуса в БД +++++++++++++++++++
-    for direction, bus_stops in directions.items():  # Название маршрута и список остановок на нем
-        if not direction:
-            # Защита от пустого маршрута (в списке попадается)
-            continue
-        print('    ', direction)
-        try:
-            bus_stop_start = next(iter(bus_stops))
-            bus_stop_end = next(reversed(bus_stops))
-            id = bus_stops[bus_stop_start]['id']  # id остановки
-            # Добавление конечной остановки в БД +++++++++++++++++++
-            bus_stop_start_obj = add_bus_stop(bus_stop_start.split('|')[0], id, True)
-            id = bus_stops[bus_stop_end]['id']  # id остановки
-            # Добавление конечной остановки в БД +++++++++++++++++++
-            bus_stop_end_obj = add_bus_stop(bus_stop_end.split('|')[0], id, True)
-        except:
-            raise
-            exit(f'Конечные остановки Автобуса {bus} в маршруте {direction} не найдены в списке.')
 
-        # Добавление конечных к автобусу +++++++++++++++++++
-        add_final_stop_to_bus(bus_obj, [bus_stop_start_obj, bus_stop_end_obj])
-        # Добавляем маршрут +++++++++++++++++++
-        router_obj = add_router(bus_stop_start_obj, bus_stop_end_obj, bus_obj)
+class Command(BaseCommand):
+    help = 'Заполняет БД расписанием из файла result.json'
 
-        for i, (bus_stop_with_key, rest) in enumerate(bus_stops.items()):  # Остановка и остальные данные (в т.ч. расписание)
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default='result.json', help='Файл с расписанием (.json или .msgpack)')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Обновить только автобусы, расписание которых изменилось')
 
-            bus_stop_name = bus_stop_with_key.split('|')[0]
+    def handle(self, *args, **options):
+        # Проверка файла до изменения БД
+        file_final = options['file']
+        if not os.path.exists(file_final):
+            raise CommandError('Отсутствует файл с расписанием Миноблавтотранс.')
+        try:
+            errors = validate_schedule_data(iter_buses(file_final))
+        except (OSError, ValueError, ImportError) as e:
+            raise CommandError(f'Ошибка импорта файла с расписанием Миноблавтотранс: {e}')
+        if errors:
+            raise CommandError('Расписание не прошло проверку, БД не изменена:\n' + '\n'.join(errors[:20]))
 
-            external_id = rest['id']  # id остановок по Миноблавтотранс
-            schedules = rest['schedule']  # Списки расписаний по дням недели
+        if connection.vendor == 'sqlite':
+            # Режим журнала сохраняется в файле БД: читатели не ждут окончания записи
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode=WAL')
 
-            bus_stop_obj = add_bus_stop(bus_stop_name, external_id)  # Добавляем остановку в БД +++++++++++++++++++
-            # Добавление конечной на которую можно попасть с этой остановки +++++++++++++++++++
-            add_final_stop_to_bus_stop(bus_stop_obj, bus_stop_end_obj, 'to')
-            # Добавление конечной с которой можно попасть на эту остановку +++++++++++++++++++
-            add_final_stop_to_bus_stop(bus_stop_obj, bus_stop_start_obj, 'from')
+        start = time.perf_counter()
+        # Очистка и заполнение в одной транзакции: до ее завершения
+        # читатели видят прежнее расписание, при ошибке оно остается.
+        # Сигналы удаляемых строк не сбрасывают кеши, их сбросит новая версия данных
+        with bulk_changes(), transaction.atomic():
+            if options['incremental']:
+                changed, removed, counts, stop_names = import_changed_buses(iter_buses(file_final))
+                if not changed and not removed:
+                    self.stdout.write(self.style.SUCCESS('Расписание не изменилось.'))
+                    return
+                self.stdout.write(f"Обновлены автобусы: {', '.join(changed) or 'нет'}. "
+                                  f"Удалены: {', '.join(removed) or 'нет'}.")
+            else:
+                clear_all_tables()  # Очистка всех таблиц БД (перед импортом новых данных)
 
-            # Добавление номера следования остановки в маршруте +++++++++++++++++++
-            add_order(router_obj, bus_stop_obj)
+                # Обработка данных и заполнение БД
+                counts = import_schedule_data(iter_buses(file_final))
+                stop_names = None  # Сообщения полного расписания для всех остановок
 
-            if i == len(bus_stops) - 1:
-                # Если это последняя остановка в маршруте, ее расписание записывать не нужно
-                # там время прибытия на остановку.
-                continue
-            for day, times in schedules.items():  # Разбираем расписания по дням недели
-                for time in times:  # Разбираем список с временными метками в виде строк
-                    add_time_point(day, time, bus_obj, bus_stop_obj)
+            errors = check_imported_data()
+            if errors:
+                # Исключение откатывает транзакцию, остается прежнее расписание
+                raise CommandError('Записанные данные не прошли проверку, БД не изменена:\n' + '\n'.join(errors))
+            # Сообщения полного расписания остановок меняются вместе с расписанием
+            # (при инкрементальном импорте - только для остановок изменившихся автобусов)
+            counts['stop_timetable'] = build_stop_timetables(stop_names)
+            version = publish_data_version(sum(counts.values()))
+        duration = time.perf_counter() - start
+        rows = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Записано строк: {rows} ({', '.join(f'{k}: {v}' for k, v in counts.items())}) "
+            f"за {duration:.1f} с, {rows / duration:.0f} строк/с. Версия данных {version.id}"
+        ))
 
-exit()
+        # Файл отправлений для процессов веб-сервера (отображается в память)
+        timetable_file.save_timetable_file()
+        self.stdout.write(f'Файл отправлений записан: {timetable_file.TIMETABLE_FILE}')
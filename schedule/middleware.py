@@ -0,0 +1,13 @@
+from schedule.services.data_version import check_data_version
+
+
+class DataVersionMiddleware:
+    """Перед обработкой запроса проверяет, не изменилась ли версия данных расписания
+    (импорт в другом процессе). Если изменилась - кеши в памяти процесса сбрасываются."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        check_data_version()
+        return self.get_response(request)
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:08
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_departures(apps, schema_editor):
+    """Повторы отправлений (импорт из файла с повторами) удаляются до ограничения уникальности."""
+    Schedule = apps.get_model('schedule', 'Schedule')
+    first = Schedule.objects.values('bus_stop', 'bus', 'day', 'time').annotate(first=Min('id')).values('first')
+    Schedule.objects.exclude(id__in=first).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0006_alter_stopgroup_options_alter_busstop_con_to_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='stopgroup',
+            options={'verbose_name': 'Группа остановок', 'verbose_name_plural': 'Группы остановок'},
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['bus_stop', 'day', 'time', 'bus'], name='schedule_stop_day_time_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(fields=('router', 'order_number'), name='order_router_number_unique'),
+        ),
+        migrations.RunPython(remove_duplicate_departures, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='schedule',
+            constraint=models.UniqueConstraint(fields=('bus_stop', 'bus', 'day', 'time'), name='schedule_departure_unique'),
+        ),
+    ]
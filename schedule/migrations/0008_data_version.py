@@ -0,0 +1,25 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0007_schedule_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Дата импорта')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='Записано строк')),
+            ],
+            options={
+                'verbose_name': 'Версия расписания',
+                'verbose_name_plural': 'Версии расписания',
+            },
+        ),
+    ]
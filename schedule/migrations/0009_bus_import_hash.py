@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0008_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='import_hash',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='Хэш расписания'),
+        ),
+    ]
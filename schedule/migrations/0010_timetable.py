@@ -0,0 +1,73 @@
+import sys
+from array import array
+from datetime import time
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def pack(minutes) -> bytes:
+    """Упаковка отправлений, как Timetable.pack (модели миграций не имеют методов)."""
+    marks = array('H', sorted(set(minutes)))
+    if sys.byteorder == 'big':
+        marks.byteswap()
+    return marks.tobytes()
+
+
+def schedule_to_timetable(apps, schema_editor):
+    """Отправления из Schedule (запись на отправление) в Timetable (запись на автобус, остановку и день)."""
+    Schedule = apps.get_model('schedule', 'Schedule')
+    Timetable = apps.get_model('schedule', 'Timetable')
+    departures = {}
+    for stop_id, bus_id, day, value in Schedule.objects.values_list('bus_stop_id', 'bus_id', 'day', 'time').iterator():
+        departures.setdefault((stop_id, bus_id, day), []).append(value.hour * 60 + value.minute)
+    Timetable.objects.bulk_create(
+        [Timetable(bus_stop_id=stop_id, bus_id=bus_id, day=day, minutes=pack(minutes))
+         for (stop_id, bus_id, day), minutes in departures.items()],
+        batch_size=5000,
+    )
+
+
+def timetable_to_schedule(apps, schema_editor):
+    """Обратное преобразование: каждое отправление в отдельную запись Schedule."""
+    Schedule = apps.get_model('schedule', 'Schedule')
+    Timetable = apps.get_model('schedule', 'Timetable')
+    rows = []
+    for stop_id, bus_id, day, data in Timetable.objects.values_list('bus_stop_id', 'bus_id', 'day', 'minutes'):
+        marks = array('H')
+        marks.frombytes(data)
+        if sys.byteorder == 'big':
+            marks.byteswap()
+        rows += [Schedule(bus_stop_id=stop_id, bus_id=bus_id, day=day, time=time(minute // 60, minute % 60))
+                 for minute in marks]
+    Schedule.objects.bulk_create(rows, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0009_bus_import_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Timetable',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.IntegerField(default=1, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(7)], verbose_name='День недели')),
+                ('minutes', models.BinaryField(verbose_name='Отправления')),
+                ('bus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timetables_for_bus', to='schedule.bus', verbose_name='Автобус')),
+                ('bus_stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timetables_for_bus_stop', to='schedule.busstop', verbose_name='Остановка')),
+            ],
+            options={
+                'verbose_name': 'Расписание',
+                'verbose_name_plural': 'Расписания',
+                'constraints': [models.UniqueConstraint(fields=('bus_stop', 'bus', 'day'), name='timetable_stop_bus_day_unique')],
+            },
+        ),
+        migrations.RunPython(schedule_to_timetable, timetable_to_schedule),
+        migrations.DeleteModel(
+            name='Schedule',
+        ),
+    ]
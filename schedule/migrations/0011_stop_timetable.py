@@ -0,0 +1,31 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:43
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0010_timetable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StopTimetable',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Остановка')),
+                ('day', models.IntegerField(default=1, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(7)], verbose_name='День недели')),
+                ('chunks', models.JSONField(default=list, verbose_name='Сообщения')),
+            ],
+            options={
+                'verbose_name': 'Полное расписание остановки',
+                'verbose_name_plural': 'Полные расписания остановок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stoptimetable',
+            constraint=models.UniqueConstraint(fields=('name', 'day'), name='stoptimetable_name_day_unique'),
+        ),
+    ]
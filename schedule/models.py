@@ -11,6 +11,7 @@ Bus - автобусы (номера)
     1. number - цифро-буквенное обозначение
     2. station - связь многие-ко-многим c остановками на которых автобус может начинать и заканчивать движение
     3. active - работает ли автобус True/False
+    4. import_hash - хэш расписания автобуса при последнем импорте
 
 Router - маршруты следования автобусов. Название маршрута складывается из начальной и конечно остановок через тире.
     1. start - начало маршрута. Один-к-одному
@@ -22,24 +23,30 @@ Order - порядок остановок в маршруте
     2. router - маршрут много-к-одному
     3. bus_stop - остановка много-к-одному
 
-Schedule - расписание
+Timetable - расписание, одна запись на автобус, остановку и день недели
     1. day - день недели (1-7)
     2. bus_stop - связь много-к-одному с автобусной остановкой
     3. bus - связь много-к-одному с автобусом
-    4. time - время. Значение в формате Time H:M.
+    4. minutes - упакованные отправления: минуты от полуночи по возрастанию, 2 байта на отправление.
+
+StopTimetable - полное расписание остановки на день (заполняется при импорте)
+    1. name - название остановки
+    2. day - день недели (1-7)
+    3. chunks - сообщения Телеграмм с расписанием (Markdown)
 
 """
 import json
+import sys
 import itertools
-from typing import Dict
+from array import array
+from typing import Dict, Iterable
 from django.db import models
-from functools import cmp_to_key
-from datetime import datetime
+from datetime import datetime, time
 from typing import List
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator, MaxValueValidator
 
-from utils.sorted_buses import compare_name
+from utils.sorted_buses import bus_sort_key
 from utils.translation import get_day_string
 from tbot.services.functions import date_now
 
@@ -86,10 +93,7 @@ class BusStop(models.Model):
 
         orders = Order.objects.filter(bus_stop__in=start_objects)
         buses = {order.router.bus for order in orders}
-        buses = sorted(
-            buses,
-            key=cmp_to_key(lambda bus1, bus2: compare_name(bus1.number, bus2.number))
-        )
+        buses = sorted(buses, key=lambda bus: bus.sort_key)
         return buses
 
     @staticmethod
@@ -138,6 +142,9 @@ class Bus(models.Model):
     station = models.ManyToManyField(BusStop, verbose_name='Конечные остановки автобуса',
                                      related_name='buses')
     active = models.BooleanField(verbose_name='Автобус ходит', default=True)
+    # Хэш расписания автобуса при последнем импорте. Совпадает с хэшем в имени файла
+    # import_schedule/buses/{номер}_{хэш}.json, по нему импорт находит изменившиеся автобусы
+    import_hash = models.CharField(verbose_name='Хэш расписания', max_length=32, blank=True, default='')
 
     @staticmethod
     def get_buses(only_active=True):
@@ -149,6 +156,11 @@ class Bus(models.Model):
         else:
             return Bus.objects.all().values_list('number', flat=True)
 
+    @property
+    def sort_key(self) -> tuple:
+        """Ключ сортировки автобусов по номеру (10, 10а, 11 ...)."""
+        return bus_sort_key(self.number)
+
     def __str__(self):
         return str(f'Автобус №{self.number}')
 
@@ -205,25 +217,80 @@ class Order(models.Model):
     class Meta:
         verbose_name = 'Остановка по порядку'
         verbose_name_plural = 'Остановки по порядку'
+        constraints = [
+            # Номер остановки в маршруте не повторяется,
+            # индекс служит для выборки остановок маршрута по порядку
+            models.UniqueConstraint(fields=['router', 'order_number'], name='order_router_number_unique'),
+        ]
 
 
-class Schedule(models.Model):
-    """Расписание. Временные метки"""
+class Timetable(models.Model):
+    """Расписание. Отправления автобуса с остановки за день недели в одной записи"""
     day = models.IntegerField(verbose_name='День недели',
                               validators=[MinValueValidator(1), MaxValueValidator(7)], default=1)
-    bus_stop = models.ForeignKey(BusStop, verbose_name='Остановка', related_name='time_for_bus_stop',
+    bus_stop = models.ForeignKey(BusStop, verbose_name='Остановка', related_name='timetables_for_bus_stop',
                                  on_delete=models.CASCADE, null=False, blank=False)
-    bus = models.ForeignKey(Bus, verbose_name='Автобус', related_name='time_for_bus',
+    bus = models.ForeignKey(Bus, verbose_name='Автобус', related_name='timetables_for_bus',
                             on_delete=models.CASCADE, null=False, blank=False)
-    time = models.TimeField(verbose_name='Время')
+    minutes = models.BinaryField(verbose_name='Отправления')
+
+    @staticmethod
+    def pack(minutes: Iterable[int]) -> bytes:
+        """Упаковка отправлений (минут от полуночи): по возрастанию, без повторов,
+        по 2 байта (little-endian) на отправление."""
+        marks = array('H', sorted(set(minutes)))
+        if sys.byteorder == 'big':
+            marks.byteswap()
+        return marks.tobytes()
+
+    @staticmethod
+    def unpack(data: bytes) -> array:
+        """Отправления из упакованного вида: array('H') минут от полуночи по возрастанию."""
+        marks = array('H')
+        marks.frombytes(data)
+        if sys.byteorder == 'big':
+            marks.byteswap()
+        return marks
+
+    def get_minutes(self) -> array:
+        """Отправления в минутах от полуночи."""
+        return self.unpack(self.minutes)
+
+    def get_times(self) -> List[time]:
+        """Отправления в виде списка времени."""
+        return [time(minute // 60, minute % 60) for minute in self.get_minutes()]
 
     def __str__(self):
-        return str(f"{get_day_string(self.day)} {self.time.strftime('%H:%M')} "
-                   f"автобус {self.bus.number} на остановке {self.bus_stop.name}")
+        return str(f"{get_day_string(self.day)} автобус {self.bus.number} на остановке {self.bus_stop.name}: "
+                   f"{' '.join(value.strftime('%H:%M') for value in self.get_times())}")
 
     class Meta:
-        verbose_name = 'Время'
-        verbose_name_plural = 'Время'
+        verbose_name = 'Расписание'
+        verbose_name_plural = 'Расписания'
+        constraints = [
+            # Одна запись на автобус, остановку и день недели.
+            # Индекс служит и для выборки расписания остановки на день (full_schedule)
+            models.UniqueConstraint(fields=['bus_stop', 'bus', 'day'], name='timetable_stop_bus_day_unique'),
+        ]
+
+
+class StopTimetable(models.Model):
+    """Полное расписание остановки на день, подготовленное при импорте:
+    сообщения Телеграмм (Markdown) для всех одноименных остановок (schedule/services/full_schedule.py)."""
+    name = models.CharField(verbose_name='Остановка', max_length=100)
+    day = models.IntegerField(verbose_name='День недели',
+                              validators=[MinValueValidator(1), MaxValueValidator(7)], default=1)
+    chunks = models.JSONField(verbose_name='Сообщения', default=list)
+
+    def __str__(self):
+        return str(f"{get_day_string(self.day)} {self.name}")
+
+    class Meta:
+        verbose_name = 'Полное расписание остановки'
+        verbose_name_plural = 'Полные расписания остановок'
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'day'], name='stoptimetable_name_day_unique'),
+        ]
 
 
 class Holiday(models.Model):
@@ -266,6 +333,11 @@ class StopGroup(models.Model):
 
     list_name = models.CharField('Остановки', max_length=300)
 
+    # Кеш обратного индекса групп в памяти процесса.
+    # Сбрасывается сигналами post_save/post_delete (schedule/signals.py).
+    _index = None
+    _index_generation = 0  # Растет при каждом сбросе
+
     class Meta:
         verbose_name = 'Группа остановок'
         verbose_name_plural = 'Группы остановок'
@@ -297,32 +369,71 @@ class StopGroup(models.Model):
 
             Если название остановок совпадает - Возврашает пустой словарь
         """
-        if start_name == finish_name:
-            raise ValueError("Одноименные остановки отправления и прибытия")
-        
-        all_groups = StopGroup.objects.all()  # Получаем все группы остановок
-        start_stops_set = set()  # Список для накопления названий остановок отправления
-        finish_stops_set = set()  # Список для накопления названий остановок прибытия
-        for group in all_groups:
-            try:
-                # Загружаем список названий из JSON-поля
-                stop_names_in_group = json.loads(group.list_name)
-                if not isinstance(stop_names_in_group, list):
-                    continue  # Пропускаем, если формат не является списком
+        # Обратный индекс всех групп остановок
+        return StopGroup.resolve_group(StopGroup.get_index(), start_name, finish_name)
+
+    @classmethod
+    def get_index(cls) -> Dict[str, frozenset]:
+        """
+        Возвращает обратный индекс групп (см. build_index).
+        Индекс строится при первом обращении и хранится до изменения групп.
+        """
+        index = cls._index
+        if index is None:
+            generation = cls._index_generation
+            index = cls.build_index(cls.objects.values_list('list_name', flat=True))
+            if generation == cls._index_generation:
+                # Группы не менялись, пока строился индекс
+                cls._index = index
+        return index
+
+    @classmethod
+    def invalidate_index(cls):
+        """Сбрасывает кеш индекса групп."""
+        cls._index_generation += 1
+        cls._index = None
 
-                # Проверяем вхождение названия в группу
-                if start_name in stop_names_in_group:
-                    for name in stop_names_in_group:
-                        start_stops_set.add(name)
+    @staticmethod
+    def build_index(list_names) -> Dict[str, frozenset]:
+        """
+        Строит обратный индекс групп: название остановки -> все названия
+        из групп, в которые она входит (включая ее саму).
 
-                # Проверяем вхождение названия в группу
-                if finish_name in stop_names_in_group:
-                    for name in stop_names_in_group:
-                        finish_stops_set.add(name)
+        Args:
+            list_names - значения поля list_name (JSON-списки названий)
 
+        Returns:
+            {название: frozenset(названия из групп с этой остановкой)}
+        """
+        index = {}
+        for list_name in list_names:
+            try:
+                # Загружаем список названий из JSON-поля
+                stop_names_in_group = json.loads(list_name)
             except json.JSONDecodeError:
                 # Пропускаем группы с некорректным JSON
                 continue
+            if not isinstance(stop_names_in_group, list):
+                continue  # Пропускаем, если формат не является списком
+
+            for name in stop_names_in_group:
+                index.setdefault(name, set()).update(stop_names_in_group)
+
+        return {name: frozenset(names) for name, names in index.items()}
+
+    @staticmethod
+    def resolve_group(index: Dict[str, frozenset], start_name: str,
+                      finish_name: str = None) -> Dict[str, List[str]]:
+        """
+        Формирует списки остановок отправления и прибытия по обратному индексу групп.
+        Логика и формат ответа описаны в get_group_by_stop_name.
+        """
+        if start_name == finish_name:
+            raise ValueError("Одноименные остановки отправления и прибытия")
+
+        # Названия остановок из групп отправления и прибытия
+        start_stops_set = set(index.get(start_name, ()))
+        finish_stops_set = set(index.get(finish_name, ()))
 
         if finish_name and (start_name in finish_stops_set) or (finish_name in start_stops_set):
             start_stops_set.clear()
@@ -333,3 +444,18 @@ class StopGroup(models.Model):
             "finish_names": [finish_name] + list(finish_stops_set - {finish_name})
         }
 
+
+class DataVersion(models.Model):
+    """Версии данных расписания.
+    Каждый импорт добавляет запись в той же транзакции, что и само расписание.
+    Номер версии (id последней записи) проверяют процессы приложения,
+    чтобы сбросить кеши в памяти после импорта (schedule/services/data_version.py)."""
+    created = models.DateTimeField(verbose_name='Дата импорта', auto_now_add=True)
+    rows = models.PositiveIntegerField(verbose_name='Записано строк', default=0)
+
+    def __str__(self):
+        return str(f'Версия {self.id} от {self.created:%d.%m.%Y %H:%M}')
+
+    class Meta:
+        verbose_name = 'Версия расписания'
+        verbose_name_plural = 'Версии расписания'
@@ -1,115 +1,413 @@
 # Функции добавления данных в БД
+import re
 from datetime import datetime
 
-from schedule.models import BusStop, Bus, Router, Order, Schedule
+from django.db import transaction
+from django.db.models import Count
 
-from utils.translation import get_day_number
+from schedule.models import BusStop, Bus, Router, Order, Timetable
+from schedule.services.data_version import invalidate_caches
 
+from utils.hashing import calculate_md5_from_dict
+from utils.translation import get_day_number, get_day_string
 
-def add_bus(number: str, station: BusStop = None, active=None):
-    """Добавление или изменение автобуса.
-    Принимает Номер, останову (объект), Активность.
-    Обновится активность (ходит ли автобус), если она специально передана.
-    Если нет автобус добавится, остановка добавится или не изменится.
-    Возвращает объект.
+
+def clear_all_tables():
+    """Очистка всех таблиц расписания автобусов в БД."""
+    # Сначала удаляем объекты из таблиц, которые не имеют внешних ссылок
+    Timetable.objects.all().delete()
+    Order.objects.all().delete()
+    # Затем удаляем объекты из таблиц, которые могут иметь внешние ссылки
+    Router.objects.all().delete()
+    Bus.objects.all().delete()
+    BusStop.objects.all().delete()
+
+    print('Все таблицы расписания автобусов очищены.')
+
+
+def bus_items(data):
+    """Автобусы расписания парами (номер, маршруты).
+    Расписание - словарь в формате файла result.json или поток таких пар
+    (utils.schedule_file.iter_buses), который читается по одному автобусу.
     """
-    defaults = dict()
-    if active is not None:
-        defaults['active'] = active
-    bus = Bus.objects.update_or_create(number=number, defaults=defaults)
-    if station:
-        bus[0].station.add(station)
-    return bus[0]
-
-
-def add_final_stop_to_bus(bus: Bus, stations: list):
-    """Добавление конечных остановок к автобусу.
-    Каждая автобус имеет список конечных, на которых он начинает и заканчивает движение.
-    Этот список пополняет эта функция.
-    Принимает Автобус и список конечных остановок.
+    return data.items() if isinstance(data, dict) else data
+
+
+def validate_schedule_data(data) -> list:
+    """Проверка расписания в формате файла result.json перед импортом.
+    Принимает словарь или поток пар (номер, маршруты), см. bus_items.
+    Возвращает список найденных ошибок (пустой, если данные можно импортировать).
     """
-    for station in stations:
-        add_bus(bus.number, station)
+    days = [get_day_string(day) for day in range(1, 8)]
+    time_format = re.compile(r'^([01]?\d|2[0-3]):[0-5]\d$')
+    max_id = BusStop._meta.get_field('external_id').max_length
+    errors = []
 
+    bus_count = 0
+    time_points = 0
+    for bus, directions in bus_items(data):
+        bus_count += 1
+        if not bus or not isinstance(directions, dict):
+            errors.append(f'Автобус "{bus}": нет маршрутов.')
+            continue
+        for direction, stops in directions.items():
+            if not direction:
+                continue  # Пустой маршрут пропускается при импорте
+            where = f'Автобус {bus}, маршрут "{direction}"'
+            if not isinstance(stops, dict) or len(stops) < 2:
+                errors.append(f'{where}: меньше двух остановок.')
+                continue
+            for name, rest in stops.items():
+                external_id = rest.get('id') if isinstance(rest, dict) else None
+                if not isinstance(external_id, str) or not external_id or len(external_id) > max_id:
+                    errors.append(f'{where}, остановка "{name}": неверный id {external_id!r}.')
+                    continue
+                schedule = rest.get('schedule')
+                if not isinstance(schedule, dict):
+                    errors.append(f'{where}, остановка "{name}": нет расписания.')
+                    continue
+                for day, day_times in schedule.items():
+                    if not isinstance(day, str) or day.lower() not in days:
+                        errors.append(f'{where}, остановка "{name}": неизвестный день "{day}".')
+                        continue
+                    if not isinstance(day_times, list):
+                        errors.append(f'{where}, остановка "{name}": расписание на "{day}" не список.')
+                        continue
+                    wrong = [time for time in day_times if not isinstance(time, str) or not time_format.match(time)]
+                    if wrong:
+                        errors.append(f'{where}, остановка "{name}": неверное время {wrong[:3]}.')
+                    time_points += len(day_times)
 
-def add_bus_stop(name: str, external_id: str, finish: bool = False):
-    """Добавление автобусной остановки.
-    Принимает Название, id, Конечная ли она - по умолчанию не конечная.
-    Значение конечности может поменяться только на True. В другом случае оно не исправляется.
-    Добавляет остановку, если ее еще нет (с таким id) или обновляет.
-    Возвращает объект.
+    if not bus_count:
+        return ['Нет ни одного автобуса.']
+    if not errors and not time_points:
+        errors.append('В расписании нет ни одной временной метки.')
+    return errors
+
+
+def check_imported_data() -> list:
+    """Проверка данных, записанных в БД импортом (до фиксации транзакции).
+    Возвращает список найденных ошибок (пустой, если данные можно принять).
     """
-    # Даем одно название 2 остановкам (это когда объединяем остановки
-    # Например Автовокзал и Автовокзал *
-    # Остановки объединяются так-же по id в функции merge_bus_stops из модуля import
-    # names = {'Автовокзал': ['Автовокзал', 'Автовокзал *']}
-    # for n in names.keys():
-    #     if name in names[n]:
-    #         name = n
-    # закомментировал по причине что для 6 на Автовокзале ставилось расписание остановки в обратную сторону.
-
-    # Переименовал остановку для ясности
-    name = name.replace("*", "кольцо")
-    # names = {'Автовокзал кольцо': ['Автовокзал *']}
-    # for n in names.keys():
-    #     if name in names[n]:
-    #         name = n
-
-    defaults = {'name': name}
-    if finish:
-        defaults['finish'] = finish
-    return BusStop.objects.update_or_create(external_id=external_id, defaults=defaults)[0]
-
-
-def add_final_stop_to_bus_stop(bus_stop: BusStop, station: BusStop, direction: str):
-    """Добавление конечных остановок к остановкам.
-    Каждая остановка имеет список конечных, к которым она ведет.
-    И список конечных, которые ведут к ней.
-    Эти списки пополняет эта функция.
-    Принимает Остановку, конечную остановку и направление в виде строки:
-    to - к каким конечным, from - от каких конечных.
+    errors = []
+    for model in (BusStop, Bus, Router, Timetable):
+        if not model.objects.exists():
+            errors.append(f'Таблица {model._meta.verbose_name_plural} пуста.')
+    short = Router.objects.annotate(stops=Count('orders_for_router')).filter(stops__lt=2).count()
+    if short:
+        errors.append(f'Маршрутов с количеством остановок меньше двух: {short}.')
+    return errors
+
+
+def collect_schedule_data(data: dict, verbose: bool = True) -> dict:
+    """Разбор расписания в формате файла result.json в памяти.
+    Остановки, автобусы, маршруты и их связи собираются по тем же правилам,
+    что и функции add_* выше (порядок создания, а значит и id, совпадает с поочередным добавлением).
+    Объекты моделей не сохраняются.
+
+    verbose - печатать ли номера автобусов и маршрутов по ходу разбора.
+    Возвращает словарь:
+        bus_stops - {external_id: BusStop} в порядке первого появления
+        buses - {номер: Bus}, у автобуса заполнен хэш расписания
+        bus_stations - {номер автобуса: {external_id конечных}}
+        routers - [(Router, номер автобуса, external_id начала, external_id конца, [external_id остановок])]
+        time_points - [(номер автобуса, external_id остановки, день, минуты от полуночи)]
     """
-    if direction == 'to':
-        bus_stop.con_to.add(station)
-    else:
-        bus_stop.con_from.add(station)
+    bus_stops = {}  # {external_id: BusStop} в порядке первого появления
+    buses = {}  # {номер: Bus}
+    bus_stations = {}  # {номер автобуса: {external_id конечных}}
+    routers = []  # [(Router, номер автобуса, external_id начала, external_id конца, [external_id остановок])]
+    time_points = []  # [(номер автобуса, external_id остановки, день, минуты от полуночи)]
+    times = {}  # Кеш разобранных временных меток {строка: минуты от полуночи}
+
+    def bus_stop(name: str, external_id: str, finish: bool = False) -> str:
+        """Остановка в памяти: добавляется, если ее еще нет, или обновляется.
+        Признак конечной может только установиться. Возвращает external_id."""
+        name = name.replace("*", "кольцо")
+        if external_id not in bus_stops:
+            bus_stops[external_id] = BusStop(name=name, external_id=external_id)
+        stop = bus_stops[external_id]
+        stop.name = name
+        if finish:
+            stop.finish = finish
+        return external_id
+
+    for bus, directions in data.items():  # Номер автобуса и названия маршрутов
+        if verbose:
+            print(bus)
+        buses.setdefault(bus, Bus(number=bus, import_hash=calculate_md5_from_dict({bus: directions})))
+        stations = bus_stations.setdefault(bus, {})
+        for direction, stops in directions.items():  # Название маршрута и список остановок на нем
+            if not direction:
+                # Защита от пустого маршрута (в списке попадается)
+                continue
+            if verbose:
+                print('    ', direction)
+            bus_stop_start = next(iter(stops))
+            bus_stop_end = next(reversed(stops))
+            # Конечные остановки
+            start_id = bus_stop(bus_stop_start.split('|')[0], stops[bus_stop_start]['id'], True)
+            end_id = bus_stop(bus_stop_end.split('|')[0], stops[bus_stop_end]['id'], True)
+            # Конечные автобуса
+            stations[start_id] = None
+            stations[end_id] = None
+
+            order = []  # Остановки маршрута по порядку
+            for i, (bus_stop_with_key, rest) in enumerate(stops.items()):  # Остановка и остальные данные
+                stop_id = bus_stop(bus_stop_with_key.split('|')[0], rest['id'])
+                order.append(stop_id)
 
+                if i == len(stops) - 1:
+                    # Если это последняя остановка в маршруте, ее расписание записывать не нужно
+                    # там время прибытия на остановку.
+                    continue
+                for day, day_times in rest['schedule'].items():  # Разбираем расписания по дням недели
+                    day_number = get_day_number(day)
+                    for time in day_times:  # Разбираем список с временными метками в виде строк
+                        if time not in times:
+                            value = datetime.strptime(time, "%H:%M").time()
+                            times[time] = value.hour * 60 + value.minute
+                        time_points.append((bus, stop_id, day_number, times[time]))
 
-def add_router(start: BusStop, end: BusStop, bus: Bus):
-    """Добавление маршрута.
-    Принимает Остановку начала маршрута, Остановку конца маршрута и Автобус.
-    Возвращает объект.
+            routers.append((Router(), bus, start_id, end_id, order))
+
+    return {
+        'bus_stops': bus_stops,
+        'buses': buses,
+        'bus_stations': bus_stations,
+        'routers': routers,
+        'time_points': time_points,
+    }
+
+
+def write_routes(plan: dict, counts: dict, batch_size: int = 5000):
+    """Запись конечных автобусов, маршрутов и порядка остановок
+    из результата collect_schedule_data. Остановки и автобусы плана должны быть уже сохранены.
+    Количество записанных строк прибавляется к counts.
     """
-    return Router.objects.create(start=start, end=end, bus=bus)
+    bus_stops, buses = plan['bus_stops'], plan['buses']
+    station_links = [
+        Bus.station.through(bus_id=buses[bus].id, busstop_id=bus_stops[external_id].id)
+        for bus, ids in plan['bus_stations'].items() for external_id in ids
+    ]
+    Bus.station.through.objects.bulk_create(station_links, batch_size=batch_size, ignore_conflicts=True)
+    counts['bus_station'] = counts.get('bus_station', 0) + len(station_links)
+
+    routers = plan['routers']
+    for router, bus, start_id, end_id, _ in routers:
+        router.bus = buses[bus]
+        router.start = bus_stops[start_id]
+        router.end = bus_stops[end_id]
+    Router.objects.bulk_create([router for router, *_ in routers], batch_size=batch_size)
+    counts['router'] = counts.get('router', 0) + len(routers)
 
+    orders = [
+        Order(router=router, bus_stop=bus_stops[stop_id], order_number=number)
+        for router, _, _, _, order in routers
+        for number, stop_id in enumerate(order, start=1)
+    ]
+    Order.objects.bulk_create(orders, batch_size=batch_size)
+    counts['order'] = counts.get('order', 0) + len(orders)
 
-def add_order(router: Router, bus_stop: BusStop):
-    """Добавление порядка остановок в маршруте.
-    Принимает маршрут, остановку.
-    Сама добавляет порядковый номер, в зависимости от порядка создания объектов.
-    Возвращает объект.
+
+def timetable_rows(plan: dict) -> dict:
+    """Расписания из результата collect_schedule_data: отправления собираются
+    по автобусу, остановке и дню недели и упаковываются (Timetable.pack, повторы пропускаются).
+    Остановки и автобусы плана должны быть уже сохранены.
+    Возвращает {(id остановки, id автобуса, день): упакованные минуты} в порядке первого появления.
     """
-    return Order.objects.create(router=router, bus_stop=bus_stop)
+    bus_stops, buses = plan['bus_stops'], plan['buses']
+    rows = {}
+    for bus, stop_id, day, minute in plan['time_points']:
+        rows.setdefault((bus_stops[stop_id].id, buses[bus].id, day), []).append(minute)
+    return {key: Timetable.pack(minutes) for key, minutes in rows.items()}
 
 
-def add_time_point(day: str, time: str, bus: Bus, bus_stop: BusStop):
-    """Добавление временной метки в таблицу.
-    Таблица хранит День недели (1-7), Временную метку, Автобус и Остановку.
-    Принимает Сокращенное название дня недели, Временную метку (строкой),
-    Автобус, Остановку.
+def save_stops(plan: dict, saved: dict, batch_size: int = 5000) -> int:
+    """Запись остановок из результата collect_schedule_data.
+    Новые остановки создаются, у записанных ранее обновляется название.
+    Остановки в плане заменяются записанными.
+    saved - {external_id: BusStop} записанные остановки, пополняется новыми.
+    Возвращает количество созданных остановок.
     """
-    Schedule.objects.create(day=get_day_number(day), time=datetime.strptime(time, "%H:%M").time(),
-             bus=bus, bus_stop=bus_stop)
+    new_stops, renamed = [], []
+    for external_id, stop in plan['bus_stops'].items():
+        if external_id in saved:
+            if saved[external_id].name != stop.name:
+                saved[external_id].name = stop.name
+                renamed.append(saved[external_id])
+            plan['bus_stops'][external_id] = saved[external_id]
+        else:
+            new_stops.append(stop)
+            saved[external_id] = stop
+    BusStop.objects.bulk_create(new_stops, batch_size=batch_size)
+    BusStop.objects.bulk_update(renamed, ['name'], batch_size=batch_size)
+    return len(new_stops)
 
 
-def clear_all_tables():
-    """Очистка всех таблиц расписания автобусов в БД."""
-    # Сначала удаляем объекты из таблиц, которые не имеют внешних ссылок
-    Schedule.objects.all().delete()
-    Order.objects.all().delete()
-    # Затем удаляем объекты из таблиц, которые могут иметь внешние ссылки
-    Router.objects.all().delete()
-    Bus.objects.all().delete()
-    BusStop.objects.all().delete()
+def import_schedule_data(data, verbose: bool = True, batch_size: int = 5000) -> dict:
+    """Заполнение БД расписанием в формате файла result.json
+    (формат описан в schedule/management/commands/import.py).
+    Принимает словарь или поток пар (номер, маршруты), см. bus_items.
+    Таблицы должны быть очищены заранее (clear_all_tables).
 
-    print('Все таблицы расписания автобусов очищены.')
+    Автобусы обрабатываются по одному: маршруты автобуса разбираются в памяти
+    (collect_schedule_data) и записываются пакетами через bulk_create.
+    Признак конечной и связи остановок с конечными рассчитываются в конце (refresh_bus_stops).
+    Вызывать нужно внутри транзакции, чтобы БД не оставалась заполненной частично.
+
+    verbose - печатать ли номера автобусов и маршрутов по ходу импорта.
+    batch_size - размер пакета для bulk_create.
+    Возвращает количество записанных строк по таблицам.
+    """
+    counts = dict.fromkeys(['bus_stop', 'bus', 'bus_station', 'router', 'order', 'timetable'], 0)
+    saved_stops = {}  # {external_id: BusStop} записанные остановки
+    for number, directions in bus_items(data):
+        plan = collect_schedule_data({number: directions}, verbose)
+        counts['bus_stop'] += save_stops(plan, saved_stops, batch_size)
+        Bus.objects.bulk_create(plan['buses'].values())
+        counts['bus'] += len(plan['buses'])
+        write_routes(plan, counts, batch_size)
+
+        rows = timetable_rows(plan)
+        Timetable.objects.bulk_create(
+            [Timetable(bus_stop_id=stop_id, bus_id=bus_id, day=day, minutes=minutes)
+             for (stop_id, bus_id, day), minutes in rows.items()],
+            batch_size=batch_size,
+        )
+        counts['timetable'] += len(rows)
+
+    counts.update(refresh_bus_stops(batch_size))
+
+    # bulk_create не отправляет сигналы post_save, кеши в памяти сбрасываются явно,
+    # после фиксации транзакции (вне транзакции - сразу)
+    transaction.on_commit(invalidate_caches)
+    return counts
+
+
+def refresh_bus_stops(batch_size: int = 5000) -> dict:
+    """Пересчет по маршрутам в БД признака конечной остановки и связей остановок
+    с конечными (con_to, con_from). Связи симметричные, как при .add():
+    остановка связана с конечными своих маршрутов, а конечные - с ней.
+    Остановки, которые не входят ни в один маршрут, удаляются.
+    Возвращает количество добавленных связей по направлениям.
+    """
+    BusStop.objects.filter(order__isnull=True).delete()
+
+    routers = {router_id: (start_id, end_id)
+               for router_id, start_id, end_id in Router.objects.values_list('id', 'start_id', 'end_id')}
+    links = {'to': set(), 'from': set()}
+    for router_id, stop_id in Order.objects.values_list('router_id', 'bus_stop_id'):
+        start_id, end_id = routers[router_id]
+        for direction, final_id in (('to', end_id), ('from', start_id)):
+            links[direction].add((stop_id, final_id))
+            links[direction].add((final_id, stop_id))
+
+    # Конечная - остановка, на которой начинается или заканчивается маршрут
+    terminals = {stop_id for pair in routers.values() for stop_id in pair}
+    BusStop.objects.filter(finish=False, id__in=terminals).update(finish=True)
+    BusStop.objects.filter(finish=True).exclude(id__in=terminals).update(finish=False)
+
+    counts = {}
+    for direction, field in (('to', BusStop.con_to), ('from', BusStop.con_from)):
+        through = field.through
+        existing = {(a, b): link_id for link_id, a, b
+                    in through.objects.values_list('id', 'from_busstop_id', 'to_busstop_id')}
+        through.objects.filter(id__in=[existing[pair] for pair in existing.keys() - links[direction]]).delete()
+        added = links[direction] - existing.keys()
+        through.objects.bulk_create([through(from_busstop_id=a, to_busstop_id=b) for a, b in added],
+                                    batch_size=batch_size)
+        counts[f'bus_stop_{direction}'] = len(added)
+    return counts
+
+
+def route_stop_names(**router_filter) -> set:
+    """Названия остановок на маршрутах, выбранных фильтром router_filter (поля Router)."""
+    return set(BusStop.objects.filter(order__router__in=Router.objects.filter(**router_filter))
+               .values_list('name', flat=True))
+
+
+def import_changed_buses(data, verbose: bool = True, batch_size: int = 5000) -> tuple:
+    """Инкрементальный импорт расписания в формате файла result.json.
+    Принимает словарь или поток пар (номер, маршруты), см. bus_items.
+
+    Хэш расписания каждого автобуса (calculate_md5_from_dict({номер: маршруты}),
+    он же в имени файла import_schedule/buses/{номер}_{хэш}.json) сравнивается
+    с хэшем последнего импорта (Bus.import_hash). Маршруты, порядок остановок и расписание
+    удаляются и записываются заново только для изменившихся автобусов.
+    Автобусы, которых нет в данных, удаляются. Остановки и их связи с конечными
+    пересчитываются (refresh_bus_stops).
+    Расписание изменившихся автобусов не перезаписывается целиком: записываются
+    только расписания остановок, в которых изменились отправления.
+    Вызывать нужно внутри транзакции.
+
+    Возвращает (номера изменившихся автобусов, номера удаленных автобусов,
+    количество записанных строк по таблицам, названия остановок, полное расписание
+    которых могло измениться).
+    """
+    existing = {bus.number: bus for bus in Bus.objects.all()}
+    saved_stops = BusStop.objects.in_bulk(field_name='external_id')
+    changed = []
+    seen = set()
+    stop_names = set()  # Остановки изменившихся и удаленных автобусов, до и после импорта
+    renamed_ids = set()  # Переименованные остановки (их названия есть в расписании маршрутов через них)
+    counts = dict.fromkeys(['bus_stop', 'bus', 'bus_station', 'router', 'order', 'timetable'], 0)
+    for number, directions in bus_items(data):
+        seen.add(number)
+        bus = existing.get(number)
+        if bus is not None and bus.import_hash == calculate_md5_from_dict({number: directions}):
+            continue
+        changed.append(number)
+        plan = collect_schedule_data({number: directions}, verbose)
+
+        for external_id, stop in plan['bus_stops'].items():
+            saved = saved_stops.get(external_id)
+            if saved is not None and saved.name != stop.name:
+                renamed_ids.add(saved.id)
+                stop_names.add(saved.name)
+        stop_names.update(stop.name for stop in plan['bus_stops'].values())
+
+        if bus is not None:
+            # Прежние маршруты автобуса. Автобус сохраняет id, у него меняется только хэш
+            stop_names.update(route_stop_names(bus=bus))
+            Router.objects.filter(bus=bus).delete()
+            Bus.station.through.objects.filter(bus_id=bus.id).delete()
+            bus.import_hash = plan['buses'][number].import_hash
+            Bus.objects.filter(id=bus.id).update(import_hash=bus.import_hash)
+            plan['buses'][number] = bus
+        else:
+            Bus.objects.bulk_create(plan['buses'].values())
+            counts['bus'] += 1
+        counts['bus_stop'] += save_stops(plan, saved_stops, batch_size)
+        write_routes(plan, counts, batch_size)
+
+        # Расписание: разница между записанным и новым
+        rows = timetable_rows(plan)
+        saved_rows = {
+            (stop_id, bus_id, day): (row_id, bytes(minutes)) for row_id, stop_id, bus_id, day, minutes
+            in Timetable.objects.filter(bus_id=plan['buses'][number].id).values_list(
+                'id', 'bus_stop_id', 'bus_id', 'day', 'minutes')
+        }
+        Timetable.objects.filter(id__in=[saved_rows[key][0] for key in saved_rows.keys() - rows.keys()]).delete()
+        updated = [Timetable(id=saved_rows[key][0], minutes=minutes) for key, minutes in rows.items()
+                   if key in saved_rows and saved_rows[key][1] != minutes]
+        Timetable.objects.bulk_update(updated, ['minutes'], batch_size=batch_size)
+        new_rows = [Timetable(bus_stop_id=stop_id, bus_id=bus_id, day=day, minutes=minutes)
+                    for (stop_id, bus_id, day), minutes in rows.items() if (stop_id, bus_id, day) not in saved_rows]
+        Timetable.objects.bulk_create(new_rows, batch_size=batch_size)
+        counts['timetable'] += len(updated) + len(new_rows)
+
+    # Удаленные автобусы - вместе со всеми данными
+    removed = [number for number in existing if number not in seen]
+    if removed:
+        stop_names.update(route_stop_names(bus__number__in=removed))
+    Bus.objects.filter(number__in=removed).delete()
+    if not changed and not removed:
+        return [], [], {}, set()
+    if renamed_ids:
+        stop_names.update(route_stop_names(start_id__in=renamed_ids))
+        stop_names.update(route_stop_names(end_id__in=renamed_ids))
+
+    counts.update(refresh_bus_stops(batch_size))
+    transaction.on_commit(invalidate_caches)
+    return changed, removed, counts, stop_names
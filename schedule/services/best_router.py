@@ -27,9 +27,12 @@ class BestRoute:
         self.flat_sequence = []  # значения
         # Сохраняем информацию об исходном списке и индексе для каждой остановки
         self.source_info = []    # (list_index, inner_index)
+        # Позиции каждой остановки в общей последовательности
+        self.positions = {}      # {остановка: [позиции]}
 
         for list_idx, lst in enumerate(bus_router):
             for inner_idx, value in enumerate(lst):
+                self.positions.setdefault(value, []).append(len(self.flat_sequence))
                 self.flat_sequence.append(value)
                 self.source_info.append((list_idx, inner_idx))
 
@@ -67,8 +70,8 @@ class BestRoute:
             factor = transitions[factor]
         
         # Находим все позиции start и finish в общей последовательности
-        positions1 = [i for i, val in enumerate(self.flat_sequence) if val == start]
-        positions2 = [i for i, val in enumerate(self.flat_sequence) if val == finish]
+        positions1 = self.positions.get(start, [])
+        positions2 = self.positions.get(finish, [])
 
         if not positions1 or not positions2:
             # Отсутствует одна или обе остановки   
@@ -0,0 +1,116 @@
+"""
+Версия данных расписания и сброс кешей в памяти процессов.
+
+Импорт заменяет расписание в одной транзакции и в ней же добавляет запись DataVersion.
+До фиксации транзакции все запросы видят прежнее расписание целиком, после - новое.
+
+Кеши в памяти (снимок сети, индекс отправлений, словарь Алисы и др.) регистрируют
+здесь свои функции сброса (register_cache). В процессе, который выполнил импорт,
+они сбрасываются сразу после фиксации транзакции. Остальные процессы (веб-сервер)
+сравнивают номер версии в БД с последним замеченным перед обработкой запроса
+(DataVersionMiddleware), но не чаще, чем раз в CHECK_INTERVAL секунд.
+Правки в админке тоже записывают новую версию - после фиксации своей транзакции
+(schedule/signals.py). Импорт меняет данные внутри bulk_changes: обработчики сигналов
+не срабатывают на каждую строку, кеши сбрасываются один раз по новой версии.
+"""
+import contextlib
+import threading
+import time
+from typing import Callable, List
+
+from django.db import transaction
+
+from schedule.models import DataVersion
+
+CHECK_INTERVAL = 5  # Как часто (в секундах) проверять версию данных в БД
+
+_invalidators: List[Callable[[], None]] = []  # Функции сброса кешей
+_version = None  # Последняя замеченная версия
+_checked = 0.0  # Время последней проверки (time.monotonic)
+_lock = threading.Lock()
+_published = threading.local()  # Сколько версий записал поток (published_count)
+_bulk = threading.local()  # Глубина вложенных bulk_changes в потоке
+
+
+def register_cache(invalidate: Callable[[], None]) -> Callable[[], None]:
+    """Регистрирует функцию сброса кеша, зависящего от данных расписания."""
+    with _lock:
+        if invalidate not in _invalidators:
+            _invalidators.append(invalidate)
+    return invalidate
+
+
+def invalidate_caches():
+    """Сбрасывает все зарегистрированные кеши."""
+    with _lock:
+        invalidators = list(_invalidators)
+    for invalidate in invalidators:
+        invalidate()
+
+
+def current_version() -> int:
+    """Номер текущей версии данных в БД (0, если импорта еще не было)."""
+    return DataVersion.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def check_data_version(force: bool = False) -> int:
+    """
+    Сверяет версию данных в БД с последней замеченной.
+    Если версия изменилась (импорт в другом процессе) - сбрасывает кеши.
+
+    Args:
+        force - проверить, даже если с прошлой проверки прошло меньше CHECK_INTERVAL
+
+    Returns:
+        Номер версии
+    """
+    global _version, _checked
+    now = time.monotonic()
+    with _lock:
+        if not force and _version is not None and now - _checked < CHECK_INTERVAL:
+            return _version
+        _checked = now
+    version = current_version()
+    with _lock:
+        changed = _version is not None and version != _version
+        _version = version
+    if changed:
+        invalidate_caches()
+    return version
+
+
+def publish_data_version(rows: int = 0) -> DataVersion:
+    """
+    Записывает новую версию данных. Вызывается внутри транзакции импорта:
+    версия становится видна вместе с данными, кеши этого процесса
+    сбрасываются после фиксации транзакции.
+    """
+    version = DataVersion.objects.create(rows=rows)
+    _published.count = published_count() + 1
+    transaction.on_commit(invalidate_caches)
+    return version
+
+
+def published_count() -> int:
+    """Сколько версий записал текущий поток: по изменению можно узнать,
+    записана ли версия в транзакции (например, импортом)."""
+    return getattr(_published, 'count', 0)
+
+
+@contextlib.contextmanager
+def bulk_changes():
+    """
+    Массовое изменение данных расписания (импорт). Пока оно идет, обработчики сигналов
+    моделей не сбрасывают кеши на каждую строку: внутри нужно записать новую версию
+    (publish_data_version), кеши сбросятся один раз после фиксации транзакции.
+    """
+    _bulk.depth = getattr(_bulk, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _bulk.depth -= 1
+
+
+def in_bulk_changes() -> bool:
+    """Идет ли в текущем потоке массовое изменение данных (bulk_changes)."""
+    return getattr(_bulk, 'depth', 0) > 0
@@ -0,0 +1,209 @@
+"""
+Индекс отправлений автобусов.
+
+Расписание хранится в памяти процесса как отсортированные массивы минут от полуночи
+(array('H'), 2 байта на отправление) по ключу (id остановки, id автобуса, день недели).
+Весь индекс загружается из БД одним запросом: в БД отправления хранятся в том же
+упакованном виде (Timetable.minutes), одна запись на ключ.
+Если импорт записал файл отправлений для текущей версии данных (timetable_file.py),
+индекс читается из него без загрузки из БД и без копирования в память процесса.
+
+Ближайшие отправления ищутся двоичным поиском. Сутки рассматриваются как кольцо:
+окно длиной D минут после времени T, перешедшее через полночь, продолжается
+с начала суток. Отправления нескольких пар (остановка, автобус) объединяются
+слиянием отсортированных последовательностей (heapq.merge).
+"""
+import heapq
+import threading
+from array import array
+from bisect import bisect_right
+from datetime import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from schedule.models import Timetable
+from schedule.services.data_version import current_version
+from schedule.services.snapshot import get_snapshot
+from schedule.services.timetable_file import TimetableFile, open_timetable_file
+
+MINUTES_IN_DAY = 1440
+
+# Объекты времени для каждой минуты суток, чтобы не создавать их при каждом ответе
+MINUTE_TIMES = tuple(time(minute // 60, minute % 60) for minute in range(MINUTES_IN_DAY))
+
+
+def to_minutes(value: time) -> int:
+    """Время в минутах от полуночи (секунды отбрасываются)."""
+    return value.hour * 60 + value.minute
+
+
+def minutes_window(marks: Sequence, start: int, duration: int,
+                   key: Callable[[Any], int] = None) -> Tuple[Sequence, Sequence]:
+    """
+    Отправления, накрытые окном длиной duration минут после времени start.
+
+    Метки отсчитываются по кольцу суток: попадают метки, отстоящие от start
+    больше чем на 0 и не больше чем на duration минут. Метка, совпадающая со start,
+    считается отстоящей на сутки.
+
+    Args:
+        marks - отсортированные минуты от полуночи
+                (или отсортированные значения, которые key переводит в минуты)
+        start - время начала окна в минутах от полуночи
+        duration - длина окна в минутах (не больше суток)
+        key - перевод метки в минуты от полуночи
+
+    Returns:
+        Две части окна (срезы marks): до полуночи и после нее.
+        Метки идут по порядку: сначала первая часть, затем вторая.
+    """
+    end = start + min(duration, MINUTES_IN_DAY)
+    i = bisect_right(marks, start, key=key)
+    j = bisect_right(marks, end, lo=i, key=key)
+    if end < MINUTES_IN_DAY:
+        return marks[i:j], marks[0:0]
+    # Окно переходит через полночь
+    k = bisect_right(marks, end - MINUTES_IN_DAY, hi=i, key=key)
+    return marks[i:j], marks[0:k]
+
+
+class DepartureIndex:
+    """Неизменяемый индекс отправлений."""
+
+    def __init__(self, rows: Iterable[Tuple[int, int, int, time]]):
+        """
+        Args:
+            rows - записи расписания (id остановки, id автобуса, день, время)
+        """
+        departures = {}
+        for stop_id, bus_id, day, value in rows:
+            departures.setdefault((stop_id, bus_id, day), []).append(to_minutes(value))
+        self.departures: Dict[Tuple[int, int, int], array] = {
+            key: array('H', sorted(set(minutes))) for key, minutes in departures.items()
+        }
+
+    @classmethod
+    def from_timetables(cls, rows: Iterable[Tuple[int, int, int, bytes]]) -> 'DepartureIndex':
+        """
+        Индекс из упакованных расписаний.
+
+        Args:
+            rows - записи (id остановки, id автобуса, день, Timetable.minutes)
+        """
+        index = cls(())
+        index.departures = {(stop_id, bus_id, day): Timetable.unpack(minutes)
+                            for stop_id, bus_id, day, minutes in rows}
+        return index
+
+    @classmethod
+    def from_db(cls) -> 'DepartureIndex':
+        """Загружает индекс из БД одним запросом."""
+        return cls.from_timetables(Timetable.objects.values_list('bus_stop_id', 'bus_id', 'day', 'minutes').iterator())
+
+    def get(self, stop_id: int, bus_id: int, day: int) -> array:
+        """Отсортированные отправления автобуса с остановки в день недели."""
+        return self.departures.get((stop_id, bus_id, day), array('H'))
+
+    def next_departures(self, stop_id: int, bus_id: int, day: int, after: int,
+                        within: int = MINUTES_IN_DAY, limit: int = None) -> List[int]:
+        """
+        Ближайшие отправления после времени after в пределах within минут,
+        с переходом через полночь.
+
+        Args:
+            stop_id, bus_id, day - ключ расписания
+            after - время в минутах от полуночи
+            within - длина окна в минутах
+            limit - наибольшее количество отправлений
+
+        Returns:
+            Минуты отправлений в порядке следования
+        """
+        first, second = minutes_window(self.get(stop_id, bus_id, day), after, within)
+        result = first.tolist() + second.tolist()
+        return result if limit is None else result[:limit]
+
+    def merge_departures(self, pairs: Iterable[Tuple[int, int]], day: int, after: int,
+                         within: int = MINUTES_IN_DAY) -> Iterator[Tuple[int, int]]:
+        """
+        Отправления нескольких пар (остановка, автобус), объединенные по времени.
+
+        Args:
+            pairs - пары (id остановки, id автобуса)
+            day - день недели
+            after - время в минутах от полуночи
+            within - длина окна в минутах
+
+        Returns:
+            Итератор (минута, номер пары в pairs) в порядке следования.
+            Одновременные отправления идут в порядке пар.
+        """
+        streams = []
+        for number, (stop_id, bus_id) in enumerate(pairs):
+            first, second = minutes_window(self.get(stop_id, bus_id, day), after, within)
+            # Отправления после полуночи сдвигаются на сутки, чтобы порядок был сквозным
+            streams.append(
+                [(minute, number) for minute in first]
+                + [(minute + MINUTES_IN_DAY, number) for minute in second]
+            )
+        for minute, number in heapq.merge(*streams):
+            yield minute % MINUTES_IN_DAY, number
+
+
+class MappedDepartureIndex(DepartureIndex):
+    """Индекс отправлений, который читает файл отправлений, отображенный в память."""
+
+    def __init__(self, timetable: TimetableFile):
+        self.timetable = timetable
+
+    def get(self, stop_id: int, bus_id: int, day: int) -> memoryview:
+        """Отсортированные отправления автобуса с остановки в день недели (без копирования)."""
+        return self.timetable.departures(stop_id, bus_id, day)
+
+
+def load_departure_index() -> DepartureIndex:
+    """Индекс из файла отправлений, если он записан для текущей версии данных этой БД
+    и расписание этой версии не правилось. Иначе - из БД."""
+    version = current_version()
+    if version != _outdated_version:
+        timetable = open_timetable_file(version, get_snapshot().version)
+        if timetable is not None:
+            return MappedDepartureIndex(timetable)
+    return DepartureIndex.from_db()
+
+
+_index = None  # Текущий индекс
+_generation = 0  # Номер поколения данных, растет при каждом сбросе
+_outdated_version = None  # Версия данных, расписание которой правилось (ее файл отправлений устарел)
+_lock = threading.Lock()
+
+
+def get_departure_index() -> DepartureIndex:
+    """Возвращает текущий индекс отправлений, при необходимости строит его."""
+    global _index
+    index = _index
+    if index is None:
+        with _lock:
+            generation = _generation
+        index = load_departure_index()
+        with _lock:
+            if generation == _generation:
+                _index = index
+    return index
+
+
+def invalidate_departure_index(file_outdated: bool = False):
+    """
+    Сбрасывает индекс. Вызывается при изменении расписания.
+
+    Args:
+        file_outdated - расписание изменено без новой версии данных (правка в админке),
+                        файл отправлений не используется до следующей версии
+                        (файл следующей версии проверяется по ее номеру при чтении)
+    """
+    global _index, _generation, _outdated_version
+    version = current_version() if file_outdated else None
+    with _lock:
+        _generation += 1
+        _index = None
+        if file_outdated:
+            _outdated_version = version
@@ -1,21 +1,26 @@
 import datetime
-from typing import Dict, List, Tuple
-from functools import cmp_to_key
+import threading
+from typing import Dict, Iterable, List, Tuple
 
-from schedule.models import BusStop, Bus, Schedule, Router
+from schedule.models import BusStop, Bus, StopTimetable, Timetable, Router
+from schedule.services.departures import MINUTE_TIMES
+from schedule.services.functions import format_bus_number
+from schedule.services.snapshot import NetworkSnapshot, get_snapshot
 from schedule.services.timestamp import time_generator
-from tbot.services.functions import date_now
-from utils.sorted_buses import compare_name
+from tbot.services.functions import ChunkedTextBuilder
 
+WEEK = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']  # Дни недели на кнопках и в заголовке расписания
 
-def full_schedule(bus_stop_name: str, day_of_week: int = None) -> Dict[Bus, Dict[str, List[datetime.time]]]:
+
+def full_schedule(bus_stop_name: str, day_of_week: int = None,
+                  snapshot: NetworkSnapshot = None) -> Dict[Bus, Dict[str, List[datetime.time]]]:
     """
     Формирует полное расписание для всех одноименных остановок на текущий день.
     Алгоритм schedule/services/full_schedule.py.
 
     Эта функция выполняет следующие шаги:
     1. Находит все остановки с заданным именем (`bus_stop_name`).
-    2. Получает все записи о времени (`Schedule`) для найденных остановок на этот день.
+    2. Получает расписания (`Timetable`) для найденных остановок на этот день.
     3. Группирует время по автобусам, а затем по их маршрутам. Маршрут определяется
        для каждой пары (автобус, остановка).
     4. Возвращает отсортированный словарь, где ключи - объекты автобусов (`Bus`),
@@ -25,6 +30,8 @@ def full_schedule(bus_stop_name: str, day_of_week: int = None) -> Dict[Bus, Dict
     Args:
         bus_stop_name (str): Название автобусной остановки для поиска.
         day_of_week (Optional[int]): День недели (1-7) или None для автоопределения.
+        snapshot (Optional[NetworkSnapshot]): Снимок сети, по которому определяются маршруты
+            (по умолчанию текущий снимок).
 
     Returns:
         Dict[Bus, Dict[str, List[datetime.time]]]: Словарь с полным расписанием,
@@ -40,26 +47,29 @@ def full_schedule(bus_stop_name: str, day_of_week: int = None) -> Dict[Bus, Dict
         }
     """
     # 1. Найти объекты всех одноименных остановок отправления.
-    # Выполняем запрос к БД для получения всех остановок с указанным именем.
-    bus_stops = BusStop.objects.filter(name=bus_stop_name)
-    if not bus_stops.exists():
+    # Остановки, автобусы и маршруты берутся из снимка сети, из БД - только отправления.
+    snapshot = snapshot or get_snapshot()
+    bus_stops = snapshot.stops_by_name.get(bus_stop_name)
+    if not bus_stops:
         # Если ни одной остановки не найдено, возвращаем пустой словарь.
         return {}
 
-    # Получаем все записи времени отправления для найденных остановок в нужный день.
-    schedules = Schedule.objects.filter(
-        bus_stop__in=bus_stops,
+    # Получаем расписания найденных остановок в нужный день: одна запись на автобус и остановку.
+    timetables = Timetable.objects.filter(
+        bus_stop_id__in=[stop.id for stop in bus_stops],
         day=day_of_week
-    ).select_related('bus', 'bus_stop').order_by('time')
+    ).values_list('bus_id', 'bus_stop_id', 'minutes')
+    # Порядок по первому отправлению, как при выборке отправлений по времени.
+    timetables = sorted(((Timetable.unpack(minutes), bus_id, stop_id) for bus_id, stop_id, minutes in timetables),
+                        key=lambda item: (item[0][:1].tolist(), item[2]))
 
     # Собираем промежуточный словарь по автобусам и их остановкам.
     # { автобус: { остановка: [список временных меток] } }
     intermediate_schedule: Dict[Bus, Dict[BusStop, List[datetime.time]]] = {}
-    for schedule in schedules:
-        # .setdefault() создает ключ с пустым словарем/списком, если его нет.
-        bus_schedules = intermediate_schedule.setdefault(schedule.bus, {})
-        stop_schedules = bus_schedules.setdefault(schedule.bus_stop, [])
-        stop_schedules.append(schedule.time)
+    for minutes, bus_id, stop_id in timetables:
+        # .setdefault() создает ключ с пустым словарем, если его нет.
+        bus_schedules = intermediate_schedule.setdefault(snapshot.buses[bus_id], {})
+        bus_schedules[snapshot.stops[stop_id]] = [MINUTE_TIMES[minute] for minute in minutes]
     
     # for im in intermediate_schedule.items():
     #     print(im)
@@ -73,33 +83,126 @@ def full_schedule(bus_stop_name: str, day_of_week: int = None) -> Dict[Bus, Dict
     #     print(im)
 
     # 2. Преобразование: меняем в исходном словаре остановки на маршруты.
+    # Маршруты берутся из снимка сети, без запросов к БД.
     final_schedule: Dict[Bus, Dict[Tuple[Router], List[datetime.time]]] = {}
     for bus, stop_schedules in intermediate_schedule.items():
         final_schedule.setdefault(bus, {})
         mark = 0
         for stop, times in stop_schedules.items():
-            try:
-                # Для каждой пары (автобус, остановка) получаем соответствующий маршрут.
-                # Используем .get(), чтобы обработать случаи, когда маршрут не найден или их несколько.
-                # Ожидается, что для конкретного автобуса остановка встречается только на одном маршруте.
-                routers = Router.objects.filter(bus=bus, orders_for_router__bus_stop=stop)
-                router_list = tuple(routers) + (mark,)  # Добавляем метку для уникальности ключа
-                final_schedule[bus][tuple(router_list)] = times
-                mark += 1
-            except Router.DoesNotExist:
-                # Эта ситуация может возникнуть при несогласованности данных в БД.
-                # Например, есть расписание для остановки, но она не привязана к маршруту.
-                # Просто пропускаем такую запись, можно добавить логирование.
-                print(f"Warning: Маршрут не найден для автобуса {bus} и остановки {stop}.")
+            # Для каждой пары (автобус, остановка) получаем маршруты автобуса, проходящие через остановку.
+            # Маршрут повторяется столько раз, сколько остановка встречается в нем.
+            # Ожидается, что для конкретного автобуса остановка встречается только на одном маршруте.
+            routers = [snapshot.routers[router_id] for router_id in snapshot.bus_routers.get(bus.id, ())
+                       for route_stop in snapshot.router_stops[router_id] if route_stop.id == stop.id]
+            router_list = tuple(routers) + (mark,)  # Добавляем метку для уникальности ключа
+            final_schedule[bus][tuple(router_list)] = times
+            mark += 1
 
     # 3. Сортируем итоговый словарь по номерам автобусов для упорядоченного вывода.
-    # Используем кастомную функцию сортировки `compare_name` для корректной обработки номеров типа "10а".
-    sorted_buses = sorted(
-        final_schedule.keys(),
-        key=cmp_to_key(lambda bus1, bus2: compare_name(bus1.number, bus2.number))
-    )
+    # Ключ сортировки автобуса (Bus.sort_key) учитывает номера типа "10а".
+    sorted_buses = sorted(final_schedule.keys(), key=lambda bus: bus.sort_key)
 
     # Собираем финальный отсортированный словарь в нужном порядке.
     sorted_final_schedule = {bus: final_schedule[bus] for bus in sorted_buses}
 
     return sorted_final_schedule
+
+
+def render_full_schedule(bus_stop_name: str, day_of_week: int, snapshot: NetworkSnapshot = None) -> List[str]:
+    """
+    Полное расписание остановки на день в виде сообщений Телеграмм (Markdown),
+    каждое не длиннее лимита на одно сообщение.
+    """
+    buffer = ChunkedTextBuilder()
+    schedule = full_schedule(bus_stop_name, day_of_week, snapshot)
+
+    spece = None
+    # Формируем заголовок сообщения. Он будет отправлен в самом начале.
+    buffer.add(f"*🚌 Все автобусы от {bus_stop_name} на период 24 часа ({WEEK[day_of_week - 1]})*")
+
+    # Начинаем итерацию по расписанию автобусов.
+    for bus, routers_times in schedule.items():
+        # Создаем строку для информации о текущем автобусе.
+        bus_content = ""
+        if spece != bus.number:
+            spece = bus.number
+            # Добавляем двойной перенос строки для визуального разделения информации о разных автобусах.
+            bus_content += "\n\n"
+
+        # Добавляем номер автобуса.
+        bus_content += f"*🚌 №{format_bus_number(bus.number)}*"  # Буквы в кавычках
+        # Добавляем информацию о маршрутах и времени.
+        for routers, times in routers_times.items():
+            bus_content += "\n" + ', '.join([f"*{router.start.name} - {router.end.name}*" for router in routers[:-1]])
+            bus_content += "\n" + ', '.join([time.strftime("%H:%M") for time in times])
+        buffer.add(bus_content)  # Накапливаем текст для вывода
+    return buffer.finalize()
+
+
+def build_stop_timetables(names: Iterable[str] = None, batch_size: int = 5000) -> int:
+    """
+    Заполняет таблицу StopTimetable: сообщения полного расписания
+    для названий остановок names (по умолчанию - всех) на все дни недели.
+    Записи остальных названий не меняются, записи исчезнувших остановок удаляются.
+    Вызывается при импорте, в его транзакции, чтобы таблица сменилась вместе с расписанием.
+    Возвращает количество записей.
+    """
+    # Снимок строится по данным транзакции и не запоминается (транзакция может откатиться)
+    snapshot = NetworkSnapshot.from_db()
+    if names is None:
+        StopTimetable.objects.all().delete()
+        names = snapshot.stops_by_name
+    else:
+        names = set(names)
+        StopTimetable.objects.filter(name__in=names).delete()
+        names = [name for name in names if name in snapshot.stops_by_name]
+    rows = [
+        StopTimetable(name=name, day=day, chunks=render_full_schedule(name, day, snapshot))
+        for name in sorted(names) for day in range(1, 8)
+    ]
+    StopTimetable.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+_chunks = {}  # Сообщения полного расписания {(название остановки, день): [сообщения]}
+_generation = 0  # Номер поколения данных, растет при каждом сбросе
+_rows_allowed = True  # Соответствует ли таблица StopTimetable расписанию
+_lock = threading.Lock()
+
+
+def get_full_schedule_chunks(bus_stop_name: str, day_of_week: int) -> List[str]:
+    """
+    Сообщения полного расписания остановки на день.
+    Берутся из памяти процесса, затем из таблицы StopTimetable (заполняется при импорте).
+    Если в таблице их нет или расписание правилось после импорта - строятся заново.
+    """
+    key = (bus_stop_name, day_of_week)
+    chunks = _chunks.get(key)
+    if chunks is None:
+        with _lock:
+            generation = _generation
+            rows_allowed = _rows_allowed
+        if rows_allowed:
+            chunks = StopTimetable.objects.filter(
+                name=bus_stop_name, day=day_of_week).values_list('chunks', flat=True).first()
+        if chunks is None:
+            chunks = render_full_schedule(bus_stop_name, day_of_week)
+        with _lock:
+            if generation == _generation:
+                _chunks[key] = chunks
+    return chunks
+
+
+def invalidate_full_schedule(rows_outdated: bool = False):
+    """
+    Сбрасывает сообщения полного расписания в памяти процесса.
+
+    Args:
+        rows_outdated - расписание изменено без новой версии данных (правка в админке),
+                        таблица StopTimetable не используется до следующей версии
+    """
+    global _generation, _rows_allowed
+    with _lock:
+        _generation += 1
+        _chunks.clear()
+        _rows_allowed = not rows_outdated
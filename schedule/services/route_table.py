@@ -0,0 +1,98 @@
+"""
+Таблица маршрутов между парами остановок.
+
+Для пары названий остановок (отправления, прибытия) запоминается результат
+анализа маршрутов (Filter.get_bus_list): автобус, остановки отправления и прибытия,
+конечные, часть маршрута, приоритет и баллы. Таблица заполняется по мере запросов:
+пара анализируется при первом обращении, затем ответ берется из таблицы.
+Пар остановок сотни тысяч, а спрашивают о небольшой их части, поэтому заранее
+таблица не строится.
+
+Таблица хранится в памяти процесса для одного снимка сети и сбрасывается
+вместе с ним (смена версии данных, правка сети маршрутов).
+Объекты подставляются из снимка сети по id, строки пары:
+    [id автобуса, id отправления, id прибытия,
+     id конечной откуда, id конечной куда, часть, приоритет, баллы]
+или None, если прямых автобусов нет.
+"""
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .snapshot import NetworkSnapshot, get_snapshot
+
+
+class RouteTable:
+    """Таблица маршрутов для одного снимка сети."""
+
+    def __init__(self, version: str):
+        self.version = version  # Отпечаток снимка сети
+        self.routes: Dict[Tuple[str, str], Optional[List[list]]] = {}
+
+    def get(self, snapshot: NetworkSnapshot, start_name: str, finish_name: str,
+            analyze: Callable[[str, str], List[Dict]]) -> List[Dict]:
+        """
+        Возвращает маршруты для пары названий в формате Filter.get_bus_list.
+        Пары нет в таблице - маршруты получаются анализом (analyze) и запоминаются.
+        Если прямых автобусов нет, вызывает ValueError, как и анализ маршрутов.
+        """
+        key = (start_name, finish_name)
+        if key not in self.routes:
+            try:
+                found_routes = analyze(start_name, finish_name)
+            except ValueError:
+                # Прямых автобусов между остановками нет
+                self.routes[key] = None
+                raise
+            self.routes[key] = [
+                [
+                    route['bus'].id, route['start'].id, route['finish'].id,
+                    route['final_stop_start'].id, route['final_stop_finish'].id,
+                    route['part'], route['priority'], route['score'],
+                ]
+                for route in found_routes
+            ]
+        rows = self.routes[key]
+        if rows is None:
+            raise ValueError(f'Нет прямых автобусов между {start_name} и {finish_name}')
+
+        found_routes = []
+        for bus_id, start_id, finish_id, final_start_id, final_finish_id, part, priority, score in rows:
+            found_routes.append({
+                "priority": priority,
+                "bus": snapshot.buses[bus_id],
+                "start": snapshot.stops[start_id],
+                "finish": snapshot.stops[finish_id],
+                "final_stop_start": snapshot.stops[final_start_id],
+                "final_stop_finish": snapshot.stops[final_finish_id],
+                "score": score,
+                "part": part,
+            })
+        return found_routes
+
+
+_table: Optional[RouteTable] = None  # Таблица текущего снимка сети
+_generation = 0  # Растет при каждом сбросе
+_lock = threading.Lock()
+
+
+def lookup_routes(start_name: str, finish_name: str, analyze: Callable[[str, str], List[Dict]]) -> List[Dict]:
+    """Маршруты для пары названий остановок: из таблицы или анализом (analyze_routes)."""
+    global _table
+    snapshot = get_snapshot()
+    table = _table
+    if table is None or table.version != snapshot.version:
+        generation = _generation
+        table = RouteTable(snapshot.version)
+        with _lock:
+            if generation == _generation:
+                # Сеть не менялась, пока строился снимок
+                _table = table
+    return table.get(snapshot, start_name, finish_name, analyze)
+
+
+def invalidate_route_table():
+    """Сбрасывает таблицу маршрутов."""
+    global _table, _generation
+    with _lock:
+        _generation += 1
+        _table = None
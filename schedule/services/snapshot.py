@@ -0,0 +1,161 @@
+"""
+Снимок сети маршрутов в памяти процесса.
+
+Все автобусы, маршруты, последовательности остановок и группы остановок
+загружаются из БД одним набором запросов и хранятся в обычных структурах Python.
+Анализ маршрутов (route_analysis, BestRoute, Filter) работает только со снимком
+и не обращается к БД.
+
+Снимок неизменяемый. При изменении данных (импорт, правка в админке)
+он не исправляется, а сбрасывается и строится заново при следующем обращении.
+Замена снимка - это присваивание одной ссылки, поэтому запрос, который уже
+получил снимок, дорабатывает со старой версией целиком.
+"""
+import hashlib
+import threading
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+from schedule.models import Bus, BusStop, Order, Router, StopGroup
+
+
+class NetworkSnapshot:
+    """
+    Неизменяемый снимок сети маршрутов.
+
+    Хранит объекты моделей (BusStop, Bus, Router), загруженные один раз,
+    поэтому результаты анализа совместимы с кодом, который работает с объектами БД.
+    """
+
+    def __init__(self, stops: Iterable[BusStop], buses: Iterable[Bus], routers: Iterable[Router],
+                 orders: Iterable[Tuple[int, int]], group_index: Dict[str, frozenset]):
+        """
+        Args:
+            stops - все остановки
+            buses - все автобусы
+            routers - все маршруты (в порядке id)
+            orders - пары (id маршрута, id остановки) в порядке следования остановок
+            group_index - обратный индекс групп остановок (StopGroup.get_index)
+        """
+        stops = sorted(stops, key=lambda stop: stop.id)
+        self.stops: Mapping[int, BusStop] = MappingProxyType({stop.id: stop for stop in stops})
+
+        stops_by_name = {}
+        for stop in stops:
+            stops_by_name.setdefault(stop.name, []).append(stop)
+        self.stops_by_name: Mapping[str, Tuple[BusStop, ...]] = MappingProxyType(
+            {name: tuple(items) for name, items in stops_by_name.items()})
+
+        self.buses: Mapping[int, Bus] = MappingProxyType({bus.id: bus for bus in buses})
+
+        # Последовательности остановок маршрутов
+        router_stops = {}
+        for router_id, stop_id in orders:
+            router_stops.setdefault(router_id, []).append(self.stops[stop_id])
+
+        routers = sorted(routers, key=lambda router: router.id)
+        bus_routers = {}  # {id автобуса: [id маршрутов]}
+        stop_buses = {}  # {id остановки: {id автобусов}} в порядке появления в маршрутах
+        for router in routers:
+            # Связанные объекты берем из снимка, чтобы не обращаться к БД
+            router.start = self.stops[router.start_id]
+            router.end = self.stops[router.end_id]
+            router.bus = self.buses[router.bus_id]
+            bus_routers.setdefault(router.bus_id, []).append(router.id)
+            for stop in router_stops.get(router.id, []):
+                stop_buses.setdefault(stop.id, {})[router.bus_id] = None
+
+        self.routers: Mapping[int, Router] = MappingProxyType({router.id: router for router in routers})
+        self.router_stops: Mapping[int, Tuple[BusStop, ...]] = MappingProxyType(
+            {router.id: tuple(router_stops.get(router.id, ())) for router in routers})
+        self.bus_routers: Mapping[int, Tuple[int, ...]] = MappingProxyType(
+            {bus_id: tuple(ids) for bus_id, ids in bus_routers.items()})
+        self.stop_buses: Mapping[int, Tuple[int, ...]] = MappingProxyType(
+            {stop_id: tuple(ids) for stop_id, ids in stop_buses.items()})
+
+        self.group_index: Mapping[str, frozenset] = MappingProxyType(dict(group_index))
+
+        # Отпечаток структуры сети. Совпадает у снимков с одинаковыми данными,
+        # используется для проверки актуальности сохраненных производных данных.
+        fingerprint = hashlib.md5()
+        for stop in stops:
+            fingerprint.update(f'{stop.id}:{stop.name}\n'.encode())
+        for router in routers:
+            stop_ids = ','.join(str(stop.id) for stop in self.router_stops[router.id])
+            fingerprint.update(f'{router.id}:{router.bus_id}:{stop_ids}\n'.encode())
+        for name in sorted(self.group_index):
+            fingerprint.update(f'{name}:{sorted(self.group_index[name])}\n'.encode())
+        self.version: str = fingerprint.hexdigest()
+
+    @classmethod
+    def from_db(cls) -> 'NetworkSnapshot':
+        """Загружает снимок из БД."""
+        return cls(
+            stops=BusStop.objects.all(),
+            buses=Bus.objects.all(),
+            routers=Router.objects.all(),
+            orders=Order.objects.order_by('router_id', 'order_number').values_list('router_id', 'bus_stop_id'),
+            group_index=StopGroup.get_index(),
+        )
+
+    def get_group_by_stop_name(self, start_name: str, finish_name: str = None) -> Dict[str, List[str]]:
+        """Аналог StopGroup.get_group_by_stop_name по данным снимка."""
+        return StopGroup.resolve_group(self.group_index, start_name, finish_name)
+
+    def get_stops_by_names(self, names: Iterable[str]) -> List[BusStop]:
+        """Возвращает остановки с указанными названиями, упорядоченные по id."""
+        stops = []
+        for name in set(names):
+            stops.extend(self.stops_by_name.get(name, ()))
+        return sorted(stops, key=lambda stop: stop.id)
+
+    def get_buses_by_stops(self, stops: Iterable[BusStop]) -> List[Bus]:
+        """
+        Возвращает автобусы, маршруты которых проходят через остановки,
+        без повторов, в порядке остановок и появления автобуса в маршрутах.
+        """
+        bus_ids = {}
+        for stop in stops:
+            bus_ids.update(dict.fromkeys(self.stop_buses.get(stop.id, ())))
+        return [self.buses[bus_id] for bus_id in bus_ids]
+
+    def get_parts(self, bus: Bus) -> List[List[BusStop]]:
+        """Возвращает части маршрута автобуса (последовательности остановок)."""
+        return [list(self.router_stops[router_id]) for router_id in self.bus_routers.get(bus.id, ())]
+
+
+_snapshot = None  # Текущий снимок
+_generation = 0  # Номер поколения данных, растет при каждом сбросе
+_lock = threading.Lock()
+
+
+def get_snapshot() -> NetworkSnapshot:
+    """Возвращает текущий снимок, при необходимости строит его."""
+    snapshot = _snapshot
+    if snapshot is None:
+        snapshot = reload_snapshot()
+    return snapshot
+
+
+def reload_snapshot() -> NetworkSnapshot:
+    """
+    Строит новый снимок из БД и атомарно заменяет им текущий.
+    Если данные изменились во время построения, снимок возвращается,
+    но не запоминается (следующий запрос построит актуальный).
+    """
+    global _snapshot
+    with _lock:
+        generation = _generation
+    snapshot = NetworkSnapshot.from_db()
+    with _lock:
+        if generation == _generation:
+            _snapshot = snapshot
+    return snapshot
+
+
+def invalidate_snapshot():
+    """Сбрасывает снимок. Вызывается при изменении данных сети."""
+    global _snapshot, _generation
+    with _lock:
+        _generation += 1
+        _snapshot = None
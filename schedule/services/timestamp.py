@@ -3,71 +3,45 @@ import itertools
 import re
 import sys
 import traceback
-from datetime import date, datetime
+from datetime import datetime
 from typing import Any, Dict, List
 
-from schedule.models import Bus, BusStop, Holiday, Order, Router, Schedule, StopGroup
+from schedule.models import Holiday
 from tbot.services.functions import date_now
 
 from .best_router import BestRoute
+from .departures import MINUTE_TIMES, get_departure_index, minutes_window, to_minutes
 from .filter import Filter
 from .functions import format_bus_number
+from .route_table import lookup_routes
+from .snapshot import get_snapshot
 
 
 def time_generator(time_marks, start_time, duration):
     """Генератор временных меток, возвращающий временные метки из списка.
-    Принимает список временных меток, стартовое время и продолжительность в минутах.
+    Принимает отсортированный список временных меток, стартовое время и продолжительность в минутах.
     Возвращает временные метки из списка, начиная со стартового времени, пока не пройдет
     указанное количество минут. Если время переходит через 00:00, продолжает считать.
     Рассматривая таким образом список закольцованным, а отрезок времени накладывается
     по периметру кольца, возвращая метки, которые накрыты отрезком.
+    Метка, совпадающая со стартовым временем (с точностью до минуты), считается
+    отстоящей от него на сутки. Поиск начала отрезка - двоичный (см. minutes_window).
     """
-
-    def dif_to_minutes(time1, time2):
-        """Разница в минутах между двумя значениями времени в формате datetime.time"""
-        # Преобразование в объекты datetime.datetime
-        datetime1 = datetime.combine(date.today(), time1)
-        datetime2 = datetime.combine(date.today(), time2)
-        # Вычисление разницы в минутах
-        difference = datetime1 - datetime2
-        return difference.total_seconds() / 60
-
-    if not time_marks:
-        return []
-    # Находим индекс временной метки, с которой начнем генерацию
-    index = None
-    for time in time_marks:
-        if time >= start_time:
-            index = time_marks.index(time)
-            break
-    index = 0 if index is None else index
-
-    counter = 0  # Счетчик минут
-    time = datetime.strptime("23:59", "%H:%M").time()
-
-    while True:
-        if time_marks[index] > start_time:
-            # Если следующее время больше стартового, то еще не было перехода через 00:00
-            # Добавляем минуты между временами в счетчик
-            counter += dif_to_minutes(time_marks[index], start_time)
-            start_time = time_marks[index]
-        else:
-            # Если следующее время меньше стартового, значит был переход через 00:00
-            # Добавляем минуты между временем и 00:00
-            counter += dif_to_minutes(time, start_time) + 1
-            # Добавляем минуты между 00:00 и новым временем
-            counter += time_marks[index].hour * 60 + time_marks[index].minute
-            start_time = time_marks[index]
-        index = (index + 1) % len(
-            time_marks
-        )  # Переход к следующему времени (закольцованный список)
-        if counter > duration:
-            # Если счетчик превысил продолжительность, то выходим из цикла
-            return
-        yield start_time  # Возвращаем время
+    before_midnight, after_midnight = minutes_window(
+        time_marks, to_minutes(start_time), duration, key=to_minutes
+    )
+    return itertools.chain(before_midnight, after_midnight)
 
 
 def route_analysis(start_stop_name: str, finish_stop_name: str) -> List:
+    """Анализ маршрутов между остановками (см. analyze_routes).
+    Результат для пары остановок запоминается в таблице маршрутов
+    (route_table.py), повторный запрос пары не анализируется заново.
+    """
+    return lookup_routes(start_stop_name, finish_stop_name, analyze_routes)
+
+
+def analyze_routes(start_stop_name: str, finish_stop_name: str) -> List:
     """Анализ маршрутов, определение приоритетов маршрутов.
     Находит все автобусы, которые идут от каждой остановки
     отправления к каждой остановке прибытия. Определяет наиболее
@@ -95,41 +69,27 @@ def route_analysis(start_stop_name: str, finish_stop_name: str) -> List:
         Пустой список вернет если нет автобусов или
         остановки отправления и прибытия одноименные.
     """
+    # Снимок сети маршрутов, анализ выполняется без обращений к БД
+    snapshot = get_snapshot()
+
     # 1 --------------------------------
     # Формируем группы остановок. Логика полностью переписана в соответствии
     # с реальной структурой модели StopGroup (JSON-поле list_name).
-    names = StopGroup.get_group_by_stop_name(start_stop_name, finish_stop_name)
+    names = snapshot.get_group_by_stop_name(start_stop_name, finish_stop_name)
     start_list = names["start_names"]  # Получаем остановки из групп
     finish_list = names["finish_names"]  # Получаем остановки из групп
 
     # 2 --------------------------------
     # Получаем объекты BusStop для всех найденных названий.
-    start_objects = list(BusStop.objects.filter(name__in=start_list))
-    finish_objects = list(BusStop.objects.filter(name__in=finish_list))
-
-    # print(start_objects)
-    # print(finish_objects)
+    start_objects = snapshot.get_stops_by_names(start_list)
+    finish_objects = snapshot.get_stops_by_names(finish_list)
 
     # 3 --------------------------------
     # Получаем все маршруты для автобусов, проходящих через начальные остановки.
-    # ВАЖНО: Реализовано без оптимизации (с циклами) для целей тестирования.
-    bus_to_stops = {}
-    all_buses = Bus.objects.filter(
-        routers__orders_for_router__bus_stop__in=start_objects
-    ).distinct()
-
-    for bus in all_buses:
-        routes = Router.objects.filter(bus=bus)
-        bus_parts = []
-        for route in routes:
-            part_orders = Order.objects.filter(router=route).order_by("order_number")
-            bus_parts.append([order.bus_stop for order in part_orders])
-        bus_to_stops[bus] = bus_parts
-
-    # for bus, parts in bus_to_stops.items():
-    #     # print(bus, "\n", parts, "\n")
-    #     print(bus)
-    # print()
+    bus_to_stops = {
+        bus: snapshot.get_parts(bus)
+        for bus in snapshot.get_buses_by_stops(start_objects)
+    }
 
     # 4 --------------------------------
     # Итерация, создание пар и анализ маршрутов.
@@ -180,16 +140,7 @@ def route_analysis(start_stop_name: str, finish_stop_name: str) -> List:
             filter_routes.pair_filter(make_route)
 
     # Получение готового списка маршрутов
-    found_routes = filter_routes.get_bus_list()
-
-    # Сохраняей вывод в файл
-    with open("log.tmp", "w", encoding="utf-8") as f:
-        for item in found_routes:
-            for k in item.items():
-                print(k, file=f)
-            print(file=f)
-
-    return found_routes
+    return filter_routes.get_bus_list()
 
 
 def answer_by_two_busstop(start_stop_name: str, finish_stop_name: str) -> Dict:
@@ -233,78 +184,59 @@ def answer_by_two_busstop(start_stop_name: str, finish_stop_name: str) -> Dict:
     #         print(route_info, "\n")
 
     # 6 --------------------------------
-    # Создаем словарь timestamp с расписанием.
-    # Реализовано без оптимизации для тестирования.
-    timestamp = {}
+    # Описания вариантов маршрута для пар (остановка отправления, автобус).
+    # Модификаторы зависят только от пары, поэтому вычисляются один раз на пару,
+    # а не для каждого отправления.
 
-    day = Holiday.is_today_holiday()
-    day = day if day else datetime.now().isoweekday()
-    time_now = date_now().time()
+    # Сколько одноименных остановок отправления у каждого автобуса,
+    # для модификатора "both"
+    stops_count = {}
+    for start_bus_stop, data in report.items():
+        for bus in data["buses"]:
+            key = (start_bus_stop.name, bus)
+            stops_count[key] = stops_count.get(key, 0) + 1
 
-    # Для остановки отправления и другой информации по маршруту:
-    # приоритет, автобусы с этой остановки, куда пребывает каждый,
-    # конечные для каждого
+    pairs = []  # Пары (остановка отправления, автобус)
+    entries = []  # Описания маршрута для пар
     for start_bus_stop, data in report.items():
-        # Для автобуса и информации по нему
         for bus, bus_data in data["buses"].items():
-            # Получаем расписание автобуса на остановке
-            # отсортированное по времени
-            schedules = Schedule.objects.filter(
-                bus_stop=start_bus_stop, bus=bus, day=day
-            ).order_by("time")
-
-            if not schedules:
-                continue
+            modifiers = []
+            if start_bus_stop.name != start_stop_name:
+                modifiers.append("start_deff")
+            if bus_data["finish"].name != finish_stop_name:
+                modifiers.append("finish_deff")
+
+            if data["priority"] == 2:
+                modifiers.append("final_stop_one")
+            if data["priority"] == 3:
+                modifiers.append("final_stop_two")
+
+            # Автобус отправляется и от другой одноименной остановки
+            if stops_count[(start_bus_stop.name, bus)] > 1:
+                modifiers.append("both")
+
+            pairs.append((start_bus_stop.id, bus.id))
+            entries.append({
+                "bus": bus,  # Автобус
+                "start": start_bus_stop,  # С какой остановки ехать
+                "finish": bus_data["finish"],  # На какой остановке выходить
+                "modifier": list(set(modifiers)),  # Модивикатор
+                "final_stop_start": bus_data["final_stop_start"],  # Конечные
+                "final_stop_finish": bus_data["final_stop_finish"],
+            })
 
-            # Вычисляем модификатор
-            for sch in schedules:
-                modifiers = []
-                if start_bus_stop.name != start_stop_name:
-                    modifiers.append("start_deff")
-                if bus_data["finish"].name != finish_stop_name:
-                    modifiers.append("finish_deff")
-
-                if data["priority"] == 2:
-                    modifiers.append("final_stop_one")
-                if data["priority"] == 3:
-                    modifiers.append("final_stop_two")
-
-                for other_start, other_data in report.items():
-                    if (
-                        start_bus_stop.name == other_start.name
-                        and start_bus_stop.id != other_start.id
-                    ):
-                        if bus in other_data["buses"]:
-                            modifiers.append("both")
-                            break
-
-                schedule_entry = {
-                    "bus": bus,  # Автобус
-                    "start": start_bus_stop,  # С какой остановки ехать
-                    "finish": bus_data["finish"],  # На какой остановке выходить
-                    "modifier": list(set(modifiers)),  # Модивикатор
-                    "final_stop_start": bus_data["final_stop_start"],  # Конечные
-                    "final_stop_finish": bus_data["final_stop_finish"],
-                }
-
-                # Добавляем новую временную метку с информацией по автобусу
-                if sch.time not in timestamp:
-                    timestamp[sch.time] = []
-                timestamp[sch.time].append(schedule_entry)
+    day = Holiday.is_today_holiday()
+    day = day if day else datetime.now().isoweekday()
+    time_now = date_now().time()
 
     # 7 --------------------------------
-    # Сортируем и фильтруем `timestamp` по времени.
-    if not timestamp:
-        return {}
-
-    # Сортируем по времени
-    timestamp = dict(sorted(timestamp.items(), key=lambda x: x[0]))
-
-    try:
-        gen = time_generator(list(timestamp.keys()), time_now, 1440)
-        timestamp = {time: timestamp[time] for time in gen}
-    except NameError:
-        pass
+    # Создаем словарь timestamp с расписанием.
+    # Отправления всех пар берутся из индекса отправлений и объединяются
+    # по времени, начиная с ближайшего (сутки по кругу).
+    # Описание маршрута пары общее для всех ее отправлений.
+    timestamp = {}
+    for minute, number in get_departure_index().merge_departures(pairs, day, to_minutes(time_now)):
+        timestamp.setdefault(MINUTE_TIMES[minute], []).append(entries[number])
 
     # 8 --------------------------------
     # Возвращаем словарь timestamp
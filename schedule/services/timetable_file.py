@@ -0,0 +1,158 @@
+"""
+Файл отправлений для нескольких процессов приложения.
+
+Импорт записывает расписание в двоичный файл (timetable.bin в корне проекта),
+процессы веб-сервера отображают его в память (mmap) только для чтения и читают
+через memoryview без копирования. Страницы файла общие для всех процессов,
+поэтому память не растет с их количеством, а процесс при старте не загружает
+расписание из БД.
+
+Файл привязан к версии данных (DataVersion) и к отпечатку снимка сети
+(NetworkSnapshot.version): процесс берет файл, только если оба совпадают с текущими,
+иначе индекс отправлений строится из БД. Номер версии сам по себе не отличает
+разные БД (копию, тестовую БД), отпечаток - отличает. Остановки и маршруты
+в файл не пишутся: снимок сети все равно загружается из БД.
+Файл заменяется целиком (os.replace), процессы со старым отображением
+дорабатывают со старым файлом.
+
+Формат (little-endian, каждый раздел выровнен на 8 байт):
+    заголовок HEADER: MAGIC, FORMAT_VERSION, версия данных, отпечаток снимка сети, размеры разделов
+    расписания: ключи (uint64, по возрастанию, см. departure_key), смещения (uint32, n + 1),
+                отправления (uint16, минуты от полуночи, как в Timetable.minutes)
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from schedule.models import Timetable
+from schedule.services.data_version import current_version
+from schedule.services.snapshot import NetworkSnapshot
+
+TIMETABLE_FILE = os.path.join(settings.BASE_DIR, 'timetable.bin')
+MAGIC = b'NBTTABLE'
+FORMAT_VERSION = 2
+# MAGIC, формат, версия данных, отпечаток снимка сети (md5), ключи, отправления
+HEADER = struct.Struct('<8sII16sII')
+
+
+def departure_key(stop_id: int, bus_id: int, day: int) -> int:
+    """Ключ расписания (остановка, автобус, день) одним числом, порядок ключей - как у кортежей."""
+    return (stop_id << 35) | (bus_id << 3) | day
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _column(typecode: str, values) -> bytes:
+    column = array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def save_timetable_file(path: str = None) -> int:
+    """
+    Записывает файл отправлений по данным БД.
+    Данные, номер версии и отпечаток снимка сети читаются в одной транзакции.
+
+    Returns:
+        Номер версии данных, для которой записан файл
+    """
+    path = path or TIMETABLE_FILE
+    with transaction.atomic():
+        version = current_version()
+        fingerprint = NetworkSnapshot.from_db().version
+        timetables = sorted(
+            (departure_key(stop_id, bus_id, day), bytes(minutes)) for stop_id, bus_id, day, minutes
+            in Timetable.objects.values_list('bus_stop_id', 'bus_id', 'day', 'minutes')
+        )
+    if max((key >> 35 for key, _ in timetables), default=0) >= 1 << 29:
+        raise ValueError('id остановки не помещается в ключ расписания')
+
+    key_offsets = [0]
+    for _, minutes in timetables:
+        key_offsets.append(key_offsets[-1] + len(minutes) // 2)
+
+    sections = [
+        _column('Q', [key for key, _ in timetables]),
+        _column('I', key_offsets),
+        b''.join(minutes for _, minutes in timetables),  # Уже little-endian uint16
+    ]
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, version, bytes.fromhex(fingerprint),
+                         len(timetables), key_offsets[-1])
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(header)
+        for section in sections:
+            file.write(b'\0' * (_align(file.tell()) - file.tell()))
+            file.write(section)
+    os.replace(tmp_path, path)
+    return version
+
+
+class TimetableFile:
+    """Файл отправлений, отображенный в память. Разделы - memoryview над отображением."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        magic, file_format, self.version, fingerprint, keys, minutes = HEADER.unpack_from(buffer)
+        if magic != MAGIC or file_format != FORMAT_VERSION:
+            raise ValueError(f'{path}: неизвестный формат файла отправлений')
+        self.fingerprint = fingerprint.hex()  # Отпечаток снимка сети, как NetworkSnapshot.version
+
+        offset = HEADER.size
+
+        def section(typecode: str, count: int) -> memoryview:
+            nonlocal offset
+            offset = _align(offset)
+            size = count * struct.calcsize(typecode)
+            if offset + size > len(buffer):
+                raise ValueError(f'{path}: файл отправлений обрезан')
+            view = buffer[offset:offset + size].cast(typecode)
+            offset += size
+            return view
+
+        self.keys = section('Q', keys)
+        self.key_offsets = section('I', keys + 1)
+        self.minutes = section('H', minutes)
+
+    @staticmethod
+    def _find(ids: memoryview, value: int) -> Optional[int]:
+        """Номер значения в отсортированном разделе или None."""
+        i = bisect_left(ids, value)
+        return i if i < len(ids) and ids[i] == value else None
+
+    def departures(self, stop_id: int, bus_id: int, day: int) -> memoryview:
+        """Отсортированные отправления (минуты от полуночи) автобуса с остановки в день недели."""
+        i = self._find(self.keys, departure_key(stop_id, bus_id, day))
+        if i is None:
+            return self.minutes[0:0]
+        return self.minutes[self.key_offsets[i]:self.key_offsets[i + 1]]
+
+
+def open_timetable_file(version: int, fingerprint: str, path: str = None) -> Optional[TimetableFile]:
+    """
+    Отображает файл отправлений в память, если он записан для версии данных version
+    и снимка сети с отпечатком fingerprint (NetworkSnapshot.version).
+    Возвращает None, если файла нет, он поврежден или записан для другой версии или другой БД.
+    """
+    if sys.byteorder != 'little':
+        return None  # Разделы читаются в порядке байтов процессора
+    try:
+        timetable = TimetableFile(path or TIMETABLE_FILE)
+    except (OSError, ValueError, struct.error):
+        return None
+    if timetable.version != version or timetable.fingerprint != fingerprint:
+        return None
+    return timetable
@@ -0,0 +1,114 @@
+# Сброс кешей в памяти процесса при изменении данных расписания
+import threading
+from typing import Iterable, Optional
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from schedule.models import Bus, BusStop, Order, Router, StopGroup, Timetable
+from schedule.services.data_version import in_bulk_changes, published_count, publish_data_version, register_cache
+from schedule.services.departures import invalidate_departure_index
+from schedule.services.full_schedule import build_stop_timetables, invalidate_full_schedule
+from schedule.services.route_table import invalidate_route_table
+from schedule.services.snapshot import invalidate_snapshot
+
+
+class PendingVersion:
+    """
+    Новая версия данных после правки в админке: записывается после фиксации
+    транзакции правки, одна на транзакцию. По ней остальные процессы сбрасывают кеши.
+    Вместе с ней перестраиваются сообщения полного расписания (StopTimetable)
+    затронутых остановок. Если в транзакции версию уже записал импорт, вторая не записывается.
+    """
+
+    def __init__(self):
+        self.published = published_count()
+        self.stop_ids = set()  # Остановки с измененным расписанием, None - изменена сеть маршрутов
+        self.done = False
+
+    def add_stops(self, stop_ids: Optional[Iterable[int]]):
+        """Добавляет остановки, сообщения которых нужно перестроить (None - все)."""
+        if stop_ids is None:
+            self.stop_ids = None
+        elif self.stop_ids is not None:
+            self.stop_ids.update(stop_ids)
+
+    def __call__(self):
+        self.done = True
+        if published_count() != self.published:
+            return
+        with transaction.atomic():
+            if self.stop_ids is None:
+                build_stop_timetables()
+            elif self.stop_ids:
+                build_stop_timetables(BusStop.objects.filter(id__in=self.stop_ids).values_list('name', flat=True))
+            publish_data_version()
+
+
+_pending = threading.local()  # PendingVersion текущей транзакции потока
+
+
+def data_changed(stop_ids: Optional[Iterable[int]] = ()):
+    """
+    Данные расписания изменены - после фиксации транзакции записывается новая версия.
+
+    Args:
+        stop_ids - остановки, сообщения полного расписания которых нужно перестроить (None - все)
+    """
+    pending = getattr(_pending, 'version', None)
+    connection = transaction.get_connection()
+    # После отката транзакции ее PendingVersion уже не вызовется - нужна новая
+    if pending is None or pending.done or not any(func is pending for _, func, *_ in connection.run_on_commit):
+        _pending.version = pending = PendingVersion()
+        pending.add_stops(stop_ids)
+        transaction.on_commit(pending)
+    else:
+        pending.add_stops(stop_ids)
+
+
+def network_changed(sender, **kwargs):
+    """Изменились данные сети маршрутов (правка в админке)."""
+    if in_bulk_changes():
+        return  # Импорт: кеши сбросит новая версия данных
+    invalidate_snapshot()
+    invalidate_full_schedule(rows_outdated=True)
+    data_changed(None)
+
+
+for model in (BusStop, Bus, Router, Order):
+    post_save.connect(network_changed, sender=model, dispatch_uid=f'network_changed_save_{model.__name__}')
+    post_delete.connect(network_changed, sender=model, dispatch_uid=f'network_changed_delete_{model.__name__}')
+
+
+def stop_groups_changed(sender, **kwargs):
+    """Изменились группы остановок."""
+    if in_bulk_changes():
+        return  # Импорт: кеши сбросит новая версия данных
+    StopGroup.invalidate_index()
+    invalidate_snapshot()
+    data_changed()
+
+
+post_save.connect(stop_groups_changed, sender=StopGroup, dispatch_uid='stop_groups_changed_save')
+post_delete.connect(stop_groups_changed, sender=StopGroup, dispatch_uid='stop_groups_changed_delete')
+
+
+def schedule_changed(sender, instance, **kwargs):
+    """Изменилось расписание (файл отправлений больше не соответствует БД)."""
+    if in_bulk_changes():
+        return  # Импорт: кеши сбросит новая версия данных
+    invalidate_departure_index(file_outdated=True)
+    invalidate_full_schedule(rows_outdated=True)
+    data_changed([instance.bus_stop_id])
+
+
+post_save.connect(schedule_changed, sender=Timetable, dispatch_uid='schedule_changed_save')
+post_delete.connect(schedule_changed, sender=Timetable, dispatch_uid='schedule_changed_delete')
+
+
+# Кеши, которые сбрасываются при смене версии данных (импорт в этом или другом процессе)
+register_cache(invalidate_snapshot)
+register_cache(invalidate_route_table)
+register_cache(invalidate_departure_index)
+register_cache(StopGroup.invalidate_index)
+register_cache(invalidate_full_schedule)
@@ -1,3 +1,531 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import tempfile
+from datetime import date, datetime, time
+from functools import cmp_to_key
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from schedule.models import Bus, BusStop, DataVersion, Order, Router, StopGroup, StopTimetable, Timetable
+from schedule.services import data_version, timetable_file
+from schedule.services.add_to_models import import_changed_buses, import_schedule_data, validate_schedule_data
+from schedule.services.departures import (DepartureIndex, MappedDepartureIndex, get_departure_index,
+                                         invalidate_departure_index)
+from schedule.services.full_schedule import (build_stop_timetables, full_schedule, get_full_schedule_chunks,
+                                             invalidate_full_schedule, render_full_schedule)
+from schedule.services.route_table import RouteTable
+from schedule.services.snapshot import get_snapshot, invalidate_snapshot
+from schedule.services.timestamp import analyze_routes, answer_by_two_busstop, route_analysis, time_generator
+from utils import schedule_file
+from utils.sorted_buses import sorted_buses
+
+try:
+    import hypothesis
+except ImportError:  # Пакет для разработки (dev-requirements.txt), нужен только тестам свойств
+    hypothesis = None
+
+
+def make_network():
+    """
+    Тестовая сеть: автобус Т1 ходит по кольцу из двух частей
+    А - Б - В - Г и Г - В - Б - А. Остановки Б и Бх входят в одну группу.
+    """
+    stops = {}
+    for i, name in enumerate(['Тест А', 'Тест Б', 'Тест В', 'Тест Г', 'Тест Бх']):
+        stops[name] = BusStop.objects.create(name=name, external_id=f'т{i}')
+    bus = Bus.objects.create(number='991')
+    parts = [
+        ['Тест А', 'Тест Б', 'Тест В', 'Тест Г'],
+        ['Тест Г', 'Тест В', 'Тест Бх', 'Тест А'],
+    ]
+    routers = []
+    for part in parts:
+        router = Router.objects.create(start=stops[part[0]], end=stops[part[-1]], bus=bus)
+        for name in part:
+            Order.objects.create(router=router, bus_stop=stops[name])
+        routers.append(router)
+    StopGroup.objects.create(list_name='["Тест Б", "Тест Бх"]')
+    return stops, bus, routers
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        self.stops, self.bus, self.routers = make_network()
+
+    def test_route_analysis_without_queries(self):
+        """После построения снимка анализ маршрутов не обращается к БД."""
+        get_snapshot()
+        with self.assertNumQueries(0):
+            routes = route_analysis('Тест А', 'Тест В')
+        self.assertEqual(len(routes), 1)
+        self.assertEqual(routes[0]['bus'], self.bus)
+        self.assertEqual(routes[0]['start'], self.stops['Тест А'])
+        self.assertEqual(routes[0]['finish'], self.stops['Тест В'])
+        self.assertEqual(routes[0]['priority'], 1)
+
+    def test_group_resolution(self):
+        """Группы остановок в снимке совпадают с группами из БД."""
+        self.assertEqual(
+            get_snapshot().get_group_by_stop_name('Тест Б', 'Тест Г'),
+            StopGroup.get_group_by_stop_name('Тест Б', 'Тест Г'),
+        )
+
+    def test_group_index_cached(self):
+        """Индекс групп строится один раз и сбрасывается при изменении групп."""
+        StopGroup.get_group_by_stop_name('Тест Б')
+        with self.assertNumQueries(0):
+            names = StopGroup.get_group_by_stop_name('Тест Б', 'Тест Г')
+        self.assertEqual(names['start_names'], ['Тест Б', 'Тест Бх'])
+        StopGroup.objects.create(list_name='["Тест Г", "Тест В"]')
+        names = StopGroup.get_group_by_stop_name('Тест Б', 'Тест Г')
+        self.assertEqual(names['finish_names'], ['Тест Г', 'Тест В'])
+
+    def test_snapshot_invalidated_on_change(self):
+        """Изменение данных сети приводит к построению нового снимка."""
+        snapshot = get_snapshot()
+        Order.objects.create(router=self.routers[0], bus_stop=self.stops['Тест Бх'])
+        self.assertIsNot(get_snapshot(), snapshot)
+        self.assertEqual(get_snapshot().get_parts(self.bus)[0][-1], self.stops['Тест Бх'])
+
+
+class RouteTableTest(TestCase):
+    def setUp(self):
+        make_network()
+
+    def test_table_matches_analysis(self):
+        """Маршруты из таблицы совпадают с результатом анализа, пара анализируется один раз."""
+        snapshot = get_snapshot()
+        table = RouteTable(snapshot.version)
+        analyzed = []
+
+        def analyze(start, finish):
+            analyzed.append((start, finish))
+            return analyze_routes(start, finish)
+
+        pairs = [('Тест А', 'Тест В'), ('Тест Г', 'Тест Бх'), ('Тест Б', 'Тест А')]
+        for _ in range(2):
+            for start, finish in pairs:
+                self.assertEqual(table.get(snapshot, start, finish, analyze), analyze_routes(start, finish))
+            for _ in range(2):
+                with self.assertRaises(ValueError):
+                    table.get(snapshot, 'Тест А', 'Нет такой', analyze)
+        self.assertEqual(analyzed, pairs + [('Тест А', 'Нет такой')])
+
+
+class AnswerTest(TestCase):
+    def setUp(self):
+        self.stops, self.bus, _ = make_network()
+        for day in range(1, 8):
+            Timetable.objects.create(day=day, minutes=Timetable.pack([360, 720, 1080]),
+                                     bus=self.bus, bus_stop=self.stops['Тест А'])
+
+    def test_answer_queries(self):
+        """Ответ по двум остановкам не запрашивает расписание по каждому автобусу."""
+        get_snapshot()
+        get_departure_index()
+        with self.assertNumQueries(1):  # Только проверка праздничного дня
+            timestamp = answer_by_two_busstop('Тест А', 'Тест В')
+        self.assertEqual(sorted(timestamp), [time(6, 0), time(12, 0), time(18, 0)])
+        for entries in timestamp.values():
+            self.assertEqual(len(entries), 1)
+            self.assertEqual(entries[0]['bus'], self.bus)
+            self.assertEqual(entries[0]['modifier'], [])
+
+    def test_query_plans(self):
+        """Запросы к расписанию и порядку остановок выполняются по индексам."""
+        invalidate_snapshot()
+        invalidate_departure_index(file_outdated=True)  # Индекс из БД, а не из файла отправлений
+        with CaptureQueriesContext(connection) as context:
+            answer_by_two_busstop('Тест А', 'Тест В')
+            full_schedule('Тест А', 1)
+        tables = ('"schedule_timetable"', '"schedule_order"')
+        checked = 0
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or not any(table in sql for table in tables):
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+                checked += 1
+                for detail in plan:
+                    if ' WHERE ' in sql and detail.startswith('SCAN schedule_'):
+                        self.fail(f'Полный просмотр таблицы: {detail}\n{sql}')
+                if '"schedule_order"' in sql and ' ORDER BY ' in sql:
+                    self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, sql)
+                if '"schedule_timetable"' in sql and ' WHERE ' in sql:
+                    self.assertTrue(any(d.startswith('SEARCH schedule_timetable USING') for d in plan), plan)
+        self.assertGreaterEqual(checked, 3)
+
+
+class ImportTest(TestCase):
+    def test_bulk_import(self):
+        """Пакетный импорт записывает те же данные, что и поочередное добавление."""
+        data = {
+            '991': {
+                'Тест А - Тест В': {
+                    'Тест А': {'id': 'и1', 'schedule': {'пн': ['06:00', '07:00'], 'вс': ['08:00']}},
+                    'Тест Б*': {'id': 'и2', 'schedule': {'пн': ['06:05']}},
+                    'Тест В': {'id': 'и3', 'schedule': {'пн': ['06:10']}},
+                },
+                '': {},
+            },
+        }
+        counts = import_schedule_data(data, verbose=False)
+        self.assertEqual(counts['timetable'], 3)
+
+        stops = {stop.external_id: stop for stop in BusStop.objects.filter(external_id__in=['и1', 'и2', 'и3'])}
+        self.assertEqual(stops['и2'].name, 'Тест Бкольцо')
+        self.assertEqual([stops[i].finish for i in ['и1', 'и2', 'и3']], [True, False, True])
+        self.assertLess(stops['и1'].id, stops['и3'].id)
+        self.assertLess(stops['и3'].id, stops['и2'].id)  # Конечные создаются раньше остальных
+
+        router = Router.objects.get(start=stops['и1'])
+        self.assertEqual(router.end, stops['и3'])
+        self.assertEqual(
+            list(Order.objects.filter(router=router).order_by('order_number').values_list('order_number', 'bus_stop')),
+            [(1, stops['и1'].id), (2, stops['и2'].id), (3, stops['и3'].id)],
+        )
+        self.assertEqual(set(router.bus.station.all()), {stops['и1'], stops['и3']})
+        self.assertIn(stops['и3'], stops['и2'].con_to.all())
+        self.assertIn(stops['и2'], stops['и3'].con_to.all())  # Связь симметричная, как при .add()
+        self.assertEqual(
+            sorted((timetable.day, timetable.bus_stop_id, timetable.get_times())
+                   for timetable in Timetable.objects.filter(bus=router.bus)),
+            [(1, stops['и1'].id, [time(6, 0), time(7, 0)]), (1, stops['и2'].id, [time(6, 5)]),
+             (7, stops['и1'].id, [time(8, 0)])],
+        )
+
+    def test_incremental_import(self):
+        """Повторный импорт записывает только изменившиеся автобусы."""
+        route = {
+            'Тест А': {'id': 'и1', 'schedule': {'пн': ['06:00', '07:00']}},
+            'Тест Б': {'id': 'и2', 'schedule': {'пн': ['06:05']}},
+            'Тест В': {'id': 'и3', 'schedule': {}},
+        }
+        data = {'991': {'Тест А - Тест В': route}, '992': {'Тест В - Тест А': dict(reversed(route.items()))}}
+        changed, removed, _, _ = import_changed_buses(data, verbose=False)
+        self.assertEqual(changed, ['991', '992'])
+        self.assertFalse(Bus.objects.exclude(number__in=['991', '992']).exists())  # Прочих автобусов нет в данных
+        bus = Bus.objects.get(number='991')
+
+        self.assertEqual(import_changed_buses(data, verbose=False), ([], [], {}, set()))
+
+        route['Тест А']['schedule']['пн'][1] = '07:30'
+        del data['992']
+        changed, removed, counts, stop_names = import_changed_buses(data, verbose=False)
+        self.assertEqual((changed, removed, counts['timetable']), (['991'], ['992'], 1))
+        self.assertEqual(stop_names, {'Тест А', 'Тест Б', 'Тест В'})
+        self.assertEqual(Bus.objects.get(number='991').id, bus.id)  # Автобус сохраняет id
+        self.assertEqual(
+            {timetable.bus_stop.external_id: timetable.get_times() for timetable in Timetable.objects.filter(bus=bus)},
+            {'и1': [time(6, 0), time(7, 30)], 'и2': [time(6, 5)]},
+        )
+        self.assertTrue(BusStop.objects.get(external_id='и3').finish)
+
+    def test_validation(self):
+        """Ошибочные данные отклоняются до изменения БД."""
+        stops = {
+            'Тест А': {'id': 'и1', 'schedule': {'пн': ['06:00'], 'xx': ['07:00']}},
+            'Тест Б': {'id': '', 'schedule': {}},
+            'Тест В': {'id': 'и3', 'schedule': {'вт': ['25:00']}},
+        }
+        errors = validate_schedule_data({'991': {'Тест А - Тест В': stops}})
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(validate_schedule_data({}), ['Нет ни одного автобуса.'])
+
+
+class TimetableFileTest(TestCase):
+    """Файл отправлений пишется по пути timetable_file.TIMETABLE_FILE,
+    на время тестов он во временной папке (nb.test_runner)."""
+
+    def setUp(self):
+        self.stops, self.bus, self.routers = make_network()
+        for day, minutes in ((1, [360, 1430]), (7, [5])):
+            Timetable.objects.create(day=day, minutes=Timetable.pack(minutes), bus=self.bus, bus_stop=self.stops['Тест Б'])
+        self.addCleanup(invalidate_departure_index)
+        self.addCleanup(invalidate_snapshot)
+        invalidate_snapshot()
+
+    def test_same_as_db(self):
+        """Из файла читаются те же отправления, что в БД."""
+        version = timetable_file.save_timetable_file()
+        fingerprint = get_snapshot().version
+        self.assertIsNone(timetable_file.open_timetable_file(version + 1, fingerprint))
+        mapped = timetable_file.open_timetable_file(version, fingerprint)
+        index = DepartureIndex.from_db()
+        for stop_id, bus_id, day in list(index.departures) + [(self.stops['Тест А'].id, self.bus.id, 1)]:
+            self.assertEqual(mapped.departures(stop_id, bus_id, day).tolist(), index.get(stop_id, bus_id, day).tolist())
+
+    def test_other_database(self):
+        """Файл другой БД с тем же номером версии данных не используется."""
+        version = timetable_file.save_timetable_file()
+        BusStop.objects.create(name='Тест Д', external_id='т5')  # Сеть уже не та, что в файле
+        invalidate_snapshot()
+        self.assertEqual(data_version.current_version(), version)
+        self.assertIsNone(timetable_file.open_timetable_file(version, get_snapshot().version))
+        invalidate_departure_index()
+        self.assertNotIsInstance(get_departure_index(), MappedDepartureIndex)
+
+    def test_index_from_file(self):
+        """Индекс берется из файла без загрузки расписания из БД, пока расписание не правилось.
+        После правки файл не используется, пока не записан файл новой версии."""
+        data_version.publish_data_version()  # Версия после правок в setUp, как после импорта
+        timetable_file.save_timetable_file()
+        invalidate_departure_index()
+        get_snapshot()
+        with self.assertNumQueries(1):  # Только номер версии данных, снимок сети уже в памяти
+            index = get_departure_index()
+        self.assertIsInstance(index, MappedDepartureIndex)
+        self.assertEqual(index.next_departures(self.stops['Тест Б'].id, self.bus.id, 1, 1400), [1430, 360])
+
+        Timetable.objects.filter(day=7).delete()
+        self.assertNotIsInstance(get_departure_index(), MappedDepartureIndex)
+        # Сброс кешей без смены версии не возвращает устаревший файл
+        invalidate_departure_index()
+        self.assertNotIsInstance(get_departure_index(), MappedDepartureIndex)
+        # Новая версия без своего файла - тоже из БД
+        data_version.publish_data_version()
+        invalidate_departure_index()
+        self.assertNotIsInstance(get_departure_index(), MappedDepartureIndex)
+
+        timetable_file.save_timetable_file()
+        invalidate_departure_index()
+        self.assertIsInstance(get_departure_index(), MappedDepartureIndex)
+
+
+class FullScheduleTest(TestCase):
+    def setUp(self):
+        self.stops, self.bus, _ = make_network()
+        Timetable.objects.create(day=1, minutes=Timetable.pack([360, 420]), bus=self.bus, bus_stop=self.stops['Тест Б'])
+
+    def test_chunks_prepared_at_import(self):
+        """Сообщения полного расписания берутся из таблицы, затем из памяти.
+        После правки расписания строятся заново."""
+        build_stop_timetables()
+        invalidate_full_schedule()
+        self.addCleanup(invalidate_full_schedule)
+        with self.assertNumQueries(1):
+            chunks = get_full_schedule_chunks('Тест Б', 1)
+        self.assertEqual(chunks, render_full_schedule('Тест Б', 1))
+        self.assertIn('*Тест А - Тест Г*\n06:00, 07:00', chunks[0])
+        with self.assertNumQueries(0):
+            get_full_schedule_chunks('Тест Б', 1)
+
+        Timetable.objects.filter(bus_stop=self.stops['Тест Б']).update(minutes=Timetable.pack([480]))
+        Timetable.objects.create(day=1, minutes=Timetable.pack([500]), bus=self.bus, bus_stop=self.stops['Тест В'])
+        self.assertIn('08:00', get_full_schedule_chunks('Тест Б', 1)[0])
+
+    def test_rebuild_changed_names(self):
+        """Инкрементальный импорт перестраивает сообщения только для переданных остановок."""
+        build_stop_timetables()
+        StopTimetable.objects.update(chunks=['старое'])
+        self.assertEqual(build_stop_timetables(['Тест Б', 'Нет такой']), 7)
+        self.assertEqual(StopTimetable.objects.get(name='Тест Б', day=1).chunks, render_full_schedule('Тест Б', 1))
+        self.assertEqual(StopTimetable.objects.get(name='Тест А', day=1).chunks, ['старое'])
+
+
+class DataVersionTest(TestCase):
+    def test_caches_invalidated_on_new_version(self):
+        """Новая версия данных сбрасывает кеши: в этом процессе - после фиксации,
+        в других - при проверке версии."""
+        calls = []
+        invalidate = data_version.register_cache(lambda: calls.append(1))
+        self.addCleanup(data_version._invalidators.remove, invalidate)
+        data_version.check_data_version(force=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            data_version.publish_data_version(rows=1)
+        self.assertEqual(len(calls), 1)
+
+        # Другой процесс замечает новую версию при следующей проверке
+        self.assertEqual(data_version.check_data_version(force=True), data_version.current_version())
+        self.assertEqual(len(calls), 2)
+        data_version.check_data_version(force=True)
+        self.assertEqual(len(calls), 2)
+
+    def test_admin_edit_publishes_version(self):
+        """Правка данных (админка) записывает одну версию после фиксации транзакции,
+        импорт, который сам записал версию, второй не получает."""
+        versions = DataVersion.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                stop = BusStop.objects.create(name='Тест А', external_id='т0')
+                stop.finish = True
+                stop.save()
+        self.assertEqual(DataVersion.objects.count(), versions + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                stop.delete()
+                data_version.publish_data_version(rows=1)
+        self.assertEqual(DataVersion.objects.count(), versions + 2)
+
+    def test_bulk_changes_mute_signals(self):
+        """При импорте удаление строк не сбрасывает кеши на каждую строку и не откладывает версию."""
+        stops, bus, _ = make_network()
+        Timetable.objects.create(day=1, minutes=Timetable.pack([360]), bus=bus, bus_stop=stops['Тест Б'])
+        with mock.patch('schedule.signals.invalidate_departure_index') as invalidate:
+            with self.captureOnCommitCallbacks() as callbacks:
+                with data_version.bulk_changes(), transaction.atomic():
+                    bus.delete()
+                self.assertFalse(data_version.in_bulk_changes())
+        invalidate.assert_not_called()
+        self.assertEqual(callbacks, [])
+
+    def test_admin_edit_rebuilds_stop_timetables(self):
+        """Правка расписания перестраивает сообщения полного расписания только своей остановки."""
+        with self.captureOnCommitCallbacks(execute=True):
+            stops, bus, _ = make_network()
+        StopTimetable.objects.update(chunks=['старое'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Timetable.objects.create(day=1, minutes=Timetable.pack([360]), bus=bus, bus_stop=stops['Тест Б'])
+        self.assertIn('06:00', StopTimetable.objects.get(name='Тест Б', day=1).chunks[0])
+        self.assertEqual(StopTimetable.objects.get(name='Тест А', day=1).chunks, ['старое'])
+
+
+class ScheduleFileTest(SimpleTestCase):
+    data = {
+        '991': {'Тест А - Тест В': {
+            'Тест А|000': {'id': 'и1', 'schedule': {'пн': ['06:00', '23:59'], 'вс': []}},
+            'Тест "В"|001': {'id': 'и3', 'schedule': {'пн': ['00:00']}},
+        }},
+        '1а': {},
+        '992': {'': {}},
+    }
+
+    def test_json_stream(self):
+        """Потоковое чтение и запись дают то же, что json.load и json.dump, при любом размере блока."""
+        text = json.dumps(self.data, ensure_ascii=False, indent=4)
+        output = io.StringIO()
+        schedule_file.write_json_object(output, self.data.items())
+        self.assertEqual(output.getvalue(), text)
+        for chunk_size in (1, 7, 4096):
+            self.assertEqual(list(schedule_file.iter_json_object(io.StringIO(text), chunk_size)),
+                             list(self.data.items()))
+        self.assertEqual(list(schedule_file.iter_json_object(io.StringIO(' {} '))), [])
+        with self.assertRaises(ValueError):
+            list(schedule_file.iter_json_object(io.StringIO(text[:-10]), 7))
+
+    @skipUnless(schedule_file.msgpack, 'Нет пакета msgpack')
+    def test_msgpack_round_trip(self):
+        """Двоичный файл читается в те же данные, что и JSON."""
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'result.msgpack')
+            schedule_file.write_buses(path, self.data.items())
+            self.assertEqual(list(schedule_file.iter_buses(path)), list(self.data.items()))
+        with self.assertRaises(ValueError):
+            schedule_file.to_minutes('6:00')
+
+
+class DepartureIndexTest(SimpleTestCase):
+    def setUp(self):
+        rows = [(1, 1, 3, time(h, m)) for h, m in [(23, 50), (6, 0), (12, 30), (0, 5)]]
+        rows += [(2, 1, 3, time(h, m)) for h, m in [(6, 0), (23, 55)]]
+        self.index = DepartureIndex(rows)
+
+    def test_next_departures(self):
+        """Ближайшие отправления с переходом через полночь."""
+        self.assertEqual(self.index.next_departures(1, 1, 3, 23 * 60), [1430, 5, 360, 750])
+        self.assertEqual(self.index.next_departures(1, 1, 3, 23 * 60, within=70), [1430, 5])
+        self.assertEqual(self.index.next_departures(1, 1, 3, 23 * 60, limit=1), [1430])
+        # Отправление в текущую минуту считается ушедшим, оно последнее в сутках
+        self.assertEqual(self.index.next_departures(1, 1, 3, 360), [750, 1430, 5, 360])
+        self.assertEqual(self.index.next_departures(1, 1, 4, 360), [])
+
+    def test_merge_departures(self):
+        """Слияние отправлений нескольких пар по времени."""
+        merged = list(self.index.merge_departures([(1, 1), (2, 1)], 3, 23 * 60, within=420))
+        self.assertEqual(merged, [(1430, 0), (1435, 1), (5, 0), (360, 0), (360, 1)])
+
+
+def legacy_time_generator(time_marks, start_time, duration):
+    """Прежняя реализация time_generator (линейный обход), эталон для сравнения."""
+
+    def dif_to_minutes(time1, time2):
+        datetime1 = datetime.combine(date.today(), time1)
+        datetime2 = datetime.combine(date.today(), time2)
+        difference = datetime1 - datetime2
+        return difference.total_seconds() / 60
+
+    if not time_marks:
+        return []
+    index = None
+    for mark in time_marks:
+        if mark >= start_time:
+            index = time_marks.index(mark)
+            break
+    index = 0 if index is None else index
+
+    counter = 0
+    midnight = datetime.strptime("23:59", "%H:%M").time()
+
+    while True:
+        if time_marks[index] > start_time:
+            counter += dif_to_minutes(time_marks[index], start_time)
+            start_time = time_marks[index]
+        else:
+            counter += dif_to_minutes(midnight, start_time) + 1
+            counter += time_marks[index].hour * 60 + time_marks[index].minute
+            start_time = time_marks[index]
+        index = (index + 1) % len(time_marks)
+        if counter > duration:
+            return
+        yield start_time
+
+
+class TimeGeneratorTest(SimpleTestCase):
+    @skipUnless(hypothesis, 'Нет пакета hypothesis')
+    def test_same_as_legacy(self):
+        """Окно по двоичному поиску совпадает с прежним генератором."""
+        from hypothesis import given, strategies as st
+
+        @given(
+            marks=st.sets(st.integers(0, 1439), max_size=60),
+            start=st.tuples(st.integers(0, 23), st.integers(0, 59), st.integers(0, 59), st.integers(0, 999999)),
+            duration=st.integers(1, 1440),
+        )
+        def check(marks, start, duration):
+            time_marks = [time(minute // 60, minute % 60) for minute in sorted(marks)]
+            start_time = time(*start)
+            # Прежний генератор обрывал сутки, если стартовое время точно совпадало с меткой
+            if start_time in time_marks:
+                start_time = start_time.replace(microsecond=1)
+            self.assertEqual(
+                list(time_generator(time_marks, start_time, duration)),
+                list(legacy_time_generator(time_marks, start_time, duration)),
+            )
+
+        check()
+
+
+def legacy_compare_name(a, b):
+    """Прежняя реализация compare_name (разбор при каждом сравнении), эталон для сравнения."""
+    name_a = re.findall(r'\d+|[^\d]+', a.split('_')[0])
+    name_b = re.findall(r'\d+|[^\d]+', b.split('_')[0])
+    num_a, num_b = int(name_a[0]), int(name_b[0])
+    alpha_a = name_a[1] if len(name_a) > 1 else ""
+    alpha_b = name_b[1] if len(name_b) > 1 else ""
+    if num_a != num_b:
+        return 1 if num_a > num_b else -1
+    if alpha_a != alpha_b:
+        return 1 if alpha_a > alpha_b else -1
+    return 0
+
+
+class BusSortTest(SimpleTestCase):
+    @skipUnless(hypothesis, 'Нет пакета hypothesis')
+    def test_same_as_legacy(self):
+        """Сортировка по ключу дает тот же порядок, что и прежнее сравнение."""
+        from hypothesis import given, strategies as st
+
+        @given(st.lists(st.from_regex(r'\A\d{1,3}[а-яa-z]{0,2}\d?(_[0-9a-f]{2})?\Z'), max_size=30))
+        def check(names):
+            self.assertEqual(sorted_buses(names), sorted(names, key=cmp_to_key(legacy_compare_name)))
+
+        check()
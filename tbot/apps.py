@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class TbotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tbot'
+
+    def ready(self):
+        # Подключение обработчиков сигналов
+        from tbot import signals  # noqa: F401
+
+        # Запросы к Bot API через общий пул соединений с ограничением частоты и повторами
+        from tbot.services.sender import install_sender
+        install_sender()
@@ -1,10 +1,51 @@
 """База данных телеграмм бота"""
 import json
-from django.db import models
-
-
-
-class BotUser(models.Model):
+import threading
+from typing import Dict, Iterable, Optional
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+
+from tbot.services.user_session import defer_flush
+
+
+class DeferredUpdateMixin:
+    """Накопление изменений записи и запись их одним UPDATE (см. tbot/services/user_session.py)."""
+
+    def _pending(self):
+        """Незаписанные изменения: (имена измененных полей, приращения счетчиков)."""
+        if '_pending_changes' not in self.__dict__:
+            self._pending_changes = (set(), {})
+        return self._pending_changes
+
+    def set_fields(self, **values):
+        """Меняет значения полей."""
+        fields, _ = self._pending()
+        for name, value in values.items():
+            setattr(self, name, value)
+            fields.add(name)
+        defer_flush(self)
+
+    def add_counts(self, **counts):
+        """Увеличивает счетчики. В БД - через F-выражения, без потери параллельных приращений."""
+        _, increments = self._pending()
+        for name, value in counts.items():
+            setattr(self, name, getattr(self, name) + value)
+            increments[name] = increments.get(name, 0) + value
+        defer_flush(self)
+
+    def flush(self):
+        """Записывает накопленные изменения одним UPDATE."""
+        fields, increments = self._pending()
+        values = {name: getattr(self, name) for name in fields}
+        values.update({name: F(name) + value for name, value in increments.items()})
+        fields.clear()
+        increments.clear()
+        if values:
+            type(self).objects.filter(pk=self.pk).update(**values)
+
+
+class BotUser(DeferredUpdateMixin, models.Model):
     """Пользователи приложения."""
     user_name = models.CharField(verbose_name='Имя', max_length=100, default='noname')
     user_login = models.CharField(verbose_name='Логин', max_length=100, default='noname')
@@ -30,7 +71,7 @@ class BotUser(models.Model):
         verbose_name_plural = 'Пользователи'
 
 
-class Parameter(models.Model):
+class Parameter(DeferredUpdateMixin, models.Model):
     """Параметры выполнения программ.
     Программы - это действия выполняющиеся в окне бота."""
     class_name = models.CharField(verbose_name='Класс (программа)', max_length=100)
@@ -49,8 +90,7 @@ class Parameter(models.Model):
         Принимает имя атрибута и значение."""
         addition = json.loads(self.addition)
         addition.update({name: value})
-        self.addition = json.dumps(addition)
-        self.save()
+        self.set_fields(addition=json.dumps(addition))
 
     def del_addition(self, name: str):
         """Удаляет указанный аттрибут.
@@ -58,8 +98,7 @@ class Parameter(models.Model):
         additions = json.loads(self.addition)
         if name in additions:
             del additions[name]
-            self.addition = json.dumps(additions)
-            self.save()
+            self.set_fields(addition=json.dumps(additions))
 
     def __str__(self):
         return str(f'{self.bot_user} - {self.class_name}')
@@ -78,9 +117,76 @@ class IdsForName(models.Model):
 
     name = models.CharField(verbose_name='Имя', max_length=200, unique=True)
 
+    # Кеш имен и идентификаторов в памяти процесса (в обе стороны).
+    # Загружается одним запросом при первом обращении, затем дополняется новыми именами.
+    # Сбрасывается сигналами post_save/post_delete (tbot/signals.py).
+    _ids = {}  # Имя -> идентификатор (строка)
+    _names = {}  # Идентификатор (строка) -> имя
+    _loaded = False
+    _cache_generation = 0  # Растет при каждом сбросе
+    _cache_lock = threading.Lock()
+
     def __str__(self):
         return str(f'{self.name}')
 
+    @classmethod
+    def _remember(cls, rows: Iterable, generation: int):
+        """Добавляет в кеш пары (id, имя), если кеш не сбрасывался с generation."""
+        with cls._cache_lock:
+            if generation != cls._cache_generation:
+                return
+            for id_name, name in rows:
+                cls._ids[name] = str(id_name)
+                cls._names[str(id_name)] = name
+
+    @classmethod
+    def load_cache(cls):
+        """Загружает все имена в кеш, если он еще не загружен."""
+        if cls._loaded:
+            return
+        generation = cls._cache_generation
+        cls._remember(cls.objects.values_list('id', 'name'), generation)
+        with cls._cache_lock:
+            if generation == cls._cache_generation:
+                cls._loaded = True
+
+    @classmethod
+    def invalidate_cache(cls):
+        """Сбрасывает кеш имен."""
+        with cls._cache_lock:
+            cls._cache_generation += 1
+            cls._ids, cls._names = {}, {}
+            cls._loaded = False
+
+    @classmethod
+    def get_ids_by_names(cls, names: Iterable[str]) -> Dict[str, str]:
+        """Возвращает идентификаторы для списка имен {имя: идентификатор}.
+        Отсутствующие в таблице имена добавляются одним запросом."""
+        cls.load_cache()
+        # Сброс кеша заменяет словарь новым: берем один и тот же словарь
+        # и для поиска отсутствующих имен, и для ответа
+        cache = cls._ids
+        names = list(dict.fromkeys(names))
+        missing = [name for name in names if name not in cache]
+        if missing:
+            generation = cls._cache_generation
+            try:
+                with transaction.atomic():
+                    created = cls.objects.bulk_create([cls(name=name) for name in missing])
+            except IntegrityError:
+                # Часть имен уже добавил другой процесс
+                cls.objects.bulk_create([cls(name=name) for name in missing], ignore_conflicts=True)
+                created = []
+            rows = [(row.id, row.name) for row in created]
+            if not rows or rows[0][0] is None:
+                # Идентификаторы не вернулись (конфликт или БД без RETURNING)
+                rows = list(cls.objects.filter(name__in=missing).values_list('id', 'name'))
+            cls._remember(rows, generation)
+            ids = {name: str(id_name) for id_name, name in rows}
+        else:
+            ids = {}
+        return {name: cache.get(name) or ids[name] for name in names}
+
     @staticmethod
     def get_id_by_name(name: str):
         """Возвращает идентификатор по имени.
@@ -88,23 +194,28 @@ class IdsForName(models.Model):
         Проверяет, если имени нет в таблице, то создает его. Возвращает его идентификатор.
         Если имя уже есть в таблице, то возвращает его идентификатор.
         """
-        id_name, created = IdsForName.objects.get_or_create(name=name)
-        return str(id_name.id)
+        return IdsForName.get_ids_by_names([name])[name]
 
     @staticmethod
-    def get_name_by_id(id: str):
+    def get_name_by_id(id: str) -> Optional[str]:
         """Возвращает имя по идентификатору.
         Принимает идентификатор.
         Проверяет, если идентификатора нет в таблице, то возвращает None.
         Если идентификатор есть в таблице, то возвращает его имя.
         """
-        try:
-            name = IdsForName.objects.get(id=id).name
-        except:
-            name = None
+        if not str(id).isdigit():
+            return None  # Идентификаторы временных клавиатур - не из таблицы
+        IdsForName.load_cache()
+        id = str(int(id))
+        name = IdsForName._names.get(id)
+        if name is None:
+            # Имя могло быть добавлено другим процессом
+            generation = IdsForName._cache_generation
+            rows = list(IdsForName.objects.filter(id=id).values_list('id', 'name'))
+            IdsForName._remember(rows, generation)
+            name = rows[0][1] if rows else None
         return name
 
-
     class Meta:
         verbose_name = 'Идентификатор для имени'
-        verbose_name_plural = 'Идентификаторы для имен'
\ No newline at end of file
+        verbose_name_plural = 'Идентификаторы для имен'
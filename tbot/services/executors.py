@@ -16,8 +16,8 @@ from schedule.models import BusStop, Holiday, StopGroup
 from schedule.services.timestamp import route_analysis, time_generator, preparing_bus_list, answer_by_two_busstop
 from utils.sorted_buses import sorted_buses
 from .functions import date_now, ChunkedTextBuilder
-from schedule.services.full_schedule import full_schedule
-from schedule.services.functions import format_bus_number
+from .stop_keyboards import STOP_KEYBOARD_ID, get_stop_keyboards
+from schedule.services.full_schedule import get_full_schedule_chunks
 
 logger = logging.getLogger('alisa')
 
@@ -44,10 +44,11 @@ class Executor:
         if type(bot_object) == types.Message:
             # Параметры зависящие от типа объекта
             self.kb_id, self.key_name = None, None  # Идентификатор и название клавиши
+            self.key_id = None  # Данные клавиши
             self.message = bot_object  # Объект сообщения
         else:
-            self.kb_id, self.key_name = bot_object.data.split('_')
-            self.key_name = IdsForName.get_name_by_id(self.key_name)  # Получаем имя по идентификатору
+            self.kb_id, self.key_id = bot_object.data.split('_')
+            self.key_name = IdsForName.get_name_by_id(self.key_id)  # Получаем имя по идентификатору
             self.message = bot_object.message  # Объект сообщения
         data = dict()
         if action is None:
@@ -60,8 +61,7 @@ class Executor:
         self.other_fields = data.get('other_fields', dict())  # Дополнительные поля
 
         # Получим название класса и запишем его в БД
-        user.parameter.class_name = self.__class__.__name__
-        user.parameter.save()
+        user.parameter.set_fields(class_name=self.__class__.__name__)
         self.answer = self.execute()  # Выполняем действие и получаем ответ что делали
 
         if self.answer:
@@ -79,8 +79,7 @@ class Executor:
             'kb_id': self.kb_wait,
             'other_fields': self.other_fields
         }
-        self.user.parameter.addition = json.dumps(data, ensure_ascii=False)
-        self.user.parameter.save()
+        self.user.parameter.set_fields(addition=json.dumps(data, ensure_ascii=False))
 
     def keyboard(self, message: str, names: (list, dict), row=1, replace=False, kd_id=None):
         """Создает InlineKeyboardMarkup клавиатуру из заданного списка.
@@ -109,9 +108,10 @@ class Executor:
         # Подготовка клавиатуры
         keyboard = types.InlineKeyboardMarkup(row_width=row)
         buttons = []
+        ids = IdsForName.get_ids_by_names(name_dict)  # Идентификаторы всех имен одним запросом
         for name, selected in name_dict.items():
             sel = '⚡️ ' if selected else ''
-            id_name = IdsForName.get_id_by_name(name)  # Получаем идентификатор по имени
+            id_name = ids[name]  # Идентификатор по имени
             button = types.InlineKeyboardButton(text=sel + name, callback_data=f'{kd_id}_{id_name}')
             buttons.append(button)
 
@@ -130,28 +130,43 @@ class Executor:
 class ExeAddBusStop(Executor):
     """Добавление остановки в Мои маршруты."""
 
+    def stop_keyboard(self, message: str) -> str:
+        """Отправляет клавиатуру выбора остановки (алфавит). Возвращает ее id.
+        Разметка готовится один раз для версии данных и одна для всех пользователей,
+        поэтому id у всех клавиатур выбора остановки общий - отвечать можно только
+        в последнем отправленном сообщении (его id запоминается)."""
+        sent = self.bot.send_message(self.message.chat.id, message, reply_markup=get_stop_keyboards().alphabet)
+        self.other_fields['kb_message_id'] = sent.message_id
+        return STOP_KEYBOARD_ID
+
     def execute(self):
         """Добавляет остановку в избранное."""
         answer = None
         if self.stage == 0:
             # ---------------- 1 этап - запрос остановки ----------------
-            # Составим список остановок без повторений, в алфавитном порядке
-            stops = BusStop.get_all_bus_stops_names()
-
             # Отправляем сообщение с клавиатурой и запоминаем ее id
-            self.kb_wait = [self.keyboard('🚩 🚩 🚩 Выберите остановку отправления:', stops, row=2)]
+            self.kb_wait = [self.stop_keyboard('🚩 🚩 🚩 Выберите остановку отправления:')]
             answer = f'{self.__class__.__name__} - {self.stage}'
 
         # Дальнейшие этапы выполняются при ответах от нужных клавиатур
         run = True if self.kb_id in self.kb_wait else False
+        if (run and self.kb_id == STOP_KEYBOARD_ID
+                and self.message.message_id != self.other_fields.get('kb_message_id')):
+            return None  # Нажатие в прежнем сообщении выбора остановки
+
+        if run and self.kb_id == STOP_KEYBOARD_ID and self.key_name is None:
+            # Переход по алфавиту или страницам - заменяем клавиатуру в сообщении, этап не меняется
+            markup = get_stop_keyboards().markup(self.key_id)
+            if markup is None:
+                return None
+            self.bot.edit_message_reply_markup(chat_id=self.message.chat.id, message_id=self.message.message_id,
+                                               reply_markup=markup)
+            return f'{self.__class__.__name__} - {self.stage}'
 
         if run and self.stage == 1:
             # ---------------- 2 этап - запрос направления ----------------
-            # Составим список остановок без повторений, в алфавитном порядке
-            for_kb = BusStop.get_all_bus_stops_names()
-
             # Отправляем сообщение с клавиатурой
-            self.kb_wait = [self.keyboard('🚩 🚩 🚩 Выберите остановку назначения:', for_kb, row=2)]
+            self.kb_wait = [self.stop_keyboard('🚩 🚩 🚩 Выберите остановку назначения:')]
             self.other_fields['start'] = self.key_name  # Сохраняем начальную остановку
             answer = f'{self.__class__.__name__} - {self.stage}'
 
@@ -240,8 +255,7 @@ class ExeAddBusStop(Executor):
             # Сохраняем маршрут в Избранное (favorites)
             save = json.loads(self.user.parameter.favorites)
             save[name] = {'start': self.other_fields['start'], 'finish': self.other_fields['finish']}
-            self.user.parameter.favorites = json.dumps(save, ensure_ascii=False)
-            self.user.parameter.save()
+            self.user.parameter.set_fields(favorites=json.dumps(save, ensure_ascii=False))
             answer = f'{self.__class__.__name__} - {self.stage}'
 
         self.stage += 1
@@ -287,9 +301,7 @@ class MyRouter(Executor):
         if self.stage == 1:
             # ---------------- 2 этап - вывод расписания ----------------
             # Засчитываем пользователю получение расписания
-            self.user.schedule_count += 1
-
-            self.user.save()
+            self.user.add_counts(schedule_count=1)
 
             week = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
             # Текущий день недели (1-7), если дата переопределена в таблице,
@@ -324,30 +336,8 @@ class MyRouter(Executor):
             # Значит выводим полное расписание остановки за выбранный день.
             if self.key_name in week:
                 mode = 'bus'  # По автобусам, для полного расписания
-                schedule = full_schedule(start, week.index(self.key_name) + 1)
-
-                spece = None
-                # Формируем заголовок сообщения. Он будет отправлен в самом начале.
-                buffer.add(f"*🚌 Все автобусы от {start} на период 24 часа ({self.key_name})*")
-
-                # Начинаем итерацию по расписанию автобусов.
-                for bus, routers_times in schedule.items():
-                    # Создаем строку для информации о текущем автобусе.
-                    bus_content = ""
-                    if spece != bus.number:
-                        spece = bus.number
-                        # Добавляем двойной перенос строки для визуального разделения информации о разных автобусах.
-                        bus_content += "\n\n"
-
-                    # Добавляем номер автобуса.
-                    bus_content += f"*🚌 №{format_bus_number(bus.number)}*"  # Буквы в кавычках
-                    # Добавляем информацию о маршрутах и времени.
-                    for routers, times in routers_times.items():
-                        bus_content += "\n" + ', '.join([f"*{router.start.name} - {router.end.name}*" for router in routers[:-1]])
-                        bus_content += "\n" + ', '.join([time.strftime("%H:%M") for time in times])
-                    buffer.add(bus_content)  # Накапливаем текст для вывода
-                # Вывод сообщения
-                for text in buffer.finalize():
+                # Сообщения готовятся при импорте расписания и кешируются
+                for text in get_full_schedule_chunks(start, week.index(self.key_name) + 1):
                     self.bot.send_message(self.message.chat.id, text, parse_mode='Markdown')
 
             # ----------------------------------------------------------
@@ -376,7 +366,7 @@ class MyRouter(Executor):
 
                 time_now = date_now().time()  # Получаем текущее время в нужном часовом поясе
                 # Перебираем полученные временные метки
-                gen = time_generator(list(schedule), time_now, delta[count])
+                gen = time_generator(sorted(schedule), time_now, delta[count])
                 rout = ""
                 if  f"{start} - {finish}" != key_name:
                     rout = f'("{start}" ⟶ "{finish}")\n'
@@ -393,7 +383,7 @@ class MyRouter(Executor):
 
                 text_list = buffer.finalize()
                 if not text_list:
-                    text_list = f'⚠️ Нет автобусов на период - *{count}*.'
+                    text_list = [f'⚠️ Нет автобусов на период - *{count}*.']
 
                 # Отправляем расписание
                 for text in text_list:
@@ -455,8 +445,7 @@ class MyRouterSetting(Executor):
         Принимает название маршрута и словарь с новыми данными."""
         favorites = json.loads(self.user.parameter.favorites)
         favorites[name] = value
-        self.user.parameter.favorites = json.dumps(favorites, ensure_ascii=False)
-        self.user.parameter.save()
+        self.user.parameter.set_fields(favorites=json.dumps(favorites, ensure_ascii=False))
 
     def execute(self):
         """Показывает короткое расписание автобусов на выбранном маршруте."""
@@ -521,8 +510,7 @@ class MyRouterSetting(Executor):
 
             self.other_fields['name_rout'] = self.message.text
             self.other_fields['favorites'] = new_favorites
-            self.user.parameter.favorites = json.dumps(new_favorites, ensure_ascii=False)
-            self.user.parameter.save()
+            self.user.parameter.set_fields(favorites=json.dumps(new_favorites, ensure_ascii=False))
 
             self.bot.send_message(self.message.chat.id, f'💾 Маршрут "{self.message.text}" сохранен.')
 
@@ -623,8 +611,7 @@ class MyRouterSetting(Executor):
 
             favorites = json.loads(self.user.parameter.favorites)
             del favorites[self.other_fields['name_rout']]
-            self.user.parameter.favorites = json.dumps(favorites, ensure_ascii=False)
-            self.user.parameter.save()
+            self.user.parameter.set_fields(favorites=json.dumps(favorites, ensure_ascii=False))
 
             self.bot.send_message(self.message.chat.id, f'❗️Маршрут "{self.other_fields["name_rout"]}" удален.')
 
@@ -20,7 +20,7 @@ def authorize(from_user) -> BotUser:
     Получает сообщение пользователя. Проверяет по id ТГ есть ли он в БД.
     Если нет - добавляет.
     Возвращает объект модели пользователей.
-    Обновляет время последнего входа пользователя и активен ли он.
+    Обновляет время последнего входа пользователя и счетчик действий.
     """
     if not from_user.is_bot:
         user_id = from_user.id
@@ -30,10 +30,9 @@ def authorize(from_user) -> BotUser:
             first_name = from_user.first_name if from_user.first_name else "NoName"
             username = from_user.username if from_user.username else "NoLogin"
             user = BotUser.objects.create(user_id=user_id, user_name=first_name, user_login=username)
-            user.save()
-        user.last_update = date_now()
-        user.action_count += 1
-        user.save()
+        # Записывается в конце обработки обновления (user_session)
+        user.set_fields(last_update=date_now())
+        user.add_counts(action_count=1)
         return user
 
     return None
@@ -86,8 +86,7 @@ def menu(bot, message, open_menu=None):
     # Если там None - значит кнопка не найдена, возможно просто введен текст.
     if isinstance(point_menu, str):
         # Запоминаем новое меню пользователя
-        user.user_menu = point_menu
-        user.save()
+        user.set_fields(user_menu=point_menu)
 
         # В списке количество словарей - это количество строк,
         # а количество ключей в словаре - это количество кнопок в строке.
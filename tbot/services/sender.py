@@ -0,0 +1,153 @@
+"""
+Отправка запросов к Bot API Телеграм.
+
+Подключается к telebot как apihelper.CUSTOM_REQUEST_SENDER (install_sender),
+через него идут запросы всех ботов процесса:
+- одна сессия requests с пулом постоянных (keep-alive) соединений на все потоки,
+  сообщения одного ответа (части полного расписания) уходят друг за другом
+  по уже открытому соединению;
+- частота сообщений ограничена корзинами токенов: общей на бота (GLOBAL_RATE в секунду)
+  и отдельной на каждый чат (CHAT_RATE в секунду, до CHAT_BURST сообщений подряд);
+- ответ 429 повторяется через время, указанное сервером (parameters.retry_after),
+  на это время задерживаются и остальные сообщения чата;
+- ответы 5xx повторяются с нарастающей паузой (или через заголовок Retry-After).
+Повторов не больше MAX_RETRIES, затем ответ возвращается telebot как есть
+(и он вызывает исключение ApiTelegramException).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+
+logger = logging.getLogger('TeleBot')
+
+GLOBAL_RATE = 30  # Сообщений в секунду на бота (ограничение Телеграм)
+CHAT_RATE = 1  # Сообщений в секунду в один чат
+CHAT_BURST = 5  # Сообщений подряд в один чат без ожидания
+CHAT_BUCKETS = 10000  # Сколько корзин чатов хранить (давно не писавшие вытесняются)
+POOL_SIZE = 16  # Постоянных соединений в пуле
+MAX_RETRIES = 3  # Повторов запроса при ответах 429 и 5xx
+MAX_RETRY_AFTER = 30  # Дольше (секунд) не ждем, ответ возвращается как есть
+RETRY_BACKOFF = 0.5  # Первая пауза перед повтором при ответе 5xx, секунд
+
+
+class TokenBucket:
+    """
+    Корзина токенов: rate токенов в секунду, не больше capacity в запасе.
+    Потоки получают токены в порядке обращения: токен можно занять вперед,
+    тогда поток ждет, пока он накопится.
+    """
+
+    def __init__(self, rate: float, capacity: float,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self.blocked_until = 0.0  # До этого времени токены не выдаются (ответ 429)
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Занимает токен. Возвращает, сколько секунд ждать до его использования."""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        """Занимает токен и ждет, пока его можно использовать."""
+        wait = self.reserve()
+        if wait > 0:
+            self.sleep(wait)
+
+    def hold(self, seconds: float):
+        """Не выдавать токены seconds секунд."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+
+
+class BotApiSender:
+    """Отправитель запросов с сигнатурой apihelper.CUSTOM_REQUEST_SENDER."""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: float = CHAT_BURST, pool_size: int = POOL_SIZE):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def chat_bucket(self, chat_id) -> TokenBucket:
+        """Корзина токенов чата."""
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+                if len(self._chat_buckets) > CHAT_BUCKETS:
+                    self._chat_buckets.popitem(last=False)
+            else:
+                self._chat_buckets.move_to_end(chat_id)
+            return bucket
+
+    @staticmethod
+    def retry_delay(response: requests.Response, attempt: int) -> Optional[float]:
+        """Через сколько секунд повторить запрос, None - не повторять."""
+        if response.status_code == 429:
+            try:
+                delay = response.json()['parameters']['retry_after']
+            except (ValueError, KeyError, TypeError):
+                delay = response.headers.get('Retry-After', 1)
+        elif 500 <= response.status_code < 600:
+            delay = response.headers.get('Retry-After', RETRY_BACKOFF * 2 ** attempt)
+        else:
+            return None
+        try:
+            delay = float(delay)
+        except ValueError:
+            return None
+        return delay if delay <= MAX_RETRY_AFTER else None
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None) -> requests.Response:
+        chat_id = params.get('chat_id') if params else None
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                # Ограничиваются только запросы в чат (сообщения, правка, удаление)
+                self.chat_bucket(chat_id).acquire()
+                self.global_bucket.acquire()
+            response = self.session.request(method, url, params=params, files=files,
+                                            timeout=timeout, proxies=proxies)
+            delay = self.retry_delay(response, attempt)
+            # Файлы уже прочитаны, такой запрос не повторяется
+            if delay is None or attempt >= MAX_RETRIES or files:
+                return response
+            attempt += 1
+            method_name = url.rsplit('/', 1)[-1]
+            logger.warning(f'Bot API {method_name}: ответ {response.status_code}, '
+                           f'повтор {attempt} через {delay} с')
+            if response.status_code == 429 and chat_id is not None:
+                # Ждут все сообщения чата, а не только этот запрос
+                self.chat_bucket(chat_id).hold(delay)
+            else:
+                time.sleep(delay)
+
+
+def install_sender(sender: BotApiSender = None) -> BotApiSender:
+    """Направляет запросы telebot через sender (по умолчанию - новый BotApiSender)."""
+    sender = sender or BotApiSender()
+    apihelper.CUSTOM_REQUEST_SENDER = sender
+    return sender
@@ -0,0 +1,145 @@
+"""
+Клавиатуры выбора остановки.
+
+Вместо одной клавиатуры со всеми остановками пользователь получает алфавит:
+кнопки групп букв (А–В, Г–Д, ...), а по нажатию - страницу с остановками
+группы и кнопками перехода. Соседние буквы объединяются в группу, пока
+в ней не больше PAGE_SIZE остановок; буква с большим числом остановок
+делится на несколько страниц. Все страницы идут подряд, кнопки ◀️ ▶️
+листают их по порядку.
+
+Разметка клавиатур одинакова для всех пользователей, она готовится один раз
+для версии данных расписания и хранится уже сериализованной в JSON
+(telebot передает строку в Bot API как есть). Кеш сбрасывается при смене
+версии данных и при изменении остановок (tbot/signals.py).
+
+Данные кнопок: f'{STOP_KEYBOARD_ID}_{ключ}', где ключ - идентификатор имени
+остановки (IdsForName), ALPHABET (алфавит) или f'p{номер страницы}'.
+"""
+import json
+import threading
+from typing import List, Optional, Tuple
+
+from telebot import types
+
+from schedule.models import BusStop
+from tbot.models import IdsForName
+
+STOP_KEYBOARD_ID = 'stops'  # id клавиатуры (не число - не из IdsForName, обрабатывает текущая программа)
+ALPHABET = 'a'  # Ключ кнопки возврата к алфавиту
+PAGE_SIZE = 16  # Остановок на странице
+ROW = 2  # Остановок в строке
+ALPHABET_ROW = 4  # Групп букв в строке
+
+
+def to_json(keyboard: types.InlineKeyboardMarkup) -> str:
+    """Разметка клавиатуры в JSON для Bot API (компактно, без экранирования кириллицы)."""
+    return json.dumps(keyboard.to_dict(), ensure_ascii=False, separators=(',', ':'))
+
+
+def page_key(number: int) -> str:
+    """Ключ кнопки перехода на страницу number."""
+    return f'p{number}'
+
+
+def split_pages(names: List[str], page_size: int = PAGE_SIZE) -> List[Tuple[str, List[str]]]:
+    """
+    Делит отсортированные названия остановок на страницы по первым буквам.
+
+    Returns:
+        [(подпись группы букв, названия на странице)] - страницы по порядку,
+        страницы одной группы идут подряд с одинаковой подписью
+    """
+    letters = {}
+    for name in names:
+        letters.setdefault(name[:1].upper(), []).append(name)
+
+    pages = []
+    group, group_names = [], []
+    for letter, letter_names in letters.items():
+        if group and len(group_names) + len(letter_names) > page_size:
+            pages.append((group, group_names))
+            group, group_names = [], []
+        group.append(letter)
+        group_names = group_names + letter_names
+    if group:
+        pages.append((group, group_names))
+
+    result = []
+    for group, group_names in pages:
+        label = group[0] if len(group) == 1 else f'{group[0]}–{group[-1]}'
+        for start in range(0, len(group_names), page_size):
+            result.append((label, group_names[start:start + page_size]))
+    return result
+
+
+class StopKeyboards:
+    """Готовая разметка клавиатур выбора остановки (JSON) для всех пользователей."""
+
+    def __init__(self, names: List[str], page_size: int = PAGE_SIZE):
+        ids = IdsForName.get_ids_by_names(names)
+        pages = split_pages(names, page_size)
+
+        # Алфавит: кнопка на первую страницу каждой группы букв
+        alphabet = types.InlineKeyboardMarkup(row_width=ALPHABET_ROW)
+        buttons = []
+        for number, (label, _) in enumerate(pages):
+            if number == 0 or pages[number - 1][0] != label:
+                buttons.append(types.InlineKeyboardButton(
+                    text=label, callback_data=f'{STOP_KEYBOARD_ID}_{page_key(number)}'))
+        alphabet.add(*buttons)
+        self.alphabet = to_json(alphabet)
+
+        self.pages = []
+        for number, (label, page_names) in enumerate(pages):
+            keyboard = types.InlineKeyboardMarkup(row_width=ROW)
+            keyboard.add(*[types.InlineKeyboardButton(text=name, callback_data=f'{STOP_KEYBOARD_ID}_{ids[name]}')
+                           for name in page_names])
+            navigation = []
+            if number > 0:
+                navigation.append(types.InlineKeyboardButton(
+                    text='◀️', callback_data=f'{STOP_KEYBOARD_ID}_{page_key(number - 1)}'))
+            navigation.append(types.InlineKeyboardButton(
+                text=f'🔤 {label}', callback_data=f'{STOP_KEYBOARD_ID}_{ALPHABET}'))
+            if number < len(pages) - 1:
+                navigation.append(types.InlineKeyboardButton(
+                    text='▶️', callback_data=f'{STOP_KEYBOARD_ID}_{page_key(number + 1)}'))
+            keyboard.row(*navigation)
+            self.pages.append(to_json(keyboard))
+
+    def markup(self, key: str) -> Optional[str]:
+        """Разметка по ключу кнопки: алфавит или страница. None - ключ не от перехода."""
+        if key == ALPHABET:
+            return self.alphabet
+        if key and key.startswith('p') and key[1:].isdigit():
+            # Страница могла исчезнуть после импорта - показываем последнюю
+            return self.pages[min(int(key[1:]), len(self.pages) - 1)] if self.pages else self.alphabet
+        return None
+
+
+# Кеш в памяти процесса
+_keyboards: Optional[StopKeyboards] = None
+_generation = 0  # Растет при каждом сбросе
+_lock = threading.Lock()
+
+
+def get_stop_keyboards() -> StopKeyboards:
+    """Клавиатуры выбора остановки. Готовятся при первом обращении после смены версии данных."""
+    global _keyboards
+    keyboards = _keyboards
+    if keyboards is None:
+        generation = _generation
+        keyboards = StopKeyboards(BusStop.get_all_bus_stops_names())
+        with _lock:
+            if generation == _generation:
+                # Остановки не менялись, пока готовились клавиатуры
+                _keyboards = keyboards
+    return keyboards
+
+
+def invalidate_stop_keyboards():
+    """Сбрасывает кеш клавиатур выбора остановки."""
+    global _keyboards, _generation
+    with _lock:
+        _generation += 1
+        _keyboards = None
@@ -0,0 +1,176 @@
+"""
+Очередь обновлений Телеграм для вебхука.
+
+Вебхук кладет обновление в очередь и сразу отвечает Телеграм, обработка
+(поиск маршрутов, отправка сообщений) идет в рабочих потоках процесса.
+Так медленный ответ пользователю не держит соединение вебхука, и Телеграм
+не повторяет обновления.
+
+Порядок обновлений одного чата сохраняется: у каждого потока своя очередь,
+чат всегда попадает в одну и ту же (по id чата). Очереди ограничены:
+если очередь потока заполнена, вебхук ждет место не дольше PUT_TIMEOUT секунд,
+затем отказывает (Телеграм повторит обновление позже).
+
+Глубина очередей и счетчики доступны в stats() (команда /stat для администраторов),
+при заполнении очереди на HIGH_WATER пишется предупреждение в лог.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+from django.db import close_old_connections
+
+logger = logging.getLogger('TeleBot')
+
+PUT_TIMEOUT = 1.0  # Сколько вебхук ждет места в заполненной очереди, секунд
+HIGH_WATER = 0.8  # Доля заполнения очереди, при которой пишется предупреждение
+
+
+def update_chat_id(update) -> Optional[int]:
+    """id чата, к которому относится обновление (для нажатия кнопки - чат сообщения с кнопкой).
+    None - если чата у обновления нет."""
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message:
+            return message.chat.id
+    call = update.callback_query
+    if call:
+        return call.message.chat.id if call.message else call.from_user.id
+    for name in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+                 'my_chat_member', 'chat_member', 'chat_join_request'):
+        event = getattr(update, name, None)
+        if event:
+            chat = getattr(event, 'chat', None)
+            return chat.id if chat else event.from_user.id
+    return None
+
+
+class UpdateQueue:
+    """
+    Рабочие потоки с ограниченными очередями обновлений.
+    Потоки запускаются при первом обновлении в каждом процессе
+    (после fork веб-сервера потоки родителя не наследуются).
+    """
+
+    def __init__(self, process: Callable[[object], None], workers: int = 4, size: int = 100):
+        """
+        Args:
+            process - обработчик одного обновления
+            workers - количество рабочих потоков
+            size - емкость очереди одного потока
+        """
+        self.process = process
+        self.workers = workers
+        self.size = size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queues = []
+        self._reset()
+
+    def _reset(self):
+        """Пустые очереди и счетчики."""
+        self._queues = [queue.Queue(maxsize=self.size) for _ in range(self.workers)]
+        self.accepted = 0  # Принято в очередь
+        self.rejected = 0  # Отказано (очередь заполнена)
+        self.processed = 0  # Обработано
+        self.failed = 0  # Обработано с ошибкой
+        self.max_depth = 0  # Наибольшая глубина очереди потока
+        self.max_wait = 0.0  # Наибольшее время ожидания обновления в очереди, секунд
+
+    def _start(self):
+        """Запускает рабочие потоки, если в этом процессе они еще не запущены."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self._reset()  # Процесс - копия (fork), очереди родителя в нем никто не обрабатывает
+            for number, updates in enumerate(self._queues):
+                threading.Thread(target=self._work, args=(updates,), name=f'tbot-updates-{number}',
+                                 daemon=True).start()
+            self._pid = os.getpid()
+
+    def put(self, update) -> bool:
+        """
+        Ставит обновление в очередь потока его чата.
+
+        Returns:
+            False - очередь заполнена и не освободилась за PUT_TIMEOUT
+        """
+        self._start()
+        chat_id = update_chat_id(update)
+        updates = self._queues[(update.update_id if chat_id is None else chat_id) % self.workers]
+        try:
+            updates.put((time.monotonic(), update), timeout=PUT_TIMEOUT)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logger.warning(f'Очередь обновлений заполнена, обновление {update.update_id} отклонено')
+            return False
+        depth = updates.qsize()
+        with self._lock:
+            self.accepted += 1
+            self.max_depth = max(self.max_depth, depth)
+        if depth == int(self.size * HIGH_WATER):
+            logger.warning(f'Очередь обновлений заполнена на {depth} из {self.size}')
+        return True
+
+    def _work(self, updates: queue.Queue):
+        """Рабочий поток: обрабатывает обновления своей очереди по порядку."""
+        while True:
+            item = updates.get()
+            if item is None:
+                updates.task_done()
+                return
+            queued, update = item
+            wait = time.monotonic() - queued
+            close_old_connections()
+            try:
+                self.process(update)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.error('---' * 10)
+                logger.error(f'Ошибка обработки обновления {update.update_id}: {e}')
+                logger.error(traceback.format_exc())
+            finally:
+                close_old_connections()
+                with self._lock:
+                    self.processed += 1
+                    self.max_wait = max(self.max_wait, wait)
+                updates.task_done()
+
+    def join(self):
+        """Ждет обработки всех обновлений, поставленных в очереди."""
+        for updates in self._queues:
+            updates.join()
+
+    def stop(self):
+        """Останавливает рабочие потоки после обработки поставленных обновлений."""
+        if self._pid != os.getpid():
+            return
+        for updates in self._queues:
+            updates.put(None)
+        self.join()
+        self._pid = None
+
+    def stats(self) -> dict:
+        """Глубина очередей и счетчики обновлений."""
+        depth = [updates.qsize() for updates in self._queues]
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'size': self.size,
+                'depth': depth,
+                'queued': sum(depth),
+                'max_depth': self.max_depth,
+                'max_wait': round(self.max_wait, 3),
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'processed': self.processed,
+                'failed': self.failed,
+            }
@@ -0,0 +1,58 @@
+"""
+Изменения пользователей бота за время обработки одного обновления.
+
+Обработка нажатия меняет пользователя несколько раз: счетчики действий
+и расписаний, меню, программу (class_name) и ее параметры, Избранное.
+Модели BotUser и Parameter копят эти изменения (set_fields, add_counts),
+а user_session записывает их в конце обработки обновления - не больше
+одного UPDATE на запись, счетчики через F-выражения.
+
+Вне user_session изменения записываются сразу.
+"""
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class UserSession:
+    """Объекты моделей с незаписанными изменениями."""
+
+    def __init__(self):
+        self.pending = {}  # id(объект) -> объект, в порядке первого изменения
+
+    def add(self, obj):
+        self.pending.setdefault(id(obj), obj)
+
+    def flush(self):
+        """Записывает изменения всех объектов."""
+        pending, self.pending = self.pending, {}
+        for obj in pending.values():
+            obj.flush()
+
+
+def current_session():
+    """Текущая сессия потока или None."""
+    return getattr(_local, 'session', None)
+
+
+def defer_flush(obj):
+    """Откладывает запись изменений obj до конца сессии (без сессии - записывает сразу)."""
+    session = current_session()
+    if session is None:
+        obj.flush()
+    else:
+        session.add(obj)
+
+
+@contextmanager
+def user_session():
+    """Сессия на время обработки обновления. Изменения записываются и при ошибке обработки."""
+    outer = current_session()
+    session = UserSession()
+    _local.session = session
+    try:
+        yield session
+    finally:
+        _local.session = outer
+        session.flush()
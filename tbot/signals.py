@@ -0,0 +1,30 @@
+# Сброс кешей бота в памяти процесса при изменении данных
+from django.db.models.signals import post_delete, post_save
+
+from schedule.models import BusStop
+from schedule.services.data_version import in_bulk_changes, register_cache
+from tbot.models import IdsForName
+from tbot.services.stop_keyboards import invalidate_stop_keyboards
+
+
+def ids_for_name_changed(sender, **kwargs):
+    """Изменение имен (админка) - сбрасываем кеш имен и идентификаторов."""
+    IdsForName.invalidate_cache()
+
+
+post_save.connect(ids_for_name_changed, sender=IdsForName, dispatch_uid='ids_for_name_changed_save')
+post_delete.connect(ids_for_name_changed, sender=IdsForName, dispatch_uid='ids_for_name_changed_delete')
+
+
+def bus_stops_changed(sender, **kwargs):
+    """Изменились остановки - клавиатуры выбора остановки готовятся заново."""
+    if in_bulk_changes():
+        return  # Импорт: кеш сбросит новая версия данных
+    invalidate_stop_keyboards()
+
+
+post_save.connect(bus_stops_changed, sender=BusStop, dispatch_uid='tbot_bus_stops_changed_save')
+post_delete.connect(bus_stops_changed, sender=BusStop, dispatch_uid='tbot_bus_stops_changed_delete')
+
+# Кеши, которые сбрасываются при смене версии данных расписания
+register_cache(invalidate_stop_keyboards)
@@ -1,3 +1,352 @@
-from django.test import TestCase
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import addModuleCleanup, mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import telebot
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from telebot import apihelper
+
+from schedule.models import BusStop
+from tbot.models import BotUser, IdsForName
+from tbot.services import update_queue
+from tbot.services.executors import ExeAddBusStop
+from tbot.services.functions import authorize
+from tbot.services.sender import BotApiSender, TokenBucket
+from tbot.services.stop_keyboards import (ALPHABET, STOP_KEYBOARD_ID, get_stop_keyboards,
+                                          invalidate_stop_keyboards, split_pages)
+from tbot.services.user_session import user_session
+from tbot.services.update_queue import UpdateQueue, update_chat_id
+
+
+def setUpModule():
+    """Сообщения бота в тестах не пишутся в telebot.log (обработчик из tbot/views.py) и в консоль."""
+    logger = logging.getLogger('TeleBot')
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        addModuleCleanup(logger.addHandler, handler)
+    null = logging.NullHandler()
+    logger.addHandler(null)
+    addModuleCleanup(logger.removeHandler, null)
+
+
+def make_update(update_id: int, chat_id: int, text: str = 'Избранное'):
+    """Обновление Телеграм с текстовым сообщением из чата chat_id."""
+    return telebot.types.Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'},
+            'text': text,
+        },
+    })
+
+
+class UpdateQueueTest(SimpleTestCase):
+    """Очередь обновлений вебхука."""
+
+    def test_chat_order(self):
+        """Обновления одного чата обрабатываются по порядку, ошибки не останавливают поток."""
+        handled = []
+
+        def process(update):
+            time.sleep(0.001)
+            if update.update_id == 7:
+                raise ValueError('Ошибка обработчика')
+            handled.append((update.message.chat.id, update.update_id))
+
+        updates = UpdateQueue(process, workers=3, size=100)
+        sent = [make_update(update_id, chat_id) for update_id in range(30) for chat_id in (1, 2, 5, -100)]
+        with self.assertLogs('TeleBot', 'ERROR'):
+            for update in sent:
+                self.assertEqual(update_chat_id(update), update.message.chat.id)
+                self.assertTrue(updates.put(update))
+            updates.stop()
+
+        for chat_id in (1, 2, 5, -100):
+            expected = [update_id for update_id in range(30) if update_id != 7]
+            self.assertEqual([update_id for chat, update_id in handled if chat == chat_id], expected)
+        stats = updates.stats()
+        self.assertEqual((stats['accepted'], stats['processed'], stats['failed']), (120, 120, 4))
+        self.assertEqual(stats['queued'], 0)
+
+    def test_back_pressure(self):
+        """Заполненная очередь отказывает в приеме, глубина видна в stats."""
+        started, release = threading.Event(), threading.Event()
+
+        def process(update):
+            started.set()
+            release.wait()
+
+        updates = UpdateQueue(process, workers=1, size=2)
+        timeout, update_queue.PUT_TIMEOUT = update_queue.PUT_TIMEOUT, 0.01
+        try:
+            results = [updates.put(make_update(0, 1))]
+            started.wait(1)
+            with self.assertLogs('TeleBot', 'WARNING') as logs:
+                results += [updates.put(make_update(update_id, 1)) for update_id in range(1, 4)]
+            stats = updates.stats()
+        finally:
+            update_queue.PUT_TIMEOUT = timeout
+            release.set()
+            updates.stop()
+
+        # Первое обновление взял поток, два ждут в очереди, четвертое не поместилось
+        self.assertEqual(results, [True, True, True, False])
+        self.assertEqual((stats['queued'], stats['max_depth'], stats['rejected']), (2, 2, 1))
+        self.assertIn('отклонено', logs.output[-1])
+
+
+class StubBotApi(BaseHTTPRequestHandler):
+    """Заглушка Bot API: sendMessage отвечает ошибками из списка errors, затем успехом."""
+    protocol_version = 'HTTP/1.1'  # Постоянные соединения
+    errors = []
+    requests = []
+
+    def do_POST(self):
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        self.requests.append((self.client_address[1], time.monotonic(), query.get('text')))
+        if self.errors:
+            status, body = self.errors.pop(0)
+        else:
+            status, body = 200, {'ok': True, 'result': {
+                'message_id': len(self.requests), 'date': 0, 'text': query.get('text'),
+                'chat': {'id': int(query['chat_id']), 'type': 'private'}}}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class BotApiSenderTest(SimpleTestCase):
+    """Отправка запросов к Bot API через пул соединений с ограничением частоты."""
+
+    def setUp(self):
+        StubBotApi.errors, StubBotApi.requests = [], []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubBotApi)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.saved = apihelper.API_URL, apihelper.CUSTOM_REQUEST_SENDER
+        apihelper.API_URL = f'http://127.0.0.1:{self.server.server_port}/bot{{0}}/{{1}}'
+        self.bot = telebot.TeleBot('1:test', threaded=False)
+
+    def tearDown(self):
+        apihelper.API_URL, apihelper.CUSTOM_REQUEST_SENDER = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_and_keep_alive(self):
+        """429 повторяется через retry_after, 5xx - с паузой, все запросы идут по одному соединению."""
+        StubBotApi.errors = [
+            (429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                   'parameters': {'retry_after': 1}}),
+            (502, {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}),
+        ]
+        apihelper.CUSTOM_REQUEST_SENDER = BotApiSender()
+        with self.assertLogs('TeleBot', 'WARNING'):
+            for number in range(3):
+                message = self.bot.send_message(5, f'Часть {number}')
+                self.assertEqual((message.chat.id, message.text), (5, f'Часть {number}'))
+
+        ports, times, texts = zip(*StubBotApi.requests)
+        self.assertEqual(texts, ('Часть 0', 'Часть 0', 'Часть 0', 'Часть 1', 'Часть 2'))
+        self.assertGreaterEqual(times[1] - times[0], 1)  # Ждали retry_after
+        self.assertEqual(len(set(ports)), 1)
+
+    def test_give_up(self):
+        """После MAX_RETRIES повторов ошибка передается telebot."""
+        StubBotApi.errors = [(500, {'ok': False, 'error_code': 500, 'description': 'Internal'})] * 10
+        sender = apihelper.CUSTOM_REQUEST_SENDER = BotApiSender()
+        sender.retry_delay = lambda response, attempt: 0  # Без пауз
+        with self.assertLogs('TeleBot', 'WARNING'), self.assertRaises(apihelper.ApiTelegramException):
+            self.bot.send_message(5, 'Текст')
+        self.assertEqual(len(StubBotApi.requests), 4)
+
+    def test_token_bucket(self):
+        """Корзина выдает запас сразу, дальше - с заданной частотой и после паузы 429."""
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=3, clock=lambda: now[0])
+        self.assertEqual([bucket.reserve() for _ in range(5)], [0, 0, 0, 0.5, 1.0])
+        now[0] = 10
+        bucket.hold(4)
+        self.assertEqual(bucket.reserve(), 4)
+
+
+class IdsForNameCacheTest(TestCase):
+    """Кеш имен и идентификаторов кнопок."""
+
+    def setUp(self):
+        IdsForName.invalidate_cache()
+        self.addCleanup(IdsForName.invalidate_cache)
+
+    def test_keyboard_queries(self):
+        """Клавиатура с новыми именами - один запрос, с известными - ни одного."""
+        IdsForName.objects.create(name='Избранное')
+        IdsForName.load_cache()
+        names = ['Избранное'] + [f'Тестовая остановка {number}' for number in range(300)]
+
+        with CaptureQueriesContext(connection) as queries:
+            ids = IdsForName.get_ids_by_names(names)
+        statements = [query['sql'] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(ids, {name: str(id_name) for id_name, name in IdsForName.objects.values_list('id', 'name')})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(IdsForName.get_ids_by_names(names[::-1]), ids)
+            self.assertEqual([IdsForName.get_name_by_id(ids[name]) for name in names], names)
+            self.assertIsNone(IdsForName.get_name_by_id('aB3xY9'))
+            self.assertIsNone(IdsForName.get_name_by_id(None))
+
+    def test_invalidate(self):
+        """Правка имени (админка) сбрасывает кеш, имя другого процесса находится по идентификатору."""
+        id_name = IdsForName.get_id_by_name('Мои маршруты')
+        row = IdsForName.objects.get(id=id_name)
+        row.name = 'Избранное'
+        row.save()
+        self.assertEqual(IdsForName.get_name_by_id(id_name), 'Избранное')
+
+        other = IdsForName.objects.bulk_create([IdsForName(name='Другой процесс')])[0]
+        self.assertEqual(IdsForName.get_name_by_id(str(other.id)), 'Другой процесс')
+
+    def test_invalidate_while_creating(self):
+        """Сброс кеша во время добавления новых имен не ломает ответ."""
+        known = IdsForName.get_id_by_name('Мои маршруты')
+        bulk_create = IdsForName.objects.bulk_create
+
+        def invalidate_and_create(*args, **kwargs):
+            IdsForName.invalidate_cache()
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(IdsForName.objects, 'bulk_create', side_effect=invalidate_and_create):
+            ids = IdsForName.get_ids_by_names(['Мои маршруты', 'Новое имя'])
+        self.assertEqual(ids['Мои маршруты'], known)
+        self.assertEqual(IdsForName.get_name_by_id(ids['Новое имя']), 'Новое имя')
+
+
+class UserSessionTest(TestCase):
+    """Запись изменений пользователя в конце обработки обновления."""
+
+    def test_single_write(self):
+        """Изменения за обновление - по одному UPDATE на запись, счетчики не теряют чужие приращения."""
+        from_user = telebot.types.User(id=987654321, is_bot=False, first_name='Тест')
+        authorize(from_user)  # Регистрация
+        user = BotUser.objects.get(user_id='987654321')
+        self.assertEqual(user.action_count, 1)
+
+        with self.assertNumQueries(4):  # 2 SELECT и 2 UPDATE
+            with user_session():
+                user = authorize(from_user)
+                user.parameter.set_fields(class_name='MyRouter')
+                user.parameter.set_addition('stage', 1)
+                user.set_fields(user_menu='Настройки')
+                user.add_counts(schedule_count=1)
+                user.add_counts(schedule_count=1)
+        user = BotUser.objects.select_related('parameter').get(pk=user.pk)
+        self.assertEqual((user.action_count, user.schedule_count, user.user_menu), (2, 2, 'Настройки'))
+        self.assertEqual((user.parameter.class_name, user.parameter.get_addition('stage')), ('MyRouter', 1))
+
+        with user_session():
+            user = authorize(from_user)
+            BotUser.objects.filter(pk=user.pk).update(action_count=F('action_count') + 5)  # Другой процесс
+        self.assertEqual(BotUser.objects.get(pk=user.pk).action_count, 8)
+
+
+class StopKeyboardsTest(TestCase):
+    """Клавиатуры выбора остановки по алфавиту и страницам."""
+
+    def setUp(self):
+        invalidate_stop_keyboards()
+        IdsForName.invalidate_cache()
+        self.addCleanup(invalidate_stop_keyboards)
+        self.addCleanup(IdsForName.invalidate_cache)
+
+    def test_split_pages(self):
+        """Соседние буквы объединяются, длинная буква делится на страницы."""
+        names = ['Аа', 'Аб', 'Ба', 'Ва', 'Вб', 'Вв', 'Вг', 'Вд', 'Га']
+        self.assertEqual(split_pages(names, page_size=3), [
+            ('А–Б', ['Аа', 'Аб', 'Ба']),
+            ('В', ['Ва', 'Вб', 'Вв']),
+            ('В', ['Вг', 'Вд']),
+            ('Г', ['Га']),
+        ])
+
+    def test_keyboards(self):
+        """Все остановки доступны со страниц, переходы ведут на соседние страницы, кеш до изменения остановок."""
+        names = BusStop.get_all_bus_stops_names()
+        keyboards = get_stop_keyboards()
+        with self.assertNumQueries(0):
+            self.assertIs(get_stop_keyboards(), keyboards)
+
+        shown = []
+        for number, page in enumerate(keyboards.pages):
+            self.assertEqual(keyboards.markup(f'p{number}'), page)
+            rows = json.loads(page)['inline_keyboard']
+            shown += [button['text'] for row in rows[:-1] for button in row]
+            navigation = [button['callback_data'] for button in rows[-1]]
+            self.assertIn(f'{STOP_KEYBOARD_ID}_{ALPHABET}', navigation)
+            self.assertEqual(f'{STOP_KEYBOARD_ID}_p{number + 1}' in navigation, number < len(keyboards.pages) - 1)
+            for row in rows:
+                for button in row:
+                    self.assertLessEqual(len(button['callback_data'].encode()), 64)
+        self.assertEqual(shown, names)
+        self.assertEqual(keyboards.markup(ALPHABET), keyboards.alphabet)
+        self.assertIsNone(keyboards.markup(IdsForName.get_id_by_name(names[0])))
+
+        # Правка остановки в админке
+        stop = BusStop.objects.first()
+        stop.name = 'Аааа тестовая'
+        stop.save()
+        self.assertIn('Аааа тестовая', get_stop_keyboards().pages[0])
+
+    def test_only_last_keyboard(self):
+        """После выбора остановки отправления нажатия в первой клавиатуре не принимаются."""
+        class Bot:
+            """Бот без Bot API: запоминает отправленные сообщения и замены клавиатур."""
+            def __init__(self):
+                self.sent, self.edited = [], []
+
+            def send_message(self, chat_id, text, **kwargs):
+                self.sent.append(text)
+                return telebot.types.Message.de_json({
+                    'message_id': len(self.sent), 'date': 0, 'text': text,
+                    'chat': {'id': chat_id, 'type': 'private'}})
+
+            def edit_message_reply_markup(self, **kwargs):
+                self.edited.append(kwargs['message_id'])
+
+        def tap(message_id, key):
+            return telebot.types.CallbackQuery.de_json({
+                'id': '1', 'chat_instance': '1', 'data': f'{STOP_KEYBOARD_ID}_{key}', 'from': sender,
+                'message': {'message_id': message_id, 'date': 0, 'chat': {'id': 55, 'type': 'private'}}})
+
+        sender = {'id': 55, 'is_bot': False, 'first_name': 'Тест'}
+        bot, user = Bot(), authorize(telebot.types.User.de_json(sender))
+        names = BusStop.get_all_bus_stops_names()
+        ids = IdsForName.get_ids_by_names(names)
+        message = telebot.types.Message.de_json({'message_id': 100, 'date': 0, 'text': 'Добавить',
+                                                 'chat': {'id': 55, 'type': 'private'}, 'from': sender})
+
+        ExeAddBusStop(bot, user, message, action=True)  # Клавиатура отправления - сообщение 1
+        ExeAddBusStop(bot, user, tap(1, ids[names[0]]))  # Клавиатура назначения - сообщение 2
+        self.assertEqual(len(bot.sent), 2)
+
+        ExeAddBusStop(bot, user, tap(1, 'p1'))
+        ExeAddBusStop(bot, user, tap(1, ids[names[1]]))
+        self.assertEqual((len(bot.sent), bot.edited), (2, []))
+        self.assertEqual(user.parameter.favorites, '{}')
+        self.assertEqual(json.loads(user.parameter.addition)['stage'], 2)
+
+        ExeAddBusStop(bot, user, tap(2, 'p1'))
+        self.assertEqual(bot.edited, [2])
@@ -12,6 +12,9 @@ from .models import BotUser, IdsForName
 from .services.menu import menu
 from .services.functions import authorize
 from .services.executors import ExeAddBusStop, MyRouter, MyRouterSetting
+from .services.update_queue import UpdateQueue
+from .services.user_session import user_session
+from schedule.services.data_version import check_data_version
 
 
 bot = telebot.TeleBot(settings.TOKEN, threaded=False)
@@ -30,13 +33,30 @@ fh.setFormatter(formatter)
 logger.addHandler(fh)
 
 
+def process_update(update):
+    """Обработка одного обновления. В рабочем потоке нет middleware,
+    поэтому версия данных расписания проверяется здесь.
+    Изменения пользователя записываются в БД один раз, в конце обработки."""
+    check_data_version()
+    with user_session():
+        bot.process_new_updates([update])
+
+
+updates = UpdateQueue(process_update, workers=settings.TELEGRAM_UPDATE_WORKERS,
+                      size=settings.TELEGRAM_UPDATE_QUEUE_SIZE)
+
+
 @csrf_exempt
 def telegram(request):
     # Эндпоинт для получения запросов от Телеграмм
     if request.META['CONTENT_TYPE'] == 'application/json':
         json_data = request.body.decode('utf-8')
         update = telebot.types.Update.de_json(json_data)
-        bot.process_new_updates([update])
+        if settings.TELEGRAM_UPDATE_WORKERS <= 0:
+            process_update(update)
+        elif not updates.put(update):
+            # Очередь заполнена - Телеграм повторит обновление позже
+            return HttpResponse('Busy', status=503)
 
         return HttpResponse('<h1>Hello!</h1>')
 
@@ -64,8 +84,7 @@ def handle_message(message):
         # Для ботов
         raise PermissionDenied
     # Работает исполнитель в классе ExeMessage
-    user.parameter.class_name = 'ExeMessage'
-    user.parameter.save()
+    user.parameter.set_fields(class_name='ExeMessage')
 
 
 @bot.message_handler(commands=['stat'])
@@ -91,6 +110,14 @@ def handle_message(message):
     bot.send_message(message.chat.id, f"Всего обработано запросов от всех пользователей: {action_count}\n"
                                      f"Всего показано расписаний для всех пользователей: {schedule_count}\n"
                                      f"Всего пользователей: {user_count}")
+    if settings.TELEGRAM_UPDATE_WORKERS > 0:
+        stats = updates.stats()
+        bot.send_message(message.chat.id, f"Очередь обновлений: {stats['queued']} "
+                                         f"(потоков {stats['workers']} по {stats['size']}, по потокам {stats['depth']})\n"
+                                         f"Наибольшая глубина: {stats['max_depth']}, "
+                                         f"наибольшее ожидание: {stats['max_wait']} с\n"
+                                         f"Принято: {stats['accepted']}, отклонено: {stats['rejected']}, "
+                                         f"обработано: {stats['processed']}, с ошибкой: {stats['failed']}")
 
 
 @bot.message_handler(commands=['help'])
@@ -0,0 +1,8 @@
+import hashlib
+import json
+
+
+def calculate_md5_from_dict(data: dict) -> str:
+    """Получение хэша md5 из словаря"""
+    json_str = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.md5(json_str.encode('utf-8')).hexdigest()
@@ -0,0 +1,195 @@
+"""
+Чтение и запись файла импорта расписания (result.json) по одному автобусу.
+
+Файл импорта - объект JSON {номер автобуса: маршруты} (формат описан
+в schedule/management/commands/import.py). Чтение и запись идут потоком:
+в памяти находятся только маршруты текущего автобуса.
+
+Кроме JSON поддерживается компактный двоичный формат (расширение .msgpack):
+последовательность объектов MessagePack, первый - заголовок [FORMAT, VERSION],
+затем [номер автобуса, маршруты] для каждого автобуса. Временные метки
+хранятся в минутах от полуночи. Файл в несколько раз меньше JSON
+и разбирается быстрее. Для него нужен пакет msgpack (pip install msgpack).
+"""
+import json
+import re
+from typing import Any, Iterable, Iterator, TextIO, Tuple
+
+try:
+    import msgpack
+except ImportError:  # Нужен только для формата .msgpack
+    msgpack = None
+
+FORMAT = 'nearest_bus_schedule'
+VERSION = 1
+CHUNK_SIZE = 1 << 16  # Размер блока чтения JSON, символов
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+# Строки времени для каждой минуты суток
+_minute_strings = tuple(f'{minute // 60:02d}:{minute % 60:02d}' for minute in range(24 * 60))
+
+
+def iter_json_object(file: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    """
+    Пары (ключ, значение) объекта JSON верхнего уровня, по одной.
+    В памяти находится только текущее значение и непрочитанный остаток буфера.
+
+    Raises:
+        json.JSONDecodeError - ошибка в файле
+    """
+    buffer = ''
+    position = 0
+    eof = False
+
+    def read() -> bool:
+        """Дочитывает файл в буфер (блоками растущего размера). False - файл кончился."""
+        nonlocal buffer, position, eof
+        if eof:
+            return False
+        chunk = file.read(max(chunk_size, len(buffer) - position))
+        buffer = buffer[position:] + chunk
+        position = 0
+        eof = not chunk
+        return not eof
+
+    def skip() -> str:
+        """Пропускает пробелы, возвращает следующий символ ('' - конец файла)."""
+        nonlocal position
+        while True:
+            position = _whitespace.match(buffer, position).end()
+            if position < len(buffer) or not read():
+                return buffer[position:position + 1]
+
+    def value() -> Any:
+        """Разбирает значение с текущей позиции, при необходимости дочитывая файл."""
+        nonlocal position
+        while True:
+            try:
+                result, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if read():
+                    continue
+                raise
+            # Число в конце буфера может продолжаться в следующем блоке
+            if end < len(buffer) or eof or not read():
+                position = end
+                return result
+
+    def expect(chars: str) -> str:
+        nonlocal position
+        char = skip()
+        if not char or char not in chars:
+            raise json.JSONDecodeError(f'Ожидается один из символов {chars!r}', buffer, position)
+        position += 1
+        return char
+
+    expect('{')
+    if skip() == '}':
+        return
+    while True:
+        if skip() != '"':
+            raise json.JSONDecodeError('Ожидается ключ', buffer, position)
+        key = value()
+        expect(':')
+        skip()
+        yield key, value()
+        if expect(',}') == '}':
+            return
+
+
+def write_json_object(file: TextIO, items: Iterable[Tuple[str, Any]]):
+    """
+    Запись пар (ключ, значение) как объекта JSON по одной паре.
+    Результат совпадает с json.dump(dict(items), file, ensure_ascii=False, indent=4).
+    """
+    file.write('{')
+    empty = True
+    for key, value in items:
+        file.write('\n' if empty else ',\n')
+        body = json.dumps(value, ensure_ascii=False, indent=4).replace('\n', '\n    ')
+        file.write(f'    {json.dumps(key, ensure_ascii=False)}: {body}')
+        empty = False
+    file.write('}' if empty else '\n}')
+
+
+def to_minutes(value: str) -> int:
+    """Время ЧЧ:ММ в минутах от полуночи. Запись должна восстанавливаться без изменений."""
+    minute = int(value[:-3]) * 60 + int(value[-2:])
+    if value[-3] != ':' or not 0 <= minute < len(_minute_strings) or _minute_strings[minute] != value:
+        raise ValueError(f'Время {value!r} не в формате ЧЧ:ММ')
+    return minute
+
+
+def pack_directions(directions: dict) -> dict:
+    """Маршруты автобуса для двоичного формата: время в минутах."""
+    return {
+        direction: {
+            name: {'id': stop['id'],
+                   'schedule': {day: [to_minutes(value) for value in times] for day, times in stop['schedule'].items()}}
+            for name, stop in stops.items()
+        }
+        for direction, stops in directions.items()
+    }
+
+
+def unpack_directions(directions: dict) -> dict:
+    """Маршруты автобуса из двоичного формата (обратно pack_directions)."""
+    return {
+        direction: {
+            name: {'id': stop['id'],
+                   'schedule': {day: [_minute_strings[minute] for minute in minutes]
+                                for day, minutes in stop['schedule'].items()}}
+            for name, stop in stops.items()
+        }
+        for direction, stops in directions.items()
+    }
+
+
+def _require_msgpack():
+    if msgpack is None:
+        raise ImportError('Для файлов .msgpack нужен пакет msgpack: pip install msgpack')
+
+
+def iter_buses(path: str) -> Iterator[Tuple[str, dict]]:
+    """
+    Автобусы из файла импорта по одному: (номер, маршруты).
+    Формат определяется по расширению файла (.msgpack или JSON).
+
+    Raises:
+        ValueError - ошибка в файле
+    """
+    if path.endswith('.msgpack'):
+        _require_msgpack()
+        with open(path, 'rb') as file:
+            unpacker = msgpack.Unpacker(file, raw=False)
+            if next(unpacker, None) != [FORMAT, VERSION]:
+                raise ValueError(f'{path}: неизвестный формат файла')
+            for number, directions in unpacker:
+                yield number, unpack_directions(directions)
+    else:
+        with open(path, 'r', encoding='utf-8') as file:
+            yield from iter_json_object(file)
+
+
+def write_buses(path: str, buses: Iterable[Tuple[str, dict]]):
+    """Запись автобусов (номер, маршруты) в файл импорта по одному.
+    Формат определяется по расширению файла (.msgpack или JSON)."""
+    if path.endswith('.msgpack'):
+        _require_msgpack()
+        with open(path, 'wb') as file:
+            packer = msgpack.Packer()
+            file.write(packer.pack([FORMAT, VERSION]))
+            for number, directions in buses:
+                file.write(packer.pack([number, pack_directions(directions)]))
+    else:
+        with open(path, 'w', encoding='utf-8') as file:
+            write_json_object(file, buses)
+
+
+if __name__ == '__main__':
+    # Перевод файла импорта в другой формат: python -m utils.schedule_file result.json result.msgpack
+    import sys
+
+    write_buses(sys.argv[2], iter_buses(sys.argv[1]))
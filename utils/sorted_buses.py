@@ -1,5 +1,20 @@
 import re
-from functools import cmp_to_key
+from functools import lru_cache
+
+_name_parts = re.compile(r'\d+|[^\d]+')
+
+
+@lru_cache(maxsize=4096)
+def bus_sort_key(name: str) -> tuple:
+    """
+    Ключ сортировки имени автобуса: (число, буквенная часть).
+    Учитывается часть имени до "_", буквенная часть - первая после числа.
+    Разбор выполняется один раз для каждого имени.
+    :param: name - имя автобуса, например 10а
+    :return: tuple - например (10, 'а')
+    """
+    parts = _name_parts.findall(name.split('_')[0])
+    return int(parts[0]), parts[1] if len(parts) > 1 else ""
 
 
 def compare_name(a: str, b: str) -> int:
@@ -9,34 +24,11 @@ def compare_name(a: str, b: str) -> int:
     :param: b - второй аргумент
     :return: int - 1 (первый больше), 0 (равны), -1 (первый меньше)
     """
-    # Извлекаем имена из строк
-    name_a = a.split('_')[0]
-    name_b = b.split('_')[0]
-
-    # Разделяем числовую и буквенную части
-    name_a = re.findall(r'\d+|[^\d]+', name_a)
-    name_b = re.findall(r'\d+|[^\d]+', name_b)
-
-    num_a = int(name_a[0])
-    num_b = int(name_b[0])
-
-    alpha_a = name_a[1] if len(name_a) > 1 else ""
-    alpha_b = name_b[1] if len(name_b) > 1 else ""
+    key_a = bus_sort_key(a)
+    key_b = bus_sort_key(b)
+    return (key_a > key_b) - (key_a < key_b)
 
-    # Сравниваем числовые части
-    if num_a > num_b:
-        return 1
-    elif num_a < num_b:
-        return -1
-    else:
-        # Если числовые части равны, сравниваем буквенные
-        if alpha_a > alpha_b:
-            return 1
-        elif alpha_a < alpha_b:
-            return -1
-        else:
-            return 0
 
 def sorted_buses(buses: list or set) -> list:
     """Сортировка списка автобусов как надо."""
-    return sorted(buses, key=cmp_to_key(compare_name))
+    return sorted(buses, key=bus_sort_key)